@@ -1,54 +1,288 @@
 import logging
 import os
-from time import sleep
+from time import sleep, monotonic
 from plexapi.server import PlexServer
 from datetime import datetime
 
 # other scripts import
 from utils.plexsyncplaylist import sync_playlists
+from utils.cacheplaylist import register_fanout_server
+from utils import metrics
+from utils import cachestore
+from utils import plexsession
+from utils import scheduler
+from utils import sharding
+from utils import tracing
 
 plex_url = os.getenv( "PLEX_URL" )
 plex_token = os.getenv( "PLEX_TOKEN" )
+plex_servers = [s.strip() for s in os.getenv( "PLEX_SERVERS", default="" ).split(',') if s.strip()]
 playlist_list = [p.strip() for p in os.environ['PLAYLIST_LIST'].split(',')]
 user_list = [u.strip() for u in os.environ['USER_LIST'].split(',')]
 sync_user_created_playlist = os.getenv( "SYNC_USER_CREATED_PLAYLIST", default=1 ) == "1"
 run_as_test = os.getenv( "RUN_AS_TEST", default=0 ) == "1"
+sync_mode = os.getenv( "SYNC_MODE", default="poll" ).strip().lower()
+profile_mode = os.getenv( "PROFILE", default="0" ).strip().lower()
+profile_directory = os.getenv( "PROFILE_DIRECTORY", default=os.path.join(cachestore.cache_directory, "profiles") )
 try:
     time_between_runs = float(os.getenv( "TIME_BETWEEN_RUNS", default=1 ))
 except ValueError:
     time_between_runs = 0
+try:
+    sync_concurrency = int(os.getenv( "SYNC_CONCURRENCY", default=1 ))
+except ValueError:
+    sync_concurrency = 1
+try:
+    event_debounce = float(os.getenv( "EVENT_DEBOUNCE", default=5 ))
+except ValueError:
+    event_debounce = 5
+try:
+    full_reconcile_interval = float(os.getenv( "FULL_RECONCILE_INTERVAL", default=3600 ))
+except ValueError:
+    full_reconcile_interval = 3600
+try:
+    min_sync_interval = float(os.getenv( "MIN_SYNC_INTERVAL", default=5 ))
+except ValueError:
+    min_sync_interval = 5
+try:
+    max_sync_interval = float(os.getenv( "MAX_SYNC_INTERVAL", default=600 ))
+except ValueError:
+    max_sync_interval = 600
+try:
+    plex_rate_limit = float(os.getenv( "PLEX_RATE_LIMIT", default=0 ))
+except ValueError:
+    plex_rate_limit = 0
+try:
+    plex_max_retries = int(os.getenv( "PLEX_MAX_RETRIES", default=3 ))
+except ValueError:
+    plex_max_retries = 3
+try:
+    circuit_breaker_threshold = int(os.getenv( "CIRCUIT_BREAKER_THRESHOLD", default=5 ))
+except ValueError:
+    circuit_breaker_threshold = 5
+try:
+    circuit_breaker_cooldown = float(os.getenv( "CIRCUIT_BREAKER_COOLDOWN", default=30 ))
+except ValueError:
+    circuit_breaker_cooldown = 30
+try:
+    metrics_port = int(os.getenv( "METRICS_PORT", default=0 ))
+except ValueError:
+    metrics_port = 0
+try:
+    user_token_ttl = float(os.getenv( "USER_TOKEN_TTL", default=3600 ))
+except ValueError:
+    user_token_ttl = 3600
+try:
+    user_directory_ttl = float(os.getenv( "USER_DIRECTORY_TTL", default=3600 ))
+except ValueError:
+    user_directory_ttl = 3600
+
+# plex server objects of PLEX_SERVERS, made again with every connect_plex
+fanout_servers = []
 
 logging.basicConfig(level=logging.INFO)
 
-if __name__ == "__main__":
-    while True:
+
+def new_plex_session():
+    """Builds the requests session of one plex server with the request limits from the environment.
+
+    Returns:
+        obj: requests session
+    """
+    return metrics.instrumented_session(
+        plexsession.new_session(
+            pool_size=max(10, sync_concurrency),
+            rate_limit=plex_rate_limit,
+            max_retries=plex_max_retries,
+            failure_threshold=circuit_breaker_threshold,
+            cooldown=circuit_breaker_cooldown,
+        )
+    )
+
+
+def connect_fanout_servers():
+    """Connects to every server in PLEX_SERVERS with the admin token, servers that cannot be reached are left out until the next connect."""
+    fanout_servers.clear()
+    for server_url in plex_servers:
+        try:
+            fanout_plex = PlexServer(server_url, plex_token, session=new_plex_session())
+            register_fanout_server(fanout_plex)
+            fanout_servers.append(fanout_plex)
+        except Exception as e:
+            logging.error(f"Failed to connect to {server_url}, playlists will not be synced to it. Error: {e}")
+
+
+def connect_plex():
+    """Connects to the plex server with the admin token and exits if the connection is not possible.
+    The connection and its session are reused by every run, user servers made with an earlier connection are forgotten.
+
+    Returns:
+        obj: plex server object
+    """
+    if plex_url and plex_token:
         try:
-            logging.info("Starting playlist sync")
-            if plex_url and plex_token:
-                try:
-                    plex = PlexServer(plex_url, plex_token)
-                except:
-                    logging.error("Plex authorization error")
-                    exit()
-            else:
-                logging.error("Missing Plex Authorization Variables")
-                exit()
-
-            sync_playlists(
+            plexsession.clear_user_servers()
+            plex = PlexServer(plex_url, plex_token, session=new_plex_session())
+            connect_fanout_servers()
+            return plex
+        except:
+            logging.error("Plex authorization error")
+            exit()
+    else:
+        logging.error("Missing Plex Authorization Variables")
+        exit()
+
+
+def run_sync(
+    plex,
+    changed_playlists=None,
+    due_units=None
+):
+    """Runs one sync of the playlists with the settings from the environment and copies the synced playlists to PLEX_SERVERS.
+
+    Args:
+        plex obj: plex server object
+        changed_playlists set: optional set of admin playlist rating keys to limit the run to, None syncs every playlist.
+        due_units set: optional set of (admin playlist rating key, username or None) to limit the run to, None syncs every pair.
+
+    Returns:
+        dict: (admin playlist rating key, username or None for the admin) to the result of the comparison, None when the plex server stopped answering.
+    """
+    start_time = monotonic()
+    if profile_mode not in ("", "0"):
+        tracing.start_cycle(profile=profile_mode == "cprofile")
+    try:
+        with tracing.profiled(), tracing.span("cycle"):
+            results = sync_playlists(
                 plex,
                 playlist_list,
                 user_list,
                 sync_user_created_playlist,
-                run_as_test
+                run_as_test,
+                sync_concurrency,
+                changed_playlists,
+                user_token_ttl,
+                user_directory_ttl,
+                due_units,
+                checkpoint=True
             )
-            if time_between_runs != 0:
-                print(f"Done. Running again in {time_between_runs} seconds.")
-            print("""
+            if fanout_servers:
+                from utils.multiserver import fan_out_playlists
+
+                fan_out_playlists(
+                    plex,
+                    fanout_servers,
+                    {playlist_key for playlist_key, _ in results},
+                    user_list,
+                    run_as_test,
+                    sync_concurrency,
+                    user_token_ttl,
+                    user_directory_ttl
+                )
+    except plexsession.CircuitOpenError as e:
+        tracing.finish_cycle(profile_directory)
+        logging.error(f"Sync stopped early. {e}")
+        sleep(e.retry_after)
+        return None
+    tracing.finish_cycle(profile_directory)
+    cycle_seconds = monotonic() - start_time
+    metrics.observe("cycle_seconds", cycle_seconds)
+    metrics.set_gauge("last_cycle_seconds", cycle_seconds)
+    print("""
     ======== end of run ========
-                """
-            )
-            sleep(time_between_runs)
-        except KeyboardInterrupt:
-            print("Script terminated by user.")
-            logging.info("Script terminated by user.")
-            exit()
\ No newline at end of file
+        """
+    )
+    return results
+
+
+def run_polling():
+    """Syncs every playlist and then waits TIME_BETWEEN_RUNS seconds before running again."""
+    plex = connect_plex()
+    while True:
+        logging.info("Starting playlist sync")
+        run_sync(plex)
+        if time_between_runs != 0:
+            print(f"Done. Running again in {time_between_runs} seconds.")
+        sleep(time_between_runs)
+
+
+def run_on_events():
+    """Syncs the playlists named in plex server notifications once they settle, with a full sync every FULL_RECONCILE_INTERVAL seconds."""
+    from utils.playlistevents import pop_changed_playlists
+    from utils.playlistevents import resolve_source_playlists
+    from utils.playlistevents import start_playlist_listener
+
+    plex = connect_plex()
+    listener = start_playlist_listener(plex)
+    last_full_sync = None
+    while True:
+        if not listener.is_alive():
+            logging.info("Playlist notifications disconnected, reconnecting...")
+            plex = connect_plex()
+            listener = start_playlist_listener(plex)
+            last_full_sync = None
+        if last_full_sync is None or monotonic() - last_full_sync >= full_reconcile_interval:
+            logging.info("Starting full playlist sync")
+            pop_changed_playlists(0)
+            if run_sync(plex) is not None:
+                last_full_sync = monotonic()
+        else:
+            changed_playlist_keys = pop_changed_playlists(event_debounce)
+            if changed_playlist_keys:
+                changed_playlists = resolve_source_playlists(plex, changed_playlist_keys)
+                if changed_playlists is None:
+                    if run_sync(plex) is not None:
+                        last_full_sync = monotonic()
+                else:
+                    logging.info(f"Starting playlist sync for playlists {', '.join(map(str, sorted(changed_playlists)))}")
+                    run_sync(plex, changed_playlists)
+        sleep(1)
+
+
+def run_adaptive():
+    """Syncs each playlist for each user when it is due, soon after a change and less often while it stays idle.
+    A full sync every FULL_RECONCILE_INTERVAL seconds finds new playlists and users.
+    """
+    plex = connect_plex()
+    last_full_sync = None
+    while True:
+        if last_full_sync is None or monotonic() - last_full_sync >= full_reconcile_interval:
+            logging.info("Starting full playlist sync")
+            results = run_sync(plex)
+            if results is None:
+                continue
+            scheduler.reschedule(results, min_sync_interval, max_sync_interval, full_run=True)
+            last_full_sync = monotonic()
+        else:
+            due_units = scheduler.pop_due_units()
+            if due_units:
+                logging.info(f"Starting playlist sync for {len(due_units)} due playlists")
+                results = run_sync(plex, due_units=due_units)
+                # units that failed to sync are backed off like idle ones
+                scheduler.reschedule(
+                    {**{unit: None for unit in due_units}, **(results or {})},
+                    min_sync_interval,
+                    max_sync_interval
+                )
+        wait = scheduler.seconds_until_due()
+        if wait is None:
+            wait = max_sync_interval
+        sleep(max(1, min(wait, full_reconcile_interval - (monotonic() - last_full_sync))))
+
+
+if __name__ == "__main__":
+    try:
+        if metrics_port:
+            metrics.start_metrics_server(metrics_port)
+        if sharding.worker_count > 1:
+            logging.info(f"Running as worker {sharding.worker_index} ({sharding.worker_index + 1} of {sharding.worker_count})")
+        if sync_mode == "events":
+            run_on_events()
+        elif sync_mode == "adaptive":
+            run_adaptive()
+        else:
+            run_polling()
+    except KeyboardInterrupt:
+        print("Script terminated by user.")
+        logging.info("Script terminated by user.")
+        exit()
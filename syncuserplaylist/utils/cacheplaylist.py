@@ -1,12 +1,34 @@
+import hashlib
 import logging
 import re
-import pandas as pd
-import pyarrow.feather as feather
-from datetime import datetime
-import os
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# other scripts import
+from . import cachestore
+from . import metrics
+from . import ratingkeys
+from . import sharding
+from . import trackindex
+from . import tracing
 
 logging.basicConfig(level=logging.INFO)
 
+# longest comma separated key list sent in one /library/metadata request to stay under url length limits
+MAX_METADATA_KEY_LENGTH = 1500
+# playlist items requested per page while a playlist is read, and tracks sent per request while one is created
+PLAYLIST_PAGE_SIZE = 1000
+# seconds an interrupted sync cycle can be resumed for, an older one is started over
+CHECKPOINT_MAX_AGE = 3600
+
+# machine identifiers of the servers playlists are fanned out to, their playlists are cached under "<machine identifier>:<rating key>"
+_fanout_servers = set()
+# one lock per playlist cache so users synced in parallel never read or write the same cache at once
+_cache_locks = {}
+_cache_locks_guard = threading.Lock()
+
 
 def sanitize_filename(filename):
     """converts a filename to a savable name.
@@ -19,6 +41,367 @@ def sanitize_filename(filename):
     """
     return re.sub(r'[<>:"/\\|?*]', '_', filename)
 
+def register_fanout_server(plex):
+    """Caches the playlists of a server that playlists are fanned out to apart from those of the main server.
+
+    Args:
+        plex obj: plex server object
+    """
+    _fanout_servers.add(plex.machineIdentifier)
+
+def cache_namespace(plex):
+    """Returns the prefix the playlists of a server are cached under.
+
+    Args:
+        plex obj: plex server object
+
+    Returns:
+        str: machine identifier of a fan out server, None for the main server.
+    """
+    machine_identifier = getattr(plex, "machineIdentifier", None)
+    return machine_identifier if machine_identifier in _fanout_servers else None
+
+def cache_lock(playlist_name):
+    """Returns the lock guarding the cache of a playlist within this process.
+
+    Args:
+        playlist_name str: name the playlist is cached under
+
+    Returns:
+        obj: a reentrant lock shared by every thread working on the playlist cache.
+    """
+    with _cache_locks_guard:
+        if playlist_name not in _cache_locks:
+            _cache_locks[playlist_name] = threading.RLock()
+        return _cache_locks[playlist_name]
+
+@contextmanager
+def lock_playlist_cache(playlist):
+    """Holds the lock of an admin playlist's cache while it or a copy of it is synced.
+    When more than one worker shares the cache a file lock is held as well.
+
+    Args:
+        playlist obj: admin playlist object from plexapi
+    """
+    playlist_name = sanitize_filename(playlist_cache_key(playlist))
+    with cache_lock(playlist_name):
+        if sharding.worker_count == 1:
+            yield
+            return
+        with cachestore.lock_playlist(playlist_name):
+            yield
+
+def playlist_cache_key(
+    playlist,
+    cache_key=None
+):
+    """Returns the name a playlist is cached under, the rating key of the admin playlist the copies are synced from.
+
+    Args:
+        playlist obj: playlist object from plexapi
+        cache_key int: optional rating key of the admin playlist when playlist is a user's copy
+
+    Returns:
+        str: the cache name of the playlist.
+    """
+    playlist_name = str(cache_key if cache_key is not None else playlist.ratingKey)
+    namespace = cache_namespace(getattr(playlist, "_server", None))
+    return playlist_name if namespace is None else f"{namespace}:{playlist_name}"
+
+def chunk_rating_keys(rating_keys):
+    """splits rating keys into comma separated groups that fit in a single metadata request url.
+
+    Args:
+        rating_keys list: list of track rating keys
+
+    Returns:
+        list: a list of lists of rating key strings.
+    """
+    chunks, chunk, chunk_length = [], [], 0
+    for rating_key in rating_keys:
+        rating_key = str(rating_key)
+        if chunk and chunk_length + len(rating_key) + 1 > MAX_METADATA_KEY_LENGTH:
+            chunks.append(chunk)
+            chunk, chunk_length = [], 0
+        chunk.append(rating_key)
+        chunk_length += len(rating_key) + 1
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def iter_track_pages(
+    plex,
+    rating_keys
+):
+    """Looks up tracks with batched /library/metadata/k1,k2,... requests, one page of tracks per request.
+
+    Args:
+        plex obj: plexserver endpoint
+        rating_keys list: list of track rating keys
+
+    Yields:
+        list: list of the plex api track objects found by one request, in the order of rating_keys.
+    """
+    unique_rating_keys = list(dict.fromkeys(int(rating_key) for rating_key in rating_keys))
+    for chunk in chunk_rating_keys(unique_rating_keys):
+        try:
+            tracks = plex.fetchItems(
+                f"/library/metadata/{','.join(chunk)}", container_size=len(chunk)
+            )
+        except Exception as e:
+            logging.error(f"Failed to look up {len(chunk)} cached tracks! Error: {e}")
+            continue
+        positions = {int(rating_key): position for position, rating_key in enumerate(chunk)}
+        yield sorted(
+            (track for track in tracks if track.type == "track"),
+            key=lambda track: positions.get(int(track.ratingKey), len(positions)),
+        )
+
+def iter_track_rating_keys(
+    plex,
+    rating_keys
+):
+    """Checks which tracks are on the server with the same batched requests as iter_track_pages, without building track objects.
+
+    Args:
+        plex obj: plexserver endpoint
+        rating_keys list: list of track rating keys
+
+    Yields:
+        int: rating key of every track found on the server.
+    """
+    unique_rating_keys = list(dict.fromkeys(int(rating_key) for rating_key in rating_keys))
+    for chunk in chunk_rating_keys(unique_rating_keys):
+        try:
+            data = plex.query(
+                f"/library/metadata/{','.join(chunk)}",
+                headers={"X-Plex-Container-Start": "0", "X-Plex-Container-Size": str(len(chunk))},
+            )
+        except Exception as e:
+            logging.error(f"Failed to look up {len(chunk)} cached tracks! Error: {e}")
+            continue
+        for element in data:
+            if element.attrib.get("type") == "track":
+                yield int(element.attrib["ratingKey"])
+
+@metrics.track_caller
+def fetch_tracks_by_rating_key(
+    plex,
+    rating_keys
+):
+    """Looks up all cached tracks with batched /library/metadata/k1,k2,... requests instead of one search per track.
+
+    Args:
+        plex obj: plexserver endpoint
+        rating_keys list: list of track rating keys from the cache
+
+    Returns:
+        dict: a dictionary of rating key to plex api track object for every track found on the server.
+    """
+    rating_keys = list(rating_keys)
+    track_map = {
+        int(track.ratingKey): track for tracks in iter_track_pages(plex, rating_keys) for track in tracks
+    }
+    logging.info(f"Resolved {len(track_map)} of {len(set(map(int, rating_keys)))} cached tracks")
+    return track_map
+
+@metrics.track_caller
+def resolve_cached_rating_keys(
+    plex,
+    playlist_caches
+):
+    """Finds the current rating key of the tracks of one or more cached playlists, matching tracks whose rating key changed to their new rating key.
+
+    Args:
+        plex obj: plexserver endpoint
+        playlist_caches list: list of playlists cache dictionaries
+
+    Returns:
+        dict: a dictionary of cached rating key to current rating key for every track found on the server.
+    """
+    cached_keys = {
+        int(cachedtrack["ratingKey"]): cachedtrack
+        for playlist_cache in playlist_caches
+        for cachedtrack in playlist_cache["items"]
+    }
+    key_map = {rating_key: rating_key for rating_key in iter_track_rating_keys(plex, cached_keys)}
+    logging.info(f"Resolved {len(key_map)} of {len(cached_keys)} cached tracks")
+    missing_items = [cachedtrack for rating_key, cachedtrack in cached_keys.items() if rating_key not in key_map]
+    if missing_items:
+        try:
+            remapped = trackindex.remap_rating_keys(plex, missing_items)
+        except Exception as e:
+            logging.error(f"Failed to match {len(missing_items)} missing cached tracks! Error: {e}")
+            remapped = {}
+        found_keys = set(iter_track_rating_keys(plex, remapped.values())) if remapped else set()
+        for old_rating_key, new_rating_key in remapped.items():
+            if new_rating_key in found_keys:
+                key_map[old_rating_key] = new_rating_key
+    return key_map
+
+def remapped_cached_rating_keys(
+    playlist_cache,
+    key_map
+):
+    """Returns the current rating keys of the tracks of a cached playlist that were found under a new rating key.
+
+    Args:
+        playlist_cache dict: playlists cache dictionary
+        key_map dict: dictionary of cached rating key to current rating key from resolve_cached_rating_keys
+
+    Returns:
+        set: set of track rating keys
+    """
+    return {
+        key_map[int(cachedtrack["ratingKey"])]
+        for cachedtrack in playlist_cache["items"]
+        if int(cachedtrack["ratingKey"]) in key_map
+        and key_map[int(cachedtrack["ratingKey"])] != int(cachedtrack["ratingKey"])
+    }
+
+def cached_rating_keys(
+    playlist_cache,
+    key_map
+):
+    """Returns the current rating keys of a cached playlist in cache order, skipping tracks no longer on the server.
+
+    Args:
+        playlist_cache dict: playlists cache dictionary
+        key_map dict: dictionary of cached rating key to current rating key
+
+    Returns:
+        list: list of track rating keys
+    """
+    return [
+        key_map[int(cachedtrack["ratingKey"])]
+        for cachedtrack in playlist_cache["items"]
+        if int(cachedtrack["ratingKey"]) in key_map
+    ]
+
+def iter_playlist_elements(playlist):
+    """Reads the items of a playlist PLAYLIST_PAGE_SIZE at a time as xml, so no plex api object is built for them.
+
+    Args:
+        playlist obj: playlist object from plexapi
+
+    Yields:
+        tuple: xml element of an item and the library section id of its page.
+    """
+    start = 0
+    while True:
+        data = playlist._server.query(
+            f"{playlist.key}/items",
+            headers={
+                "X-Plex-Container-Start": str(start),
+                "X-Plex-Container-Size": str(PLAYLIST_PAGE_SIZE),
+            },
+        )
+        elements = list(data)
+        for element in elements:
+            yield element, data.attrib.get("librarySectionID")
+        start += len(elements)
+        if len(elements) < PLAYLIST_PAGE_SIZE or start >= int(data.attrib.get("totalSize", start)):
+            break
+
+def iter_playlist_items(playlist):
+    """Reads the items of a playlist page by page as item dictionaries.
+
+    Args:
+        playlist obj: playlist object from plexapi
+
+    Yields:
+        dict: item dictionary of a track in the playlist, in playlist order.
+    """
+    for element, page_section_id in iter_playlist_elements(playlist):
+        attributes = element.attrib
+        is_track = attributes.get("type") == "track"
+        section_id = attributes.get("librarySectionID") or page_section_id
+        yield {
+            "title": attributes.get("title"),
+            "ratingKey": int(attributes["ratingKey"]),
+            "type": attributes.get("type"),
+            "librarySectionID": int(section_id) if section_id else None,
+            "artist": attributes.get("grandparentTitle") if is_track else None,
+            "grandparentRatingKey": int(attributes["grandparentRatingKey"])
+            if is_track and attributes.get("grandparentRatingKey")
+            else None,
+            "guid": attributes.get("guid"),
+            "album": attributes.get("parentTitle") if is_track else None,
+            "duration": int(attributes["duration"]) if attributes.get("duration") else None,
+        }
+
+def iter_playlist_rating_keys(playlist):
+    """Reads the rating keys of the items of a playlist page by page.
+
+    Args:
+        playlist obj: playlist object from plexapi
+
+    Yields:
+        int: rating key of each item, in playlist order.
+    """
+    for element, _ in iter_playlist_elements(playlist):
+        yield int(element.attrib["ratingKey"])
+
+def iter_playlist_track_pages(playlist):
+    """Reads the items of a playlist as plex api objects, PLAYLIST_PAGE_SIZE at a time.
+
+    Args:
+        playlist obj: playlist object from plexapi
+
+    Yields:
+        list: list of plex api track objects of one page, in playlist order.
+    """
+    start = 0
+    while True:
+        tracks = playlist.fetchItems(
+            f"{playlist.key}/items",
+            container_start=start,
+            container_size=PLAYLIST_PAGE_SIZE,
+            maxresults=PLAYLIST_PAGE_SIZE,
+        )
+        if tracks:
+            yield tracks
+        start += len(tracks)
+        if len(tracks) < PLAYLIST_PAGE_SIZE:
+            break
+
+def create_playlist_from_pages(
+    plex,
+    title,
+    track_pages
+):
+    """Creates a playlist from the first page of tracks and adds every later page with its own request, so no request url holds every track.
+
+    Args:
+        plex obj: plexserver endpoint the playlist is created on
+        title str: title of the new playlist
+        track_pages iterable: pages of plex api track objects in playlist order
+
+    Returns:
+        obj: the new plex playlist object, None when there were no tracks.
+    """
+    new_playlist = None
+    for tracks in track_pages:
+        if not tracks:
+            continue
+        if new_playlist is None:
+            new_playlist = plex.createPlaylist(title, items=tracks)
+        else:
+            new_playlist.addItems(tracks)
+    return new_playlist
+
+def summary_hash(summary):
+    """hashes a playlist summary so it can be compared without storing the text twice.
+
+    Args:
+        summary str: playlist summary text
+
+    Returns:
+        str: a hex digest of the summary.
+    """
+    return hashlib.sha1((summary or "").encode("utf-8")).hexdigest()
+
+@metrics.track_caller
 def extract_playlist_info(playlist):
     """searlizes information about each playlist object passed into the function.
 
@@ -34,96 +417,49 @@ def extract_playlist_info(playlist):
         "summary": playlist.summary,
         "playlistType": playlist.playlistType,
         "updatedAt": playlist.updatedAt.isoformat(),
-        "items": [],
+        "leafCount": playlist.leafCount,
+        "summaryHash": summary_hash(playlist.summary),
+        "items": list(iter_playlist_items(playlist)),
     }
-    for item in playlist.items():
-        item_info = {
-            "title": item.title,
-            "ratingKey": item.ratingKey,
-            "type": item.type,
-            "librarySectionID": item.librarySectionID,
-            "artist": item.artist().title if item.type == "track" else None,
-        }
-        playlist_info["items"].append(item_info)
     return playlist_info
 
 
 def save_playlist_to_cache(
     playlist_info,
-    playlist
+    playlist,
+    cache_key=None
 ):
-    """takes playlist dictonaries and plex api playlist objects and saves the information as feather files for metadata and items/
+    """takes playlist dictonaries and plex api playlist objects and saves the information in the cache database as the newest generation.
 
     Args:
         playlist_info dict: dictionary containing information about a playlist and a list of item dictionaries for the tracks in the playlist
         playlist obj: playlist object from plexapi
+        cache_key int: optional rating key of the admin playlist when playlist is a user's copy
+
+    Returns:
+        str: the cachedAt time of the saved cache or None if saving failed.
     """
     playlist_name = playlist.title
-    sanitized_playlist_name = sanitize_filename(playlist_name)
-    playlist_cache_filename = os.path.join(
-        cache_directory, f"{sanitized_playlist_name}_cache.feather"
-    )
-
-    playlist_cache_filename_items = f"{playlist_cache_filename}_items"
-    playlist_cache_filename_metadata = f"{playlist_cache_filename}_metadata"
-    old_playlist_cache_filename_items = f"{playlist_cache_filename}_items_old"
-    old_playlist_cache_filename_metadata = f"{playlist_cache_filename}_metadata_old"
 
     logging.info(f"saving cache for {playlist_name}...")
 
-    items_df = pd.DataFrame(playlist_info["items"])
     metadata = {
         "title": playlist_info["title"],
         "summary": playlist_info["summary"],
         "playlistType": playlist_info["playlistType"],
         "updatedAt": playlist_info["updatedAt"],
+        "leafCount": playlist_info["leafCount"],
+        "summaryHash": playlist_info["summaryHash"],
+        "cachedAt": datetime.now().isoformat(),
     }
-    metadata_df = pd.DataFrame([metadata])
-
-    try:
-        if os.path.exists(old_playlist_cache_filename_items):
-            logging.info("Removing old item cache file")
-            os.remove(old_playlist_cache_filename_items)
-
-        if os.path.exists(old_playlist_cache_filename_metadata):
-            logging.info("Removing old metadate cache file")
-            os.remove(old_playlist_cache_filename_metadata)
-
-    except Exception as e:
-        logging.error(f"The old playlist cache failed to be deleted! Error: {e}")
 
     try:
-        if os.path.exists(playlist_cache_filename_items):
-            logging.info("Copying old item cache file")
-            os.rename(playlist_cache_filename_items, old_playlist_cache_filename_items)
-
-        if os.path.exists(playlist_cache_filename_metadata):
-            logging.info("Copying old metadata cache file")
-            os.rename(
-                playlist_cache_filename_metadata, old_playlist_cache_filename_metadata
-            )
-
-    except Exception as e:
-        logging.error(f"The old playlist cache failed to be saved! Error: {e}")
-
-    try:
-
-        if not os.path.exists(old_playlist_cache_filename_items):
-            feather.write_feather(items_df, playlist_cache_filename_items)
-            os.rename(playlist_cache_filename_items, old_playlist_cache_filename_items)
-            feather.write_feather(items_df, playlist_cache_filename_items)
-        else:
-            feather.write_feather(items_df, playlist_cache_filename_items)
-
-        if not os.path.exists(old_playlist_cache_filename_metadata):
-            feather.write_feather(metadata_df, playlist_cache_filename_metadata)
-            os.rename(
-                playlist_cache_filename_metadata, old_playlist_cache_filename_metadata
-            )
-            feather.write_feather(metadata_df, playlist_cache_filename_metadata)
-        else:
-            feather.write_feather(metadata_df, playlist_cache_filename_metadata)
-
+        cachestore.save_playlist(
+            playlist_name=playlist_cache_key(playlist, cache_key),
+            metadata=metadata,
+            items=playlist_info["items"],
+        )
+        return metadata["cachedAt"]
     except Exception as e:
         logging.error(f"The playlist {playlist_name} failed to be saved! Error: {e}")
 
@@ -131,52 +467,199 @@ def save_playlist_to_cache(
 def load_playlist_from_cache(
     playlist,
     load_old,
-    is_test
+    is_test,
+    cache_key=None
 ):
-    """Takes seralized cached data from feather files and converts them into usable dictionaries
+    """Takes cached data from the cache database and converts it into usable dictionaries
 
     Args:
         playlist obj: plex api playlist object
         load_old bool: option to load the old playlists or not
         is_test bool: bool indicating whether to run as test
+        cache_key int: optional rating key of the admin playlist when playlist is a user's copy
 
     Returns:
         dict: combined dictionary of playlist information and playlist tracks
     """
     playlist_name = playlist.title
-    sanitized_playlist_name = sanitize_filename(playlist_name)
 
     if not is_test:
         try:
-            playlist_cache_filename = os.path.join(
-                cache_directory, f"{sanitized_playlist_name}_cache.feather"
+            playlist_info = cachestore.load_playlist(
+                playlist_name=playlist_cache_key(playlist, cache_key),
+                generation=cachestore.OLD_GENERATION if load_old else cachestore.CURRENT_GENERATION,
             )
-            if load_old:
-                items_df = feather.read_feather(playlist_cache_filename + "_items_old")
-                metadata_df = feather.read_feather(
-                    playlist_cache_filename + "_metadata_old"
-                )
-            else:
-                items_df = feather.read_feather(playlist_cache_filename + "_items")
-                metadata_df = feather.read_feather(
-                    playlist_cache_filename + "_metadata"
-                )
-
-            playlist_info = {
-                "title": metadata_df.loc[0, "title"],
-                "summary": metadata_df.loc[0, "summary"],
-                "playlistType": metadata_df.loc[0, "playlistType"],
-                "updatedAt": datetime.fromisoformat(metadata_df.loc[0, "updatedAt"]),
-                "items": items_df.to_dict(orient="records"),
-            }
+            if playlist_info is None:
+                logging.error(f"The playlist {playlist_name} failed to be loaded!")
+                return
+            playlist_info["updatedAt"] = datetime.fromisoformat(playlist_info["updatedAt"])
             return playlist_info
-        except FileNotFoundError:
-            logging.error(f"The playlist {playlist_name} failed to be loaded!")
         except Exception as e:
             logging.error(
                 f"An error occurred while loading the playlist {playlist_name} from cache! Error: {e}"
             )
 
+def playlist_fingerprint(playlist):
+    """Builds a fingerprint of a playlist from the fields that come back with the playlist listing.
+
+    Args:
+        playlist obj: plex api playlist object
+
+    Returns:
+        dict: dictionary with the playlist rating key, updatedAt, leafCount and summary hash.
+    """
+    return {
+        "playlistKey": int(playlist.ratingKey),
+        "updatedAt": playlist.updatedAt.isoformat(),
+        "leafCount": int(playlist.leafCount or 0),
+        "summaryHash": summary_hash(playlist.summary),
+    }
+
+def playlist_unchanged_since_sync(
+    playlist,
+    cache_key=None
+):
+    """Checks if a playlist and its cache are both unchanged since this copy of the playlist was last synced.
+
+    Args:
+        playlist obj: plex api playlist object
+        cache_key int: optional rating key of the admin playlist when playlist is a user's copy
+
+    Returns:
+        bool: True if the fingerprint and cache match what was recorded at the last sync.
+    """
+    try:
+        cached_at = cachestore.load_cached_at(playlist_cache_key(playlist, cache_key))
+        if cached_at is None:
+            return False
+        fingerprints = cachestore.load_fingerprints(playlist_cache_key(playlist, cache_key))
+    except Exception as e:
+        logging.error(
+            f"An error occurred while loading the fingerprints for {playlist.title}! Error: {e}"
+        )
+        return False
+    fingerprint = playlist_fingerprint(playlist)
+    fingerprint["cachedAt"] = cached_at
+    for recorded in fingerprints:
+        if recorded["playlistKey"] == fingerprint["playlistKey"]:
+            return recorded == fingerprint
+    return False
+
+def record_playlist_fingerprint(
+    playlist,
+    cached_at,
+    cache_key=None
+):
+    """Saves the fingerprint of a synced copy of a playlist along with the cache it was synced against.
+
+    Args:
+        playlist obj: plex api playlist object
+        cached_at str: cachedAt time of the cache the playlist was synced against
+        cache_key int: optional rating key of the admin playlist when playlist is a user's copy
+    """
+    if cached_at is None:
+        return
+    fingerprint = playlist_fingerprint(playlist)
+    fingerprint["cachedAt"] = cached_at
+    try:
+        cachestore.save_fingerprint(playlist_cache_key(playlist, cache_key), fingerprint)
+    except Exception as e:
+        logging.error(
+            f"The fingerprint for {playlist.title} failed to be saved! Error: {e}"
+        )
+
+def load_playlist_copy_key(
+    playlist,
+    user
+):
+    """Looks up the rating key of the copy of an admin playlist that was last synced to a user.
+
+    Args:
+        playlist obj: admin playlist object from plexapi
+        user obj: plex user object
+
+    Returns:
+        int: rating key of the user's copy or None if no copy is known.
+    """
+    try:
+        return cachestore.load_playlist_copy(playlist_cache_key(playlist), user.id)
+    except Exception as e:
+        logging.error(
+            f"An error occurred while loading the copies of {playlist.title}! Error: {e}"
+        )
+
+def record_playlist_copy(
+    playlist,
+    user,
+    user_playlist
+):
+    """Saves which playlist of a user is the copy of an admin playlist so it is found by rating key even after a rename.
+
+    Args:
+        playlist obj: admin playlist object from plexapi
+        user obj: plex user object
+        user_playlist obj: the user's copy of the playlist
+    """
+    try:
+        cachestore.save_playlist_copy(
+            playlist_cache_key(playlist), user.id, int(user_playlist.ratingKey)
+        )
+    except Exception as e:
+        logging.error(
+            f"The copy of {playlist.title} for {user.username or user.title} failed to be saved! Error: {e}"
+        )
+
+def start_sync_checkpoint():
+    """Resumes the sync cycle that was interrupted, for example by a restart, or starts a new one.
+
+    Returns:
+        tuple: sync cycle number and dictionary of (admin playlist rating key, username or None) to the result of every
+            playlist already synced in the cycle, (None, {}) when the checkpoint could not be read.
+    """
+    now = datetime.now()
+    try:
+        cycle = cachestore.start_sync_cycle(
+            now.isoformat(), (now - timedelta(seconds=CHECKPOINT_MAX_AGE)).isoformat(), sharding.worker_index
+        )
+        return cycle, cachestore.load_checkpoints(cycle)
+    except Exception as e:
+        logging.error(f"An error occurred while loading the sync checkpoint! Error: {e}")
+        return None, {}
+
+def record_sync_checkpoint(
+    cycle,
+    playlist_key,
+    username,
+    result
+):
+    """Records a synced playlist in the checkpoint of the sync cycle so it is not synced again if the cycle is resumed.
+
+    Args:
+        cycle int: sync cycle number from start_sync_checkpoint, nothing is recorded when None
+        playlist_key int: rating key of the admin playlist
+        username str: username of the user, None for the admin
+        result str: result of the sync, nothing is recorded when None
+    """
+    if cycle is None or result is None:
+        return
+    try:
+        cachestore.save_checkpoint(cycle, playlist_key, username, result)
+    except Exception as e:
+        logging.error(f"The sync checkpoint for {playlist_key} failed to be saved! Error: {e}")
+
+def finish_sync_checkpoint(cycle):
+    """Marks the sync cycle as finished so the next cycle starts from the beginning.
+
+    Args:
+        cycle int: sync cycle number from start_sync_checkpoint
+    """
+    if cycle is None:
+        return
+    try:
+        cachestore.finish_sync_cycle(cycle, datetime.now().isoformat())
+    except Exception as e:
+        logging.error(f"The sync checkpoint failed to be finished! Error: {e}")
+
 def update_playlist_summary(
     playlist_cache,
     target_playlist,
@@ -213,14 +696,183 @@ def update_playlist_summary(
     return target_playlist
 
 
+def diff_playlist_items(
+    cache_keys,
+    current_keys
+):
+    """Compares the cached tracks to a single snapshot of the target playlist by rating key.
+
+    Args:
+        cache_keys list: list of track rating keys from the cache
+        current_keys list: list of track rating keys currently in the target playlist
+
+    Returns:
+        tuple: list of rating keys to add and set of rating keys to remove from the target playlist.
+    """
+    keys_to_add = ratingkeys.keys_not_in(cache_keys, current_keys)
+    keys_to_remove = set(ratingkeys.keys_not_in(current_keys, cache_keys))
+    return keys_to_add, keys_to_remove
+
+@metrics.track_caller
+def apply_playlist_diff(
+    target_playlist,
+    tracks_to_add,
+    tracks_to_remove,
+    username
+):
+    """Applies the add and remove sets to the target playlist with batched addItems calls and one removeItems call.
+    The tracks are added in order in batches whose rating keys fit in a url, the batches after a failed one are not sent.
+
+    Args:
+        target_playlist obj: plex api playlist object
+        tracks_to_add list: list of plex api track objects to add
+        tracks_to_remove list: list of plex api track objects to remove
+        username obj: plex api username object
+
+    Returns:
+        int: number of add and remove operations applied to the playlist.
+    """
+    user_name = username.username or username.title
+    applied = 0
+    added = 0
+    for chunk in chunk_rating_keys([track.ratingKey for track in tracks_to_add]):
+        batch = tracks_to_add[added:added + len(chunk)]
+        try:
+            target_playlist.addItems(batch)
+        except:
+            print(
+                f"Failed to add {len(tracks_to_add) - added} tracks to '{user_name}' '{target_playlist.title}' playlist."
+            )
+            break
+        added += len(batch)
+        applied += len(batch)
+        for track in batch:
+            print(
+                f"Adding '{track.title}' by '{track.grandparentTitle}' to '{user_name}' '{target_playlist.title}' playlist."
+            )
+    if tracks_to_remove:
+        try:
+            target_playlist.removeItems(tracks_to_remove)
+            applied += len(tracks_to_remove)
+            for plextrack in tracks_to_remove:
+                print(
+                    f"Removing '{plextrack.title}' by '{plextrack.grandparentTitle}' from '{user_name}' '{target_playlist.title}' playlist."
+                )
+        except:
+            print(
+                f"Failed to remove {len(tracks_to_remove)} tracks from '{user_name}' '{target_playlist.title}' playlist."
+            )
+    print(f"Applied {applied} changes to '{user_name}' '{target_playlist.title}' playlist.")
+    return applied
+
+def longest_increasing_subsequence(sequence):
+    """Finds one longest strictly increasing subsequence in O(n log n).
+
+    Args:
+        sequence list: list of numbers
+
+    Returns:
+        set: set of the positions in sequence that make up the subsequence.
+    """
+    tails, tail_positions, previous = [], [], [None] * len(sequence)
+    for position, value in enumerate(sequence):
+        length = bisect_left(tails, value)
+        if length == len(tails):
+            tails.append(value)
+            tail_positions.append(position)
+        else:
+            tails[length] = value
+            tail_positions[length] = position
+        previous[position] = tail_positions[length - 1] if length else None
+    positions = set()
+    position = tail_positions[-1] if tail_positions else None
+    while position is not None:
+        positions.add(position)
+        position = previous[position]
+    return positions
+
+def plan_playlist_moves(
+    desired_keys,
+    current_keys
+):
+    """Works out the fewest moves that put the current tracks in the desired order.
+    Tracks in the longest run that is already in order stay where they are, every other track is moved after the track before it in the desired order.
+    Only the first occurrence of a rating key is ordered and tracks that are not in both lists are left alone.
+
+    Args:
+        desired_keys list: list of track rating keys in the desired order
+        current_keys list: list of track rating keys in the current order
+
+    Returns:
+        list: list of (rating key, rating key to move it after or None for the top) tuples in the order they have to be applied.
+    """
+    current_keys = list(dict.fromkeys(current_keys))
+    current_key_set = set(current_keys)
+    desired_keys = [key for key in dict.fromkeys(desired_keys) if key in current_key_set]
+    desired_index = {key: index for index, key in enumerate(desired_keys)}
+    current_keys = [key for key in current_keys if key in desired_index]
+    kept_keys = {
+        current_keys[position]
+        for position in longest_increasing_subsequence([desired_index[key] for key in current_keys])
+    }
+    return [
+        (key, desired_keys[index - 1] if index else None)
+        for index, key in enumerate(desired_keys)
+        if key not in kept_keys
+    ]
+
+def apply_playlist_order(
+    target_playlist,
+    cache_keys,
+    username
+):
+    """Moves the tracks of the target playlist into the cached order with the fewest moveItem calls.
+
+    Args:
+        target_playlist obj: plex api playlist object
+        cache_keys list: list of track rating keys from the cache in cache order
+        username obj: plex api username object
+
+    Returns:
+        int: number of tracks moved.
+    """
+    user_name = username.username or username.title
+    current_items = target_playlist.items()
+    current_tracks = {}
+    for track in current_items:
+        current_tracks.setdefault(track.ratingKey, track)
+    moves = plan_playlist_moves(
+        cache_keys,
+        [track.ratingKey for track in current_items],
+    )
+    moved = 0
+    for rating_key, after_rating_key in moves:
+        try:
+            target_playlist.moveItem(
+                current_tracks[rating_key],
+                after=current_tracks[after_rating_key] if after_rating_key is not None else None,
+            )
+            moved += 1
+        except:
+            print(
+                f"Failed to move '{current_tracks[rating_key].title}' in '{user_name}' '{target_playlist.title}' playlist."
+            )
+    if moves:
+        print(f"Moved {moved} tracks to match the order of '{user_name}' '{target_playlist.title}' playlist.")
+    return moved
+
 def update_plex_from_cache(
     plex,
     playlist_cache,
     target_playlist,
     username,
-    is_test
+    is_test,
+    key_map=None,
+    current_keys=None
 ):
-    """Updates plex playlist object from the cache by searching for the track by ID.
+    """Updates plex playlist object from the cache by looking up the cached tracks by ID.
+    Missing tracks are added, extra tracks removed and then the tracks are moved into the cached order.
+    The playlist is compared by rating key, track objects are only fetched for the tracks that are added or removed.
 
     Args:
         plex obj: plexserver endpoint
@@ -228,40 +880,45 @@ def update_plex_from_cache(
         target_playlist obj: plex api playlist object
         username obj: plex api username object
         is_test bool: bool indicating whether to run as test
+        key_map dict: optional dictionary of cached rating key to current rating key that was already resolved
+        current_keys list: optional list of the rating keys in the target playlist that were already read
 
     Returns:
         obj: updated plex playlist object with new tracks and with tracks that are no longer in updated playlist
     """
-    cache_tracklist = []
-
     if not is_test:
-        for cachedtrack in playlist_cache["items"]:
-            plex_track_obj = plex.library.sectionByID(
-                cachedtrack["librarySectionID"]
-            ).searchTracks(id=cachedtrack["ratingKey"])
-            for track in plex_track_obj:
-                cache_tracklist.append(track)
-                if track not in target_playlist.items():
-                    try:
-                        target_playlist.addItems(track)
-                        print(
-                            f"Adding '{track.title}' by '{track.artist().title}' to '{username.username or username.title}' '{target_playlist.title}' playlist."
-                        )
-                    except:
-                        print(
-                            f"Failed to add '{track.title}' by '{track.artist().title}'"
-                        )
-        for plextrack in target_playlist.items():
-            if plextrack not in cache_tracklist:
-                try:
-                    target_playlist.removeItems(plextrack)
-                    print(
-                        f"Removing '{plextrack.title}' by '{plextrack.artist().title}' from '{username.username or username.title}' '{target_playlist.title}' playlist."
-                    )
-                except:
-                    print(
-                        f"Failed to remove {plextrack.title}' by '{plextrack.artist().title}' from '{username.username or username.title}' '{target_playlist.title}' playlist."
-                    )
+        if key_map is None:
+            key_map = resolve_cached_rating_keys(plex, [playlist_cache])
+        cache_keys = cached_rating_keys(playlist_cache, key_map)
+        if current_keys is None:
+            current_keys = list(iter_playlist_rating_keys(target_playlist))
+        keys_to_add, keys_to_remove = diff_playlist_items(
+            cache_keys=cache_keys,
+            current_keys=current_keys,
+        )
+        track_map = fetch_tracks_by_rating_key(plex, keys_to_add) if keys_to_add else {}
+        tracks_to_add = [track_map[key] for key in keys_to_add if key in track_map]
+        tracks_to_remove = [
+            track for track in target_playlist.items() if track.ratingKey in keys_to_remove
+        ] if keys_to_remove else []
+        # plex appends added tracks, so the order after the diff is known without fetching the playlist again
+        expected_order = [
+            key for key in current_keys if key not in keys_to_remove
+        ] + [track.ratingKey for track in tracks_to_add]
+        apply_playlist_diff(
+            target_playlist=target_playlist,
+            tracks_to_add=tracks_to_add,
+            tracks_to_remove=tracks_to_remove,
+            username=username,
+        )
+        if plan_playlist_moves(cache_keys, expected_order):
+            if tracks_to_add or tracks_to_remove:
+                target_playlist.reload()
+            apply_playlist_order(
+                target_playlist=target_playlist,
+                cache_keys=cache_keys,
+                username=username,
+            )
 
         if target_playlist.summary != playlist_cache["summary"]:
             update_playlist_summary(playlist_cache, target_playlist, username, is_test)
@@ -271,194 +928,193 @@ def update_plex_from_cache(
 
 # Key def to call
 
-def check_for_playlist_cache(playlist):
-    """ Checks if the playlist feather cache files exsit already for both metadata and items cache
+def check_for_playlist_cache(
+    playlist,
+    cache_key=None
+):
+    """ Checks if the playlist cache exists already for both the current and old generation.
 
     Args:
         playlist obj: plex api playlist object
+        cache_key int: optional rating key of the admin playlist when playlist is a user's copy
 
     Returns:
-       bool: returns True or False depending if all cahce files exist for the playlist
+       bool: returns True or False depending if both cache generations exist for the playlist
     """
     playlist_name = playlist.title
-    sanitized_playlist_name = sanitize_filename(playlist_name)
-    playlist_cache_filename = os.path.join(
-        cache_directory, f"{sanitized_playlist_name}_cache.feather"
-    )
-
-    playlist_cache_filename_items = f"{playlist_cache_filename}_items"
-    playlist_cache_filename_metadata = f"{playlist_cache_filename}_metadata"
-    old_playlist_cache_filename_items = f"{playlist_cache_filename}_items_old"
-    old_playlist_cache_filename_metadata = f"{playlist_cache_filename}_metadata_old"
-    cache_files_list, check_list = [
-        playlist_cache_filename_items,
-        playlist_cache_filename_metadata,
-        old_playlist_cache_filename_items,
-        old_playlist_cache_filename_metadata,
-    ], []
-
     try:
-        for cache_file_path in cache_files_list:
-            check = os.path.exists(cache_file_path)
-            check_list.append(check)
-
-        check_results = all(check_list)
-
-        return check_results
-
+        cached = cachestore.has_playlist(playlist_cache_key(playlist, cache_key))
+        metrics.increment("cache_lookups_total", cache="playlist", result="hit" if cached else "miss")
+        return cached
     except Exception as e:
         logging.error(
             f"An error occurred while loading the playlist {playlist_name} from cache! Error: {e}"
         )
 
+@metrics.track_caller
 def make_playlist_cache(
     playlist,
-    is_test
+    is_test,
+    cache_key=None
 ):
     """Runs the extract_playlist_info function and save_playlist_to_cache funtion on the playlist obj passed through.
 
     Args:
         playlist obj: Plex api playlist object
         is_test bool: bool indicating whether to run as test
+        cache_key int: optional rating key of the admin playlist when playlist is a user's copy
+
+    Returns:
+        str: the cachedAt time of the new cache or None if nothing was saved.
     """
+    cached_at = None
     if not is_test:
         playlist_info = extract_playlist_info(playlist=playlist)
-        save_playlist_to_cache(playlist_info=playlist_info, playlist=playlist)
+        cached_at = save_playlist_to_cache(
+            playlist_info=playlist_info, playlist=playlist, cache_key=cache_key
+        )
     print(f"Created cache for {playlist.title}")
+    return cached_at
 
 
 def delete_old_cache(
-    playlist_list,
-    is_test
+    playlists,
+    is_test,
+    plex=None
 ):
-    """Takes playlist list and compares to all cached feather files. If a cached playlist is no longer in the list it deletes the feather files.
+    """Takes the synced admin playlists and removes every cached playlist of the server that is no longer synced in one delete.
 
     Args:
-        playlist_list list: list of playlists titles
+        playlists list: list of admin playlist objects that are synced
         is_test bool: bool indicating whether to run as test
+        plex obj: optional plex server object the playlists are from, the main server when not given
     """
-    cache_list = []
     if not is_test:
         try:
-            for playlist_name in playlist_list:
-                file_name = f"{sanitize_filename(playlist_name)}_cache.feather"
-                cache_list.append(file_name + "_items")
-                cache_list.append(file_name + "_items_old")
-                cache_list.append(file_name + "_metadata")
-                cache_list.append(file_name + "_metadata_old")
-
-            for cache_file in os.listdir(cache_directory):
-                cache_file_path = os.path.join(cache_directory, cache_file)
-                if cache_file not in cache_list:
-                    try:
-                        if os.path.isfile(cache_file_path):
-                            print(f"Removing {cache_file} from cache storage")
-                            os.remove(cache_file_path)
-                    except Exception as e:
-                        logging.error(
-                            f"An error occurred while removing old playlist! Error: {e}"
-                        )
-                else:
-                    print(
-                        f"Playlist for {cache_file} cache still in playlsit sync list, skipping..."
-                    )
-
+            removed_playlists = cachestore.delete_playlists_not_in(
+                (playlist_cache_key(playlist) for playlist in playlists),
+                namespace=cache_namespace(plex),
+            )
+            for removed_playlist in removed_playlists:
+                print(f"Removing {removed_playlist} from cache storage")
         except Exception as e:
             logging.error(f"An error occurred while removing old playlist! Error: {e}")
     else:
         logging.info("In test mode no cache needs to be removed.")
 
 
+@metrics.track_caller
 def compare_tracks_to_cache(
     plexserver,
     playlist,
     username,
-    is_test
+    is_test,
+    cache_key=None
 ):
-    """Logic test to compare tracks in cache playlist file to the tracks in the playlist by track ID.
-    If the plex playlist needs new tracks or tracks removed it runs update_plex_from_cache.
+    """Logic test to compare tracks in cache playlist file to the tracks in the playlist by track ID and order.
+    If the plex playlist needs new tracks, tracks removed or tracks moved it runs update_plex_from_cache.
     If the playlist cache needs to be updated then it runs make_playlist_cache.
-
+    The comparison is skipped when the playlist fingerprint and cache are unchanged since the last sync.
 
     Args:
         plexserver obj: plexserver endpoint
         playlist obj: plex api playlist object
         username obj: plex api username object
         is_test bool: bool indicating whether to run as test
+        cache_key int: optional rating key of the admin playlist when playlist is a user's copy
+
+    Returns:
+        str: "skipped", "unchanged", "updated_plex" or "updated_cache", None when running as test.
     """
     if not is_test:
+        tags = {"playlist": playlist.title, "user": username.username or username.title}
+        with tracing.span("check fingerprint", **tags):
+            unchanged = playlist_unchanged_since_sync(playlist, cache_key)
+        if unchanged:
+            print(f"no changes needed for '{username.username or username.title}'")
+            metrics.increment("playlists_total", result="skipped")
+            return "skipped"
         playlist_name = playlist.title
-        logging.info(f"Reading {playlist_name} cache...")
-        cached_playlist = load_playlist_from_cache(
-            playlist=playlist, load_old=False, is_test=is_test
-        )
-        logging.info(f"Reading {playlist_name} old cache...")
-        old_cached_playlist = load_playlist_from_cache(
-            playlist=playlist, load_old=True, is_test=is_test
-        )
-
-        cached_track_list, old_cached_track_list = [], []
-
-        for cachedtrack in cached_playlist["items"]:
-            plex_track_obj = plexserver.library.sectionByID(
-                cachedtrack["librarySectionID"]
-            ).searchTracks(id=cachedtrack["ratingKey"])
-            for track in plex_track_obj:
-                cached_track_list.append(track)
-
-        for cachedtrack in old_cached_playlist["items"]:
-            plex_track_obj = plexserver.library.sectionByID(
-                cachedtrack["librarySectionID"]
-            ).searchTracks(id=cachedtrack["ratingKey"])
-            for track in plex_track_obj:
-                old_cached_track_list.append(track)
+        with tracing.span("load cache", **tags):
+            logging.info(f"Reading {playlist_name} cache...")
+            cached_playlist = load_playlist_from_cache(
+                playlist=playlist, load_old=False, is_test=is_test, cache_key=cache_key
+            )
+            logging.info(f"Reading {playlist_name} old cache...")
+            old_cached_playlist = load_playlist_from_cache(
+                playlist=playlist, load_old=True, is_test=is_test, cache_key=cache_key
+            )
 
-        cache_length = len(cached_track_list)
-        old_cache_length = len(old_cached_track_list)
+        with tracing.span("resolve tracks", **tags):
+            key_map = resolve_cached_rating_keys(plexserver, [cached_playlist, old_cached_playlist])
+        cached_keys = cached_rating_keys(cached_playlist, key_map)
+        old_cached_keys = cached_rating_keys(old_cached_playlist, key_map)
+        with tracing.span("read playlist", **tags):
+            current_keys = list(iter_playlist_rating_keys(playlist))
+        cache_in_playlist = ratingkeys.contains_all(cached_keys, current_keys)
+        old_cache_in_playlist = ratingkeys.contains_all(old_cached_keys, current_keys)
+        playlist_in_cache = ratingkeys.contains_all(current_keys, cached_keys)
+
+        cache_length = len(cached_keys)
+        old_cache_length = len(old_cached_keys)
         summary_changed = playlist.summary != cached_playlist["summary"]
         old_summary_changed = playlist.summary == old_cached_playlist["summary"]
-        current_track_list = playlist.items()
+        order_changed = current_keys != cached_keys
+        old_order_matches = current_keys == old_cached_keys
+        # tracks that got a new rating key were dropped from the playlist by plex, not removed by the user
+        lost_tracks = ratingkeys.keys_not_in(remapped_cached_rating_keys(cached_playlist, key_map), current_keys)
 
         if (
-            not set(cached_track_list).issubset(set(current_track_list))
-            and set(old_cached_track_list).issubset(set(current_track_list))
+            not cache_in_playlist
+            and old_cache_in_playlist
             or (
-                cache_length != len(current_track_list)
-                and old_cache_length == len(current_track_list)
+                cache_length != len(current_keys)
+                and old_cache_length == len(current_keys)
             )
             or (summary_changed and old_summary_changed)
+            or (order_changed and old_order_matches)
+            or lost_tracks
         ):
             print("updating plex from cache")
-            update_plex_from_cache(
-                plex=plexserver,
-                playlist_cache=cached_playlist,
-                target_playlist=playlist,
-                username=username,
-                is_test=is_test,
-            )
+            with tracing.span("update plex", **tags):
+                update_plex_from_cache(
+                    plex=plexserver,
+                    playlist_cache=cached_playlist,
+                    target_playlist=playlist,
+                    username=username,
+                    is_test=is_test,
+                    key_map=key_map,
+                    current_keys=current_keys,
+                )
+                playlist.reload()
+            cached_at = cached_playlist["cachedAt"]
+            result = "updated_plex"
         elif (
-            not set(current_track_list).issubset(set(cached_track_list))
-            and not set(old_cached_track_list).issubset(set(current_track_list))
+            not playlist_in_cache
+            and not old_cache_in_playlist
             or (
-                cache_length != len(current_track_list)
-                or old_cache_length != len(current_track_list)
+                cache_length != len(current_keys)
+                or old_cache_length != len(current_keys)
             )
             or (summary_changed and not old_summary_changed)
+            or (order_changed and not old_order_matches)
         ):
             print("the cached playlist needs to be updated")
-            make_playlist_cache(
-                playlist=playlist,
-                is_test=is_test
-            )
+            with tracing.span("update cache", **tags):
+                cached_at = make_playlist_cache(
+                    playlist=playlist,
+                    is_test=is_test,
+                    cache_key=cache_key
+                )
+            result = "updated_cache"
         else:
             print(f"no changes needed for '{username.username or username.title}'")
+            cached_at = cached_playlist["cachedAt"]
+            result = "unchanged"
+        metrics.increment("playlists_total", result=result)
+        record_playlist_fingerprint(playlist, cached_at, cache_key)
+        return result
     else:
         logging.info(
             "If not in test mode would compare both plex playlist from user/account to cache playlist. Based on set conditions it would update the other playlist accordingly."
         )
-
-# ensures cache directories are in place for script to run properly
-
-cache_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
-if not os.path.exists(cache_directory):
-    os.makedirs(cache_directory)
@@ -0,0 +1,817 @@
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import closing, contextmanager
+
+# other scripts import
+from . import sharding
+
+logging.basicConfig(level=logging.INFO)
+
+# generations are loaded by how many saves back from the newest they are
+CURRENT_GENERATION = 0
+OLD_GENERATION = 1
+
+# the database is created and migrated on the first transaction instead of when the module is imported
+_initialized = False
+_initialize_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS playlists (
+    playlist TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS playlist_cache (
+    playlist TEXT NOT NULL REFERENCES playlists (playlist) ON DELETE CASCADE,
+    generation INTEGER NOT NULL,
+    title TEXT,
+    summary TEXT,
+    playlistType TEXT,
+    updatedAt TEXT,
+    leafCount INTEGER,
+    summaryHash TEXT,
+    cachedAt TEXT,
+    snapshot INTEGER,
+    PRIMARY KEY (playlist, generation)
+);
+CREATE TABLE IF NOT EXISTS playlist_items (
+    playlist TEXT NOT NULL REFERENCES playlists (playlist) ON DELETE CASCADE,
+    generation INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    ratingKey INTEGER NOT NULL,
+    title TEXT,
+    type TEXT,
+    librarySectionID INTEGER,
+    artist TEXT,
+    grandparentRatingKey INTEGER,
+    guid TEXT,
+    album TEXT,
+    duration INTEGER,
+    PRIMARY KEY (playlist, generation, position)
+);
+CREATE INDEX IF NOT EXISTS playlist_items_rating_key ON playlist_items (ratingKey);
+CREATE TABLE IF NOT EXISTS playlist_journal (
+    playlist TEXT NOT NULL REFERENCES playlists (playlist) ON DELETE CASCADE,
+    generation INTEGER NOT NULL,
+    entry INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    position INTEGER,
+    ratingKey INTEGER NOT NULL,
+    title TEXT,
+    type TEXT,
+    librarySectionID INTEGER,
+    artist TEXT,
+    grandparentRatingKey INTEGER,
+    guid TEXT,
+    album TEXT,
+    duration INTEGER,
+    PRIMARY KEY (playlist, generation, entry)
+);
+CREATE TABLE IF NOT EXISTS playlist_fingerprints (
+    playlist TEXT NOT NULL REFERENCES playlists (playlist) ON DELETE CASCADE,
+    playlistKey INTEGER NOT NULL,
+    updatedAt TEXT,
+    leafCount INTEGER,
+    summaryHash TEXT,
+    cachedAt TEXT,
+    PRIMARY KEY (playlist, playlistKey)
+);
+CREATE TABLE IF NOT EXISTS playlist_copies (
+    playlist TEXT NOT NULL REFERENCES playlists (playlist) ON DELETE CASCADE,
+    userID INTEGER NOT NULL,
+    copyKey INTEGER NOT NULL,
+    PRIMARY KEY (playlist, userID)
+);
+CREATE INDEX IF NOT EXISTS playlist_copies_copy_key ON playlist_copies (copyKey);
+CREATE TABLE IF NOT EXISTS playlist_mirrors (
+    playlist TEXT NOT NULL REFERENCES playlists (playlist) ON DELETE CASCADE,
+    server TEXT NOT NULL,
+    mirrorKey INTEGER NOT NULL,
+    cachedAt TEXT,
+    updatedAt TEXT,
+    PRIMARY KEY (playlist, server)
+);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT,
+    title TEXT,
+    email TEXT,
+    home INTEGER,
+    thumb TEXT,
+    servers TEXT,
+    cachedAt TEXT
+);
+CREATE TABLE IF NOT EXISTS sync_cycles (
+    cycle INTEGER PRIMARY KEY AUTOINCREMENT,
+    worker INTEGER NOT NULL DEFAULT 0,
+    startedAt TEXT NOT NULL,
+    finishedAt TEXT
+);
+CREATE TABLE IF NOT EXISTS sync_checkpoints (
+    cycle INTEGER NOT NULL REFERENCES sync_cycles (cycle) ON DELETE CASCADE,
+    playlistKey INTEGER NOT NULL,
+    username TEXT NOT NULL,
+    result TEXT,
+    PRIMARY KEY (cycle, playlistKey, username)
+);
+"""
+
+METADATA_FIELDS = [
+    "title",
+    "summary",
+    "playlistType",
+    "updatedAt",
+    "leafCount",
+    "summaryHash",
+    "cachedAt",
+]
+ITEM_FIELDS = [
+    "ratingKey",
+    "title",
+    "type",
+    "librarySectionID",
+    "artist",
+    "grandparentRatingKey",
+    "guid",
+    "album",
+    "duration",
+]
+FINGERPRINT_FIELDS = ["playlistKey", "updatedAt", "leafCount", "summaryHash", "cachedAt"]
+USER_FIELDS = ["id", "username", "title", "email", "home", "thumb", "servers"]
+MIRROR_FIELDS = ["mirrorKey", "cachedAt", "updatedAt"]
+
+
+@contextmanager
+def transaction():
+    """Opens a connection to the cache database and commits everything done inside the block as one transaction.
+    The database is created on the first transaction of the process.
+
+    Yields:
+        obj: sqlite3 connection to the cache database
+    """
+    global _initialized
+    if not _initialized:
+        with _initialize_lock:
+            if not _initialized:
+                initialize_cache_store()
+                _initialized = True
+    with closing(sqlite3.connect(cache_database, timeout=30)) as connection:
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA foreign_keys = ON")
+        # a committed cache update or checkpoint is on disk before the sync moves on, even if the container is killed
+        connection.execute("PRAGMA synchronous = FULL")
+        with connection:
+            yield connection
+
+
+def latest_generation(
+    connection,
+    playlist_name
+):
+    """Returns the newest generation number of a cached playlist.
+
+    Args:
+        connection obj: sqlite3 connection to the cache database
+        playlist_name str: name the playlist is cached under
+
+    Returns:
+        int: generation number or None if the playlist is not cached.
+    """
+    return connection.execute(
+        "SELECT MAX(generation) FROM playlist_cache WHERE playlist = ?", (playlist_name,)
+    ).fetchone()[0]
+
+
+def write_snapshot(
+    connection,
+    playlist_name,
+    generation,
+    items
+):
+    """Writes every item of a generation so it can be loaded without the journal.
+
+    Args:
+        connection obj: sqlite3 connection to the cache database
+        playlist_name str: name the playlist is cached under
+        generation int: generation number of the snapshot
+        items list: list of item dictionaries for the tracks in the playlist
+    """
+    connection.executemany(
+        f"INSERT INTO playlist_items (playlist, generation, position, {', '.join(ITEM_FIELDS)}) "
+        f"VALUES (?, ?, ?{', ?' * len(ITEM_FIELDS)})",
+        (
+            (playlist_name, generation, position, *[item.get(field) for field in ITEM_FIELDS])
+            for position, item in enumerate(items)
+        ),
+    )
+
+
+def journal_changes(
+    old_items,
+    new_items
+):
+    """Works out the removed rating keys and added items that turn one generation into the next.
+
+    Args:
+        old_items list: list of item dictionaries of the previous generation
+        new_items list: list of item dictionaries of the new generation
+
+    Returns:
+        list: list of journal entry dictionaries, or None if the change cannot be replayed from adds and removes alone, like a reordered playlist.
+    """
+    old_keys = {item["ratingKey"] for item in old_items}
+    new_keys = {item["ratingKey"] for item in new_items}
+    entries = [
+        {"action": "remove", "position": None, "ratingKey": rating_key}
+        for rating_key in old_keys - new_keys
+    ]
+    entries += [
+        dict(item, action="add", position=position)
+        for position, item in enumerate(new_items)
+        if item["ratingKey"] not in old_keys
+    ]
+    replayed = replay_journal(old_items, entries)
+    if [item["ratingKey"] for item in replayed] != [item["ratingKey"] for item in new_items]:
+        return None
+    return entries
+
+
+def replay_journal(
+    items,
+    entries
+):
+    """Applies the journal entries of one generation to the items of the generation before it.
+
+    Args:
+        items list: list of item dictionaries
+        entries list: list of journal entry dictionaries of a single generation
+
+    Returns:
+        list: list of item dictionaries of the generation.
+    """
+    removed = {entry["ratingKey"] for entry in entries if entry["action"] == "remove"}
+    items = [item for item in items if item["ratingKey"] not in removed]
+    for entry in sorted(
+        (entry for entry in entries if entry["action"] == "add"), key=lambda entry: entry["position"]
+    ):
+        items.insert(entry["position"], {field: entry.get(field) for field in ITEM_FIELDS})
+    return items
+
+
+def load_items(
+    connection,
+    playlist_name,
+    generation
+):
+    """Loads the items of a generation from the snapshot before it and the journal entries written since.
+
+    Args:
+        connection obj: sqlite3 connection to the cache database
+        playlist_name str: name the playlist is cached under
+        generation int: generation number
+
+    Returns:
+        list: list of item dictionaries for the tracks in the playlist.
+    """
+    snapshot = connection.execute(
+        "SELECT MAX(generation) FROM playlist_cache WHERE playlist = ? AND generation <= ? AND snapshot = 1",
+        (playlist_name, generation),
+    ).fetchone()[0]
+    items = [
+        dict(item)
+        for item in connection.execute(
+            f"SELECT {', '.join(ITEM_FIELDS)} FROM playlist_items "
+            "WHERE playlist = ? AND generation = ? ORDER BY position",
+            (playlist_name, snapshot),
+        )
+    ]
+    entries = {}
+    for entry in connection.execute(
+        f"SELECT generation, action, position, {', '.join(ITEM_FIELDS)} FROM playlist_journal "
+        "WHERE playlist = ? AND generation > ? AND generation <= ? ORDER BY generation, entry",
+        (playlist_name, snapshot, generation),
+    ):
+        entries.setdefault(entry["generation"], []).append(dict(entry))
+    for journal_generation in sorted(entries):
+        items = replay_journal(items, entries[journal_generation])
+    return items
+
+
+def compact_journal(
+    connection,
+    playlist_name,
+    generation
+):
+    """Folds every journal entry up to the generation before the newest one into a snapshot and drops the history before it.
+    The newest generation is kept as it is on top of the snapshot so the old generation remains available.
+
+    Args:
+        connection obj: sqlite3 connection to the cache database
+        playlist_name str: name the playlist is cached under
+        generation int: newest generation number
+    """
+    base_generation = generation - 1
+    items = load_items(connection, playlist_name, base_generation)
+    connection.execute(
+        "DELETE FROM playlist_items WHERE playlist = ? AND generation <= ?",
+        (playlist_name, base_generation),
+    )
+    write_snapshot(connection, playlist_name, base_generation, items)
+    connection.execute(
+        "UPDATE playlist_cache SET snapshot = 1 WHERE playlist = ? AND generation = ?",
+        (playlist_name, base_generation),
+    )
+    for table in ("playlist_cache", "playlist_journal"):
+        connection.execute(
+            f"DELETE FROM {table} WHERE playlist = ? AND generation < ?",
+            (playlist_name, base_generation),
+        )
+    connection.execute(
+        "DELETE FROM playlist_journal WHERE playlist = ? AND generation = ?",
+        (playlist_name, base_generation),
+    )
+    logging.info(f"Compacted the {playlist_name} cache journal")
+
+
+def save_playlist(
+    playlist_name,
+    metadata,
+    items
+):
+    """Saves a new generation of a playlist in one transaction, the previous generation becomes the old generation.
+    The tracks added and removed since the previous generation are appended to the journal. A full snapshot is
+    written instead for the first save, when the order changed or when most of the playlist changed. Once more than
+    compact_generations generations are kept the history is compacted.
+
+    Args:
+        playlist_name str: name the playlist is cached under
+        metadata dict: dictionary of playlist metadata
+        items list: list of item dictionaries for the tracks in the playlist
+    """
+    items = list(items)
+    with transaction() as connection:
+        connection.execute(
+            "INSERT OR IGNORE INTO playlists (playlist) VALUES (?)", (playlist_name,)
+        )
+        previous_generation = latest_generation(connection, playlist_name)
+        entries = None
+        if previous_generation is not None:
+            entries = journal_changes(
+                load_items(connection, playlist_name, previous_generation), items
+            )
+            if entries is not None and len(entries) > len(items) // 2:
+                entries = None
+        generation = (previous_generation or 0) + 1
+        connection.execute(
+            f"INSERT INTO playlist_cache (playlist, generation, snapshot, {', '.join(METADATA_FIELDS)}) "
+            f"VALUES (?, ?, ?{', ?' * len(METADATA_FIELDS)})",
+            (
+                playlist_name,
+                generation,
+                int(entries is None),
+                *[metadata.get(field) for field in METADATA_FIELDS],
+            ),
+        )
+        if entries is None:
+            write_snapshot(connection, playlist_name, generation, items)
+        else:
+            connection.executemany(
+                f"INSERT INTO playlist_journal (playlist, generation, entry, action, position, {', '.join(ITEM_FIELDS)}) "
+                f"VALUES (?, ?, ?, ?, ?{', ?' * len(ITEM_FIELDS)})",
+                (
+                    (
+                        playlist_name,
+                        generation,
+                        entry_number,
+                        entry["action"],
+                        entry["position"],
+                        *[entry.get(field) for field in ITEM_FIELDS],
+                    )
+                    for entry_number, entry in enumerate(entries)
+                ),
+            )
+        oldest_generation = connection.execute(
+            "SELECT MIN(generation) FROM playlist_cache WHERE playlist = ?", (playlist_name,)
+        ).fetchone()[0]
+        if generation - oldest_generation > compact_generations:
+            compact_journal(connection, playlist_name, generation)
+
+
+def load_playlist(
+    playlist_name,
+    generation
+):
+    """Loads one generation of a cached playlist.
+
+    Args:
+        playlist_name str: name the playlist is cached under
+        generation int: number of generations back from the newest, CURRENT_GENERATION or OLD_GENERATION for the last two.
+            The oldest kept generation is loaded when the history is shorter.
+
+    Returns:
+        dict: dictionary of the playlist metadata with an items list, or None if the playlist is not cached.
+    """
+    with transaction() as connection:
+        newest, oldest = connection.execute(
+            "SELECT MAX(generation), MIN(generation) FROM playlist_cache WHERE playlist = ?",
+            (playlist_name,),
+        ).fetchone()
+        if newest is None:
+            return None
+        generation = max(newest - generation, oldest)
+        metadata = connection.execute(
+            f"SELECT {', '.join(METADATA_FIELDS)} FROM playlist_cache WHERE playlist = ? AND generation = ?",
+            (playlist_name, generation),
+        ).fetchone()
+        items = load_items(connection, playlist_name, generation)
+    playlist_info = dict(metadata)
+    playlist_info["items"] = items
+    return playlist_info
+
+
+def load_cached_at(playlist_name):
+    """Loads when the newest generation of a playlist was cached without reading its items.
+
+    Args:
+        playlist_name str: name the playlist is cached under
+
+    Returns:
+        str: cachedAt time of the newest generation or None if the playlist is not cached.
+    """
+    with transaction() as connection:
+        row = connection.execute(
+            "SELECT cachedAt FROM playlist_cache WHERE playlist = ? ORDER BY generation DESC LIMIT 1",
+            (playlist_name,),
+        ).fetchone()
+    return row["cachedAt"] if row else None
+
+
+def has_playlist(playlist_name):
+    """Checks if a playlist is cached.
+
+    Args:
+        playlist_name str: name the playlist is cached under
+
+    Returns:
+        bool: True if at least one generation exists, the old generation is the same as the current until the playlist changes.
+    """
+    with transaction() as connection:
+        return latest_generation(connection, playlist_name) is not None
+
+
+def load_fingerprints(playlist_name):
+    """Loads the fingerprints recorded for each synced copy of a playlist.
+
+    Args:
+        playlist_name str: name the playlist is cached under
+
+    Returns:
+        list: list of fingerprint dictionaries.
+    """
+    with transaction() as connection:
+        fingerprints = connection.execute(
+            f"SELECT {', '.join(FINGERPRINT_FIELDS)} FROM playlist_fingerprints WHERE playlist = ?",
+            (playlist_name,),
+        ).fetchall()
+    return [dict(fingerprint) for fingerprint in fingerprints]
+
+
+def save_fingerprint(
+    playlist_name,
+    fingerprint
+):
+    """Saves or replaces the fingerprint of one synced copy of a playlist.
+
+    Args:
+        playlist_name str: name the playlist is cached under
+        fingerprint dict: dictionary with the FINGERPRINT_FIELDS of the copy
+    """
+    with transaction() as connection:
+        if connection.execute(
+            "SELECT 1 FROM playlists WHERE playlist = ?", (playlist_name,)
+        ).fetchone() is None:
+            return
+        connection.execute(
+            f"INSERT OR REPLACE INTO playlist_fingerprints (playlist, {', '.join(FINGERPRINT_FIELDS)}) "
+            f"VALUES (?{', ?' * len(FINGERPRINT_FIELDS)})",
+            (playlist_name, *[fingerprint.get(field) for field in FINGERPRINT_FIELDS]),
+        )
+
+
+def save_playlist_copy(
+    playlist_name,
+    user_id,
+    copy_key
+):
+    """Saves or replaces the rating key of a user's copy of a cached playlist.
+
+    Args:
+        playlist_name str: name the playlist is cached under
+        user_id int: plex user id
+        copy_key int: rating key of the user's copy
+    """
+    with transaction() as connection:
+        if connection.execute(
+            "SELECT 1 FROM playlists WHERE playlist = ?", (playlist_name,)
+        ).fetchone() is None:
+            return
+        connection.execute(
+            "INSERT OR REPLACE INTO playlist_copies (playlist, userID, copyKey) VALUES (?, ?, ?)",
+            (playlist_name, user_id, copy_key),
+        )
+
+
+def load_playlist_copy(
+    playlist_name,
+    user_id
+):
+    """Loads the rating key of a user's copy of a cached playlist.
+
+    Args:
+        playlist_name str: name the playlist is cached under
+        user_id int: plex user id
+
+    Returns:
+        int: rating key of the user's copy or None if no copy is known.
+    """
+    with transaction() as connection:
+        row = connection.execute(
+            "SELECT copyKey FROM playlist_copies WHERE playlist = ? AND userID = ?",
+            (playlist_name, user_id),
+        ).fetchone()
+    return row["copyKey"] if row else None
+
+
+def save_playlist_mirror(
+    playlist_name,
+    server,
+    mirror
+):
+    """Saves or replaces the copy of a cached playlist on another plex server.
+
+    Args:
+        playlist_name str: name the playlist is cached under
+        server str: machine identifier of the other server
+        mirror dict: dictionary with the MIRROR_FIELDS of the copy
+    """
+    with transaction() as connection:
+        if connection.execute(
+            "SELECT 1 FROM playlists WHERE playlist = ?", (playlist_name,)
+        ).fetchone() is None:
+            return
+        connection.execute(
+            f"INSERT OR REPLACE INTO playlist_mirrors (playlist, server, {', '.join(MIRROR_FIELDS)}) "
+            f"VALUES (?, ?{', ?' * len(MIRROR_FIELDS)})",
+            (playlist_name, server, *[mirror.get(field) for field in MIRROR_FIELDS]),
+        )
+
+
+def load_playlist_mirror(
+    playlist_name,
+    server
+):
+    """Loads the copy of a cached playlist on another plex server.
+
+    Args:
+        playlist_name str: name the playlist is cached under
+        server str: machine identifier of the other server
+
+    Returns:
+        dict: dictionary with the MIRROR_FIELDS of the copy or None if no copy is known.
+    """
+    with transaction() as connection:
+        row = connection.execute(
+            f"SELECT {', '.join(MIRROR_FIELDS)} FROM playlist_mirrors WHERE playlist = ? AND server = ?",
+            (playlist_name, server),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def start_sync_cycle(
+    started_at,
+    resume_after,
+    worker=0
+):
+    """Returns the unfinished sync cycle of a worker to resume, or starts a new one when there is none or it started too long ago.
+    Unfinished cycles of the worker that are not resumed are dropped with their checkpoints.
+
+    Args:
+        started_at str: time the new cycle starts
+        resume_after str: time an unfinished cycle must have started after to be resumed
+        worker int: index of the worker running the cycle
+
+    Returns:
+        int: the sync cycle number
+    """
+    with transaction() as connection:
+        row = connection.execute(
+            "SELECT cycle FROM sync_cycles WHERE worker = ? AND finishedAt IS NULL AND startedAt >= ? "
+            "ORDER BY cycle DESC LIMIT 1",
+            (worker, resume_after),
+        ).fetchone()
+        if row is not None:
+            return row["cycle"]
+        connection.execute("DELETE FROM sync_cycles WHERE worker = ? AND finishedAt IS NULL", (worker,))
+        return connection.execute(
+            "INSERT INTO sync_cycles (worker, startedAt) VALUES (?, ?)", (worker, started_at)
+        ).lastrowid
+
+
+def save_checkpoint(
+    cycle,
+    playlist_key,
+    username,
+    result
+):
+    """Records that a playlist was synced for the admin or a user during a sync cycle.
+
+    Args:
+        cycle int: sync cycle number from start_sync_cycle
+        playlist_key int: rating key of the admin playlist
+        username str: username of the user, None for the admin
+        result str: result of the sync
+    """
+    with transaction() as connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO sync_checkpoints (cycle, playlistKey, username, result) VALUES (?, ?, ?, ?)",
+            (cycle, int(playlist_key), username or "", result),
+        )
+
+
+def load_checkpoints(cycle):
+    """Loads the playlists already synced during a sync cycle.
+
+    Args:
+        cycle int: sync cycle number from start_sync_cycle
+
+    Returns:
+        dict: (admin playlist rating key, username or None for the admin) to the result of the sync.
+    """
+    with transaction() as connection:
+        rows = connection.execute(
+            "SELECT playlistKey, username, result FROM sync_checkpoints WHERE cycle = ?", (cycle,)
+        ).fetchall()
+    return {(row["playlistKey"], row["username"] or None): row["result"] for row in rows}
+
+
+def finish_sync_cycle(
+    cycle,
+    finished_at
+):
+    """Marks a sync cycle as finished and drops its checkpoints and the cycles before it.
+
+    Args:
+        cycle int: sync cycle number from start_sync_cycle
+        finished_at str: time the cycle finished
+    """
+    with transaction() as connection:
+        connection.execute(
+            "UPDATE sync_cycles SET finishedAt = ? WHERE cycle = ?", (finished_at, cycle)
+        )
+        connection.execute("DELETE FROM sync_checkpoints WHERE cycle = ?", (cycle,))
+        connection.execute(
+            "DELETE FROM sync_cycles WHERE cycle < ? AND worker = (SELECT worker FROM sync_cycles WHERE cycle = ?)",
+            (cycle, cycle),
+        )
+
+
+@contextmanager
+def lock_playlist(playlist_name):
+    """Holds an exclusive file lock for one cached playlist, so workers sharing the cache directory sync it one at a time.
+    The lock is released when the block ends or the process dies.
+
+    Args:
+        playlist_name str: name the playlist is cached under, safe to use as a file name
+    """
+    lock_directory = os.path.join(cache_directory, "locks")
+    os.makedirs(lock_directory, exist_ok=True)
+    with open(os.path.join(lock_directory, f"{playlist_name}.lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def namespace_scope(namespace):
+    """Builds the sql condition that limits cached playlists to those of one server.
+
+    Args:
+        namespace str: prefix the playlists of the server are cached under, None for the main server whose names have no prefix
+
+    Returns:
+        tuple: sql condition on the playlist column and its parameters
+    """
+    if namespace is None:
+        return "instr(playlist, ':') = 0", []
+    return "substr(playlist, 1, ?) = ?", [len(namespace) + 1, f"{namespace}:"]
+
+
+def find_cached_playlists(
+    playlist_keys,
+    namespace=None
+):
+    """Looks up the name of the cached playlist of every synced copy with one of the given rating keys on one server.
+    Rating keys are only unique within a server, so copies cached for other servers are left out.
+
+    Args:
+        playlist_keys iterable: playlist rating keys of admin or user copies
+        namespace str: prefix the playlists of the server are cached under, None for the main server whose names have no prefix
+
+    Returns:
+        dict: dictionary of playlist rating key to the name the playlist is cached under for the keys that were found.
+    """
+    playlist_keys = [int(playlist_key) for playlist_key in playlist_keys]
+    placeholders = ", ".join("?" * len(playlist_keys))
+    scope, scope_parameters = namespace_scope(namespace)
+    with transaction() as connection:
+        rows = connection.execute(
+            f"SELECT playlistKey, playlist FROM playlist_fingerprints WHERE playlistKey IN ({placeholders}) AND {scope} "
+            f"UNION SELECT copyKey, playlist FROM playlist_copies WHERE copyKey IN ({placeholders}) AND {scope}",
+            (*playlist_keys, *scope_parameters, *playlist_keys, *scope_parameters),
+        ).fetchall()
+    return {row[0]: row[1] for row in rows}
+
+
+def save_users(
+    users,
+    cached_at
+):
+    """Replaces the cached user directory in one transaction.
+
+    Args:
+        users list: list of user dictionaries with the USER_FIELDS
+        cached_at str: time the users were fetched from plex
+    """
+    with transaction() as connection:
+        connection.execute("DELETE FROM users")
+        connection.executemany(
+            f"INSERT INTO users ({', '.join(USER_FIELDS)}, cachedAt) VALUES ({', '.join('?' * len(USER_FIELDS))}, ?)",
+            ((*[user.get(field) for field in USER_FIELDS], cached_at) for user in users),
+        )
+
+
+def load_users():
+    """Loads the cached user directory.
+
+    Returns:
+        tuple: list of user dictionaries and the time they were fetched from plex, or None if no users are cached.
+    """
+    with transaction() as connection:
+        rows = connection.execute(
+            f"SELECT {', '.join(USER_FIELDS)}, cachedAt FROM users"
+        ).fetchall()
+    if not rows:
+        return [], None
+    return [{field: row[field] for field in USER_FIELDS} for row in rows], rows[0]["cachedAt"]
+
+
+def delete_playlists_not_in(
+    playlist_names,
+    namespace=None
+):
+    """Removes every cached playlist of a server that is not in the list with a single delete that cascades to all tables.
+
+    Args:
+        playlist_names list: list of names the kept playlists are cached under
+        namespace str: prefix the playlists of the server are cached under, None for the main server whose names have no prefix
+
+    Returns:
+        list: names of the playlists that were removed.
+    """
+    playlist_names = list(playlist_names)
+    placeholders = ", ".join("?" * len(playlist_names))
+    scope, scope_parameters = namespace_scope(namespace)
+    with transaction() as connection:
+        removed = connection.execute(
+            f"DELETE FROM playlists WHERE {scope} AND playlist NOT IN ({placeholders}) RETURNING playlist",
+            scope_parameters + playlist_names,
+        ).fetchall()
+    return [row["playlist"] for row in removed]
+
+
+def initialize_cache_store():
+    """Creates the cache database and removes the per playlist feather files used by older versions."""
+    if not os.path.exists(cache_directory):
+        os.makedirs(cache_directory)
+    new_database = not os.path.exists(cache_database)
+    with closing(sqlite3.connect(cache_database, timeout=30)) as connection:
+        # the shared memory index of WAL only works on one host, workers sharing the cache over a network filesystem use the rollback journal
+        connection.execute(f"PRAGMA journal_mode = {'DELETE' if sharding.worker_count > 1 else 'WAL'}")
+        connection.executescript(SCHEMA)
+    if new_database:
+        for cache_file in os.listdir(cache_directory):
+            if "_cache.feather" in cache_file:
+                logging.info(f"Removing legacy cache file {cache_file}")
+                os.remove(os.path.join(cache_directory, cache_file))
+
+cache_directory = os.getenv(
+    "CACHE_DIRECTORY",
+    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"),
+)
+cache_database = os.path.join(cache_directory, "playlists.sqlite")
+try:
+    compact_generations = int(os.getenv("CACHE_COMPACT_GENERATIONS", default=20))
+except ValueError:
+    compact_generations = 20
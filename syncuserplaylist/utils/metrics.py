@@ -0,0 +1,231 @@
+import functools
+import logging
+import re
+import threading
+from urllib.parse import urlparse
+
+import requests
+
+logging.basicConfig(level=logging.INFO)
+
+METRIC_PREFIX = "syncuserplaylist"
+
+# metric name -> (help text, prometheus type)
+METRIC_HELP = {
+    "plex_requests_total": ("Plex HTTP requests by endpoint, caller and status code.", "counter"),
+    "plex_request_seconds": ("Time spent in plex HTTP requests by endpoint and caller.", "summary"),
+    "cycle_seconds": ("Duration of the sync cycles.", "summary"),
+    "last_cycle_seconds": ("Duration of the last sync cycle.", "gauge"),
+    "playlists_total": ("Playlists compared to the cache by result.", "counter"),
+    "cache_lookups_total": ("Playlist, user directory and track index cache lookups by result.", "counter"),
+    "tracks_remapped_total": ("Cached tracks missing from the server by whether a new rating key was matched.", "counter"),
+    "plex_retries_total": ("Plex requests sent again after a server error or timeout.", "counter"),
+    "plex_rate_limit_wait_seconds": ("Time requests waited for the rate limit.", "summary"),
+    "plex_circuit_opened_total": ("Times plex requests were paused after failing in a row.", "counter"),
+    "plex_circuit_open": ("1 while plex requests are paused.", "gauge"),
+    "plex_requests_rejected_total": ("Plex requests not sent because requests were paused.", "counter"),
+}
+
+_counters = {}
+_summaries = {}
+_gauges = {}
+_metrics_lock = threading.Lock()
+_caller = threading.local()
+
+
+def _labels(**labels):
+    return tuple(sorted(labels.items()))
+
+
+def increment(name, amount=1, **labels):
+    """Adds to a counter.
+
+    Args:
+        name str: metric name from METRIC_HELP
+        amount float: amount to add
+        **labels: label values of the counter
+    """
+    key = (name, _labels(**labels))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    """Records one observation of a summary.
+
+    Args:
+        name str: metric name from METRIC_HELP
+        value float: observed value
+        **labels: label values of the summary
+    """
+    key = (name, _labels(**labels))
+    with _metrics_lock:
+        total, count = _summaries.get(key, (0.0, 0))
+        _summaries[key] = (total + value, count + 1)
+
+
+def set_gauge(name, value, **labels):
+    """Sets a gauge to a value.
+
+    Args:
+        name str: metric name from METRIC_HELP
+        value float: new value
+        **labels: label values of the gauge
+    """
+    with _metrics_lock:
+        _gauges[(name, _labels(**labels))] = value
+
+
+def current_caller():
+    """Returns the innermost function wrapped with track_caller running in this thread.
+
+    Returns:
+        str: function name or "other".
+    """
+    callers = getattr(_caller, "stack", None)
+    return callers[-1] if callers else "other"
+
+
+def track_caller(func):
+    """Decorator that attributes the plex requests made while the function runs to its name."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not hasattr(_caller, "stack"):
+            _caller.stack = []
+        _caller.stack.append(func.__name__)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _caller.stack.pop()
+
+    return wrapper
+
+
+def endpoint_name(url):
+    """Turns a request url into a low cardinality endpoint name by replacing ids.
+
+    Args:
+        url str: request url
+
+    Returns:
+        str: endpoint such as /playlists/{id}/items
+    """
+    parsed = urlparse(url)
+    path = re.sub(r"(?<=/)\d+(,\d+)*(?=/|$)", "{id}", parsed.path.rstrip("/") or "/")
+    if parsed.hostname and parsed.hostname.endswith("plex.tv"):
+        return f"plex.tv{path}"
+    return path
+
+
+def record_response(response, *args, **kwargs):
+    """requests response hook counting and timing every plex request.
+
+    Args:
+        response obj: requests response
+    """
+    endpoint = endpoint_name(response.request.url)
+    method = response.request.method
+    caller = current_caller()
+    increment(
+        "plex_requests_total",
+        endpoint=endpoint,
+        method=method,
+        caller=caller,
+        status=str(response.status_code),
+    )
+    observe(
+        "plex_request_seconds",
+        response.elapsed.total_seconds(),
+        endpoint=endpoint,
+        method=method,
+        caller=caller,
+    )
+    return response
+
+
+def instrumented_session(session=None):
+    """Adds the metrics response hook to a requests session.
+
+    Args:
+        session obj: optional requests session, a new one is made when not given
+
+    Returns:
+        obj: requests session recording every request
+    """
+    session = session or requests.Session()
+    session.hooks["response"].append(record_response)
+    return session
+
+
+def _format_labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ""
+    values = ",".join(
+        f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+        for key, value in sorted(labels.items())
+    )
+    return "{" + values + "}"
+
+
+def render_metrics():
+    """Renders every metric in the prometheus text format.
+
+    Returns:
+        str: prometheus exposition text
+    """
+    with _metrics_lock:
+        counters, summaries, gauges = dict(_counters), dict(_summaries), dict(_gauges)
+    lines = []
+    for name, (help_text, metric_type) in METRIC_HELP.items():
+        full_name = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} {metric_type}")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{full_name}{_format_labels(labels)} {value}")
+        for (metric, labels), (total, count) in sorted(summaries.items()):
+            if metric == name:
+                lines.append(f"{full_name}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{full_name}_count{_format_labels(labels)} {count}")
+        for (metric, labels), value in sorted(gauges.items()):
+            if metric == name:
+                lines.append(f"{full_name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(port):
+    """Serves the metrics on http://0.0.0.0:port/metrics from a background thread.
+    http.server is only imported here, so it is not loaded when METRICS_PORT is off.
+
+    Args:
+        port int: port to listen on
+
+    Returns:
+        obj: the running http server
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """Serves the metrics on /metrics."""
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Serving metrics on port {port}")
+    return server
@@ -0,0 +1,244 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from plexapi.exceptions import NotFound
+
+# other scripts import
+from . import cachestore
+from . import metrics
+from . import sharding
+from . import trackindex
+from . import tracing
+from .cacheplaylist import create_playlist_from_pages
+from .cacheplaylist import iter_track_pages
+from .cacheplaylist import playlist_cache_key
+from .cacheplaylist import update_plex_from_cache
+from .cacheplaylist import update_playlist_summary
+from .plexsyncplaylist import build_playlist_index
+from .plexsyncplaylist import find_playlist
+from .plexsyncplaylist import sync_playlists
+
+logging.basicConfig(level=logging.INFO)
+
+
+def find_mirror(
+    source_playlist,
+    target_plex,
+    target_index
+):
+    """Finds the copy of a playlist of the main server on another server, by the rating key it was last copied to or by title.
+
+    Args:
+        source_playlist obj: admin playlist object of the main server
+        target_plex obj: plex server object of the other server
+        target_index dict: playlist index of the other server from build_playlist_index
+
+    Returns:
+        tuple: the copy of the playlist, None when there is no copy, and the saved mirror dictionary, None when it was never copied.
+    """
+    mirror_info = cachestore.load_playlist_mirror(playlist_cache_key(source_playlist), target_plex.machineIdentifier)
+    mirror = target_index["ratingKeys"].get(mirror_info["mirrorKey"]) if mirror_info else None
+    if mirror is None:
+        try:
+            mirror = find_playlist(target_index, source_playlist.title)
+        except NotFound:
+            mirror = None
+    return mirror, mirror_info
+
+
+@metrics.track_caller
+def mirror_playlist(
+    source_playlist,
+    target_plex,
+    target_index,
+    is_test
+):
+    """Copies a playlist of the main server to the admin account of another server from the playlist cache.
+    The cached tracks are matched to the other server with its track index, so no track is searched for on its own.
+    The copy is skipped when neither the cache nor the copy changed since it was last made.
+
+    Args:
+        source_playlist obj: admin playlist object of the main server
+        target_plex obj: plex server object of the other server
+        target_index dict: playlist index of the other server from build_playlist_index
+        is_test bool: bool indicating whether to run as test
+
+    Returns:
+        obj: the copy of the playlist on the other server, None when there is no copy.
+    """
+    playlist_name = playlist_cache_key(source_playlist)
+    source_cache = cachestore.load_playlist(playlist_name, cachestore.CURRENT_GENERATION)
+    if source_cache is None:
+        logging.info(f"'{source_playlist.title}' is not cached yet, it is copied to {target_plex.friendlyName} next run")
+        return None
+    server = target_plex.machineIdentifier
+    mirror, mirror_info = find_mirror(source_playlist, target_plex, target_index)
+    if (
+        mirror is not None
+        and mirror_info is not None
+        and int(mirror.ratingKey) == mirror_info["mirrorKey"]
+        and mirror_info["cachedAt"] == source_cache["cachedAt"]
+        and mirror_info["updatedAt"] == mirror.updatedAt.isoformat()
+    ):
+        print(f"no changes needed for '{source_playlist.title}' on {target_plex.friendlyName}")
+        return mirror
+    if is_test:
+        print(f"'{source_playlist.title}' would have been copied to {target_plex.friendlyName}")
+        return mirror
+
+    # asks plex.tv, so it is only done for playlists that are copied
+    account = target_plex.myPlexAccount()
+    target_keys = list(
+        dict.fromkeys(
+            rating_key
+            for rating_key in trackindex.match_tracks(target_plex, source_cache["items"])
+            if rating_key is not None
+        )
+    )
+    mirror_cache = {
+        "summary": source_cache["summary"],
+        "items": [{"ratingKey": rating_key} for rating_key in target_keys],
+    }
+    if mirror is None:
+        print(f"Copying '{source_playlist.title}' to {target_plex.friendlyName}")
+        mirror = create_playlist_from_pages(
+            target_plex, source_playlist.title, iter_track_pages(target_plex, target_keys)
+        )
+        if mirror is None:
+            print(f"None of the tracks of '{source_playlist.title}' are on {target_plex.friendlyName}, skipping...")
+            return None
+        update_playlist_summary(mirror_cache, mirror, account, is_test)
+    else:
+        if mirror.title != source_playlist.title:
+            print(f"Renaming '{mirror.title}' on {target_plex.friendlyName} to '{source_playlist.title}'")
+            mirror.editTitle(source_playlist.title)
+        print(f"Updating '{source_playlist.title}' on {target_plex.friendlyName}")
+        update_plex_from_cache(
+            plex=target_plex,
+            playlist_cache=mirror_cache,
+            target_playlist=mirror,
+            username=account,
+            is_test=is_test,
+        )
+    mirror.reload()
+    cachestore.save_playlist_mirror(
+        playlist_name,
+        server,
+        {
+            "mirrorKey": int(mirror.ratingKey),
+            "cachedAt": source_cache["cachedAt"],
+            "updatedAt": mirror.updatedAt.isoformat(),
+        },
+    )
+    return mirror
+
+
+def fan_out_to_server(
+    target_plex,
+    source_playlists,
+    user_list,
+    run_as_test,
+    sync_concurrency=1,
+    user_server_ttl=3600,
+    user_directory_ttl=3600
+):
+    """Copies the playlists of the main server to another server and syncs the copies to the users of that server.
+
+    Args:
+        target_plex obj: plex server object of the other server
+        source_playlists list: list of admin playlist objects of the main server
+        user_list list: list of string names that correspond to user names.
+        run_as_test bool: bool indicating whether to run as test
+        sync_concurrency int: max number of users synced at the same time
+        user_server_ttl float: seconds a user token and its plex server are reused across runs
+        user_directory_ttl float: seconds the cached list of plex users is used before asking plex again
+
+    Returns:
+        dict: (playlist rating key on the other server, username or None for the admin) to the result of the comparison.
+    """
+    with tracing.profiled(), tracing.span("fan out", server=target_plex.friendlyName):
+        target_index = build_playlist_index(target_plex)
+        mirror_keys = set()
+        for source_playlist in source_playlists:
+            try:
+                if sharding.owns("mirror", source_playlist.ratingKey, target_plex.machineIdentifier):
+                    with tracing.span("mirror playlist", playlist=source_playlist.title, server=target_plex.friendlyName):
+                        mirror = mirror_playlist(source_playlist, target_plex, target_index, run_as_test)
+                else:
+                    # another worker copies the playlist, its users can still be synced by this worker
+                    mirror, _ = find_mirror(source_playlist, target_plex, target_index)
+                if mirror is not None:
+                    mirror_keys.add(int(mirror.ratingKey))
+            except Exception as e:
+                print(f"Failed to copy '{source_playlist.title}' to {target_plex.friendlyName}: {e}")
+        if not mirror_keys:
+            return {}
+        return sync_playlists(
+            target_plex,
+            None,
+            user_list,
+            False,
+            run_as_test,
+            sync_concurrency,
+            mirror_keys,
+            user_server_ttl,
+            user_directory_ttl
+        )
+
+
+@metrics.track_caller
+def fan_out_playlists(
+    plex,
+    target_servers,
+    playlist_keys,
+    user_list,
+    run_as_test,
+    sync_concurrency=1,
+    user_server_ttl=3600,
+    user_directory_ttl=3600
+):
+    """Syncs the playlists of the main server to the users of every other server, one thread per server.
+
+    Args:
+        plex obj: plex server object of the main server
+        target_servers list: list of plex server objects of the other servers
+        playlist_keys set: rating keys of the admin playlists of the main server to copy
+        user_list list: list of string names that correspond to user names.
+        run_as_test bool: bool indicating whether to run as test
+        sync_concurrency int: max number of users synced at the same time on each server
+        user_server_ttl float: seconds a user token and its plex server are reused across runs
+        user_directory_ttl float: seconds the cached list of plex users is used before asking plex again
+
+    Returns:
+        dict: machine identifier of each server to the results of fan_out_to_server.
+    """
+    if not target_servers or not playlist_keys:
+        return {}
+    playlist_index = build_playlist_index(plex)
+    source_playlists = [
+        playlist_index["ratingKeys"][rating_key]
+        for rating_key in sorted(playlist_keys)
+        if rating_key in playlist_index["ratingKeys"]
+    ]
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(target_servers)) as executor:
+        futures = {
+            executor.submit(
+                fan_out_to_server,
+                target_plex=target_plex,
+                source_playlists=source_playlists,
+                user_list=user_list,
+                run_as_test=run_as_test,
+                sync_concurrency=sync_concurrency,
+                user_server_ttl=user_server_ttl,
+                user_directory_ttl=user_directory_ttl,
+            ): target_plex
+            for target_plex in target_servers
+        }
+        for future in as_completed(futures):
+            target_plex = futures[future]
+            try:
+                results[target_plex.machineIdentifier] = future.result()
+            except Exception as e:
+                print(f"Failed to sync playlists to {target_plex.friendlyName}: {e}")
+    return results
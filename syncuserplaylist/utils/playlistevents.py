@@ -0,0 +1,104 @@
+import logging
+import threading
+from time import monotonic
+
+from plexapi.alert import AlertListener
+
+# other scripts import
+from . import cachestore
+
+logging.basicConfig(level=logging.INFO)
+
+# plex metadata type number used for playlists in timeline notifications
+PLAYLIST_METADATA_TYPE = 15
+
+# playlist rating keys changed since the last sync mapped to when the latest notification arrived
+_pending_changes = {}
+_pending_changes_lock = threading.Lock()
+
+
+def handle_alert(data):
+    """Callback for the plex alert listener that records every playlist named in a timeline notification.
+
+    Args:
+        data dict: NotificationContainer dictionary sent by the plex server
+    """
+    if data.get("type") != "timeline":
+        return
+    for entry in data.get("TimelineEntry", []):
+        if int(entry.get("type", 0)) == PLAYLIST_METADATA_TYPE and entry.get("itemID"):
+            logging.info(f"Playlist {entry['itemID']} changed on the plex server")
+            with _pending_changes_lock:
+                _pending_changes[int(entry["itemID"])] = monotonic()
+
+
+def handle_alert_error(error):
+    """Callback for the plex alert listener that logs websocket errors.
+
+    Args:
+        error obj: error raised by the websocket connection
+    """
+    logging.error(f"Playlist notification error: {error}")
+
+
+def start_playlist_listener(plex):
+    """Subscribes to the plex server notifications websocket in a background thread.
+
+    Args:
+        plex obj: plex server object
+
+    Returns:
+        obj: started plexapi AlertListener thread
+    """
+    listener = AlertListener(
+        plex, callback=handle_alert, callbackError=handle_alert_error
+    )
+    listener.start()
+    return listener
+
+
+def pop_changed_playlists(debounce_seconds):
+    """Returns the changed playlist rating keys once no new notification has arrived for the debounce period.
+
+    Args:
+        debounce_seconds float: seconds without notifications before the changes are handed out
+
+    Returns:
+        set: set of playlist rating keys, empty while changes are still coming in.
+    """
+    with _pending_changes_lock:
+        if not _pending_changes:
+            return set()
+        if monotonic() - max(_pending_changes.values()) < debounce_seconds:
+            return set()
+        changed_playlists = set(_pending_changes)
+        _pending_changes.clear()
+    return changed_playlists
+
+
+def resolve_source_playlists(
+    plex,
+    playlist_keys
+):
+    """Finds the admin playlists that changed playlists are synced from with the cached copies and falls back to asking the plex server.
+
+    Args:
+        plex obj: plex server object
+        playlist_keys set: set of playlist rating keys from the notifications
+
+    Returns:
+        set: set of admin playlist rating keys, or None if a playlist could not be identified and everything should be synced.
+    """
+    # notifications come from the main server, the copies fanned out to other servers are not looked at
+    cached_playlists = cachestore.find_cached_playlists(playlist_keys)
+    source_keys = set()
+    for playlist_key in playlist_keys:
+        try:
+            if playlist_key in cached_playlists:
+                source_keys.add(int(cached_playlists[playlist_key]))
+            else:
+                source_keys.add(int(plex.fetchItem(f"/playlists/{playlist_key}").ratingKey))
+        except Exception:
+            logging.info(f"Playlist {playlist_key} is unknown, syncing every playlist")
+            return None
+    return source_keys
@@ -0,0 +1,240 @@
+import logging
+import random
+import threading
+from time import monotonic, sleep
+
+import requests
+from plexapi.server import PlexServer
+from requests.adapters import HTTPAdapter
+
+# other scripts import
+from . import metrics
+
+logging.basicConfig(level=logging.INFO)
+
+# methods that are safe to send again when the server fails to answer
+RETRY_METHODS = ("GET", "HEAD")
+# status codes that mean the server is struggling rather than the request being wrong
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# (plex server url, username) -> (plex server object signed in as the user, monotonic time the entry expires)
+_user_servers = {}
+_user_servers_lock = threading.Lock()
+# (plex server url, username) of the users already logged as having no token for the server
+_missing_tokens = set()
+
+
+def forget_rejected_token(response, *args, **kwargs):
+    """requests response hook that drops the cached user server whose token plex answered with 401.
+
+    Args:
+        response obj: requests response
+    """
+    if response.status_code != 401:
+        return response
+    token = response.request.headers.get("X-Plex-Token")
+    with _user_servers_lock:
+        for (baseurl, username), (user_plex, _) in list(_user_servers.items()):
+            if token and user_plex._token == token:
+                logging.info(f"Token for {username} was rejected, it will be fetched again")
+                del _user_servers[(baseurl, username)]
+    return response
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while the plex server is considered unhealthy."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Plex server is unhealthy, requests are paused for {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+
+class PlexSession(requests.Session):
+    """requests session that rate limits plex requests, retries failed reads and stops sending when the server keeps failing.
+
+    Args:
+        rate_limit float: requests per second sent to plex, 0 for no limit
+        max_retries int: times a failed GET is sent again
+        retry_backoff float: seconds the first retry waits at most, doubled for every retry after it
+        failure_threshold int: failed requests in a row that open the circuit, 0 to never open it
+        cooldown float: seconds the circuit stays open before a request is tried again
+    """
+
+    def __init__(
+        self,
+        rate_limit=0,
+        max_retries=3,
+        retry_backoff=0.5,
+        failure_threshold=5,
+        cooldown=30
+    ):
+        super().__init__()
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._tokens = max(1.0, rate_limit)
+        self._tokens_updated = monotonic()
+        self._failures = 0
+        self._open_until = 0.0
+
+    def wait_for_token(self):
+        """Blocks until the token bucket allows another request."""
+        if not self.rate_limit:
+            return
+        with self._lock:
+            now = monotonic()
+            burst = max(1.0, self.rate_limit)
+            self._tokens = min(burst, self._tokens + (now - self._tokens_updated) * self.rate_limit)
+            self._tokens_updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate_limit if self._tokens < 0 else 0
+        if wait:
+            metrics.observe("plex_rate_limit_wait_seconds", wait)
+            sleep(wait)
+
+    def circuit_retry_after(self):
+        """Returns how long the circuit stays open.
+
+        Returns:
+            float: seconds until requests are sent again, 0 when the circuit is closed.
+        """
+        with self._lock:
+            return max(0.0, self._open_until - monotonic())
+
+    def record_outcome(self, failed):
+        """Counts failed requests in a row and opens the circuit once there are too many.
+
+        Args:
+            failed bool: the request failed after its retries
+        """
+        with self._lock:
+            if not failed:
+                if self._failures >= self.failure_threshold > 0:
+                    logging.info("Plex server answered again, closing the circuit")
+                self._failures = 0
+                metrics.set_gauge("plex_circuit_open", 0)
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold > 0:
+                self._open_until = monotonic() + self.cooldown
+                metrics.increment("plex_circuit_opened_total")
+                metrics.set_gauge("plex_circuit_open", 1)
+                logging.error(f"{self._failures} plex requests failed in a row, pausing requests for {self.cooldown} seconds")
+
+    def request(self, method, url, *args, **kwargs):
+        retry_after = self.circuit_retry_after()
+        if retry_after:
+            metrics.increment("plex_requests_rejected_total")
+            raise CircuitOpenError(retry_after)
+        attempts = 1 + (self.max_retries if method.upper() in RETRY_METHODS else 0)
+        for attempt in range(attempts):
+            self.wait_for_token()
+            response = None
+            try:
+                response = super().request(method, url, *args, **kwargs)
+                failed = response.status_code in RETRY_STATUS_CODES
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt + 1 == attempts:
+                    self.record_outcome(failed=True)
+                    raise
+                failed = True
+            if not failed or attempt + 1 == attempts:
+                self.record_outcome(failed)
+                return response
+            if response is not None:
+                response.close()
+            metrics.increment("plex_retries_total", method=method.upper(), endpoint=metrics.endpoint_name(url))
+            sleep(random.uniform(0, self.retry_backoff * 2 ** attempt))
+
+
+def raise_if_circuit_open(plex):
+    """Stops a sync while the plex requests are paused, so the playlists left are not skipped one failed request at a time.
+
+    Args:
+        plex obj: plex server object
+
+    Raises:
+        CircuitOpenError: requests to the plex server are paused
+    """
+    session = getattr(plex, "_session", None)
+    if isinstance(session, PlexSession):
+        retry_after = session.circuit_retry_after()
+        if retry_after:
+            raise CircuitOpenError(retry_after)
+
+
+def new_session(
+    pool_size=10,
+    rate_limit=0,
+    max_retries=3,
+    failure_threshold=5,
+    cooldown=30
+):
+    """Builds the requests session shared by the admin and every user plex server.
+
+    Args:
+        pool_size int: connections kept open per host, at least the number of users synced at the same time
+        rate_limit float: requests per second sent to plex, 0 for no limit
+        max_retries int: times a failed GET is sent again
+        failure_threshold int: failed requests in a row that pause every request, 0 to never pause
+        cooldown float: seconds requests are paused for
+
+    Returns:
+        obj: requests session
+    """
+    session = PlexSession(
+        rate_limit=rate_limit,
+        max_retries=max_retries,
+        failure_threshold=failure_threshold,
+        cooldown=cooldown,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.hooks["response"].append(forget_rejected_token)
+    return session
+
+
+def user_server(
+    plex,
+    user,
+    ttl
+):
+    """Returns the plex server signed in as a user, reusing the one from an earlier cycle until it expires.
+
+    Args:
+        plex obj: admin plex server object
+        user obj: plex user object
+        ttl float: seconds a user token and its server are reused
+
+    Returns:
+        obj: plex server object signed in as the user, None when plex has no token of the user for the server
+    """
+    key = (plex._baseurl, user.username or user.title)
+    with _user_servers_lock:
+        cached = _user_servers.get(key)
+    if cached and cached[1] > monotonic():
+        return cached[0]
+    token = user.get_token(plex.machineIdentifier)
+    if token is None:
+        with _user_servers_lock:
+            logged = key in _missing_tokens
+            _missing_tokens.add(key)
+        if not logged:
+            logging.info(f"{key[1]} has no token for {plex.friendlyName}, skipping...")
+        return None
+    # the same as plex.switchUser, which would ask plex for the token again
+    user_plex = PlexServer(plex._baseurl, token=token, session=plex._session, timeout=plex._timeout)
+    with _user_servers_lock:
+        _user_servers[key] = (user_plex, monotonic() + ttl)
+    return user_plex
+
+
+def clear_user_servers():
+    """Forgets every cached user server, used when the admin connection is made again."""
+    with _user_servers_lock:
+        _user_servers.clear()
+        _missing_tokens.clear()
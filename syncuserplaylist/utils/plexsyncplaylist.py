@@ -1,10 +1,11 @@
 
-#todo make a list from this list that is a list of the playlist ID and it instead syncs that list so if you rename a playlist it updates.
 #todo sync playlist cover photo
 #todo add documentation for def
 
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from time import sleep
+from plexapi.exceptions import BadRequest
 from plexapi.exceptions import NotFound
 from plexapi.server import PlexServer
 from datetime import datetime
@@ -14,7 +15,99 @@ import re
 from .cacheplaylist import check_for_playlist_cache
 from .cacheplaylist import make_playlist_cache
 from .cacheplaylist import compare_tracks_to_cache
+from .cacheplaylist import create_playlist_from_pages
 from .cacheplaylist import delete_old_cache
+from .cacheplaylist import finish_sync_checkpoint
+from .cacheplaylist import iter_playlist_track_pages
+from .cacheplaylist import load_playlist_copy_key
+from .cacheplaylist import lock_playlist_cache
+from .cacheplaylist import record_playlist_copy
+from .cacheplaylist import record_sync_checkpoint
+from .cacheplaylist import start_sync_checkpoint
+from . import metrics
+from . import sharding
+from . import tracing
+from .plexsession import raise_if_circuit_open
+from .plexsession import user_server
+from .userdirectory import resolve_users
+from .userdirectory import shared_users
+
+
+def build_playlist_index(plex):
+    """Lists the playlists of an account once and indexes them by title and rating key for the rest of the run.
+
+    Args:
+        plex obj: plexserver object of the admin or a user
+
+    Returns:
+        dict: dictionary with "titles" mapping title to playlist and "ratingKeys" mapping rating key to playlist
+    """
+    playlist_index = {"titles": {}, "ratingKeys": {}}
+    for playlist in plex.playlists():
+        playlist_index["titles"].setdefault(playlist.title, playlist)
+        playlist_index["ratingKeys"][int(playlist.ratingKey)] = playlist
+    return playlist_index
+
+
+def find_playlist(
+    playlist_index,
+    title
+):
+    """Looks up a playlist by title in a playlist index.
+
+    Args:
+        playlist_index dict: playlist index from build_playlist_index
+        title str: playlist title
+
+    Returns:
+        obj: playlist object from plexapi
+
+    Raises:
+        NotFound: if the account has no playlist with the title
+    """
+    try:
+        return playlist_index["titles"][title]
+    except KeyError:
+        raise NotFound(f"Invalid playlist title: {title}")
+
+
+def find_playlist_copy(
+    user_playlist_index,
+    playlist,
+    user,
+    is_test,
+    copy_key
+):
+    """Finds a user's copy of an admin playlist by the rating key it was last synced to, falling back to the title.
+    A copy found by rating key under another title is renamed to the admin playlist title.
+
+    Args:
+        user_playlist_index dict: playlist index of the user from build_playlist_index
+        playlist obj: admin playlist object from plexapi
+        user obj: plex user object
+        is_test bool: bool indicating whether to run as test
+        copy_key int: rating key of the copy from load_playlist_copy_key, None if no copy is known
+
+    Returns:
+        obj: the user's copy of the playlist
+
+    Raises:
+        NotFound: if the user has no copy of the playlist
+    """
+    user_playlist = user_playlist_index["ratingKeys"].get(copy_key)
+    if user_playlist is None:
+        return find_playlist(user_playlist_index, playlist.title)
+    if user_playlist.title != playlist.title:
+        print(
+            f"Renaming '{user.username or user.title}' playlist '{user_playlist.title}' to '{playlist.title}'"
+        )
+        if not is_test:
+            try:
+                user_playlist.editTitle(playlist.title)
+                user_playlist.title = playlist.title
+            except Exception as e:
+                logging.error(f"Failed to rename '{user_playlist.title}'! Error: {e}")
+    return user_playlist
 
 
 def update_playlist_summary(
@@ -52,11 +145,13 @@ def update_playlist_summary(
             )
     return target_playlist
 
+@metrics.track_caller
 def create_playlist(
     username,
     user_plex,
     playlist,
-    is_test
+    is_test,
+    cache_key=None
 ):
     """Create a new playlist for a user in plex who does not have a specific playlist.
 
@@ -65,13 +160,15 @@ def create_playlist(
         user_plex obj: plexserver object under specific username
         playlist obj: playlist object from plexapi
         is_test bool: bool indicating whether to run as test
+        cache_key int: rating key of the admin playlist the cache is saved under, None when the new playlist is made on the admin account
 
     Returns:
-        obj: returns plex playlist object
+        obj: returns the new plex playlist object, or the given playlist when running as test
     """
     if not is_test:
-        user_plex.createPlaylist(playlist.title, items=playlist.items())
-        new_playlist = user_plex.playlist(playlist.title)
+        new_playlist = create_playlist_from_pages(user_plex, playlist.title, iter_playlist_track_pages(playlist))
+        if new_playlist is None:
+            raise BadRequest(f"'{playlist.title}' has no tracks to copy")
         update_playlist_summary(
             updated_playlist=playlist,
             target_playlist=new_playlist,
@@ -80,161 +177,162 @@ def create_playlist(
         )
         make_playlist_cache(
             playlist=playlist,
-            is_test=is_test
+            is_test=is_test,
+            cache_key=cache_key if cache_key is not None else new_playlist.ratingKey
         )
     print(f"Created '{playlist.title}' for '{username.username or username.title}'.")
     if is_test:
         print(
             f"'{playlist.title}' summary '{playlist.summary}' would have been copied to new playlist for '{username.username or username.title}'."
         )
-    return playlist
+        return playlist
+    return new_playlist
 
 
-def sync_playlists(
+def sync_playlist_for_user(
     plex,
-    playlist_list,
-    user_list,
-    sync_user_created_playlist,
+    playlist,
+    user,
+    user_plex,
+    user_playlist_index,
     run_as_test
 ):
-    """Compares the playlist given in the list to those listed in the for each user in the user list provided. Playlists are then cached and compared against the cache as a way to know when to update to a new change.
+    """Compares an admin playlist to the copy in a users account and creates the copy if the user does not have it.
 
     Args:
         plex obj: plex server object
-        playlist_list list: list of string names that correspond to playlist names.
-        user_list list: list of string names that correspond to user names.
-        sync_user_created_playlist bool: bool indicating whether to sync playlist made by users that are not on admin account.
+        playlist obj: playlist object from plexapi
+        user obj: plex user object
+        user_plex obj: plexserver object under specific username
+        user_playlist_index dict: playlist index of the user from build_playlist_index
         run_as_test bool: bool indicating whether to run as test
+
+    Returns:
+        str: result of compare_tracks_to_cache or "created", None when the playlist could not be synced.
     """
     try:
-        delete_old_cache(
-            playlist_list=playlist_list,
-            is_test=run_as_test
-        )
-    except Exception as e:
-        print(f"Failed to delete old cache: {e}")
+        try:
+            print(
+                f"'{playlist.title}' found in '{user.username or user.title}' playlist, checking for most updated playlist"
+            )
+            if not check_for_playlist_cache(
+                playlist=playlist
+            ):
+                logging.info("Playlist cache does not exist. Creating...")
+                make_playlist_cache(
+                    playlist=playlist,
+                    is_test=run_as_test
+                )
+            copy_key = load_playlist_copy_key(playlist, user)
+            user_playlist = find_playlist_copy(user_playlist_index, playlist, user, run_as_test, copy_key)
+            logging.info(f"Comparing {user.username or user.title}' playlist {playlist.title} to cache")
+            result = compare_tracks_to_cache(
+                plexserver=plex,
+                playlist=user_playlist,
+                username=user,
+                is_test=run_as_test,
+                cache_key=playlist.ratingKey
+            )
+            # the copy is only written when it was found by title or replaced since the last sync
+            if not run_as_test and int(user_playlist.ratingKey) != copy_key:
+                record_playlist_copy(playlist, user, user_playlist)
+            return result
+        except NotFound:
+            print(
+                f"Playlist '{playlist.title}' not found for '{user.username or user.title}' adding playlist to users account"
+            )
+            user_playlist = create_playlist(
+                username=user,
+                user_plex=user_plex,
+                playlist=playlist,
+                is_test=run_as_test,
+                cache_key=playlist.ratingKey,
+            )
+            if not run_as_test:
+                record_playlist_copy(playlist, user, user_playlist)
+            return "created"
+    except:
+        print("No playlist to sync, continuing...")
 
-    account = plex.myPlexAccount()
-    if run_as_test:
-        print("Running sync in test mode, no changes will be actually be applied.")
 
-    if not user_list:
-        print("No users were specified, so all users will be used.")
-        users = account.users()
-    else:
-        valid_usernames, not_usernames = [], []
+@metrics.track_caller
+def sync_user(
+    plex,
+    account,
+    user,
+    playlists,
+    playlist_list,
+    playlist_names,
+    sync_user_created_playlist,
+    run_as_test,
+    user_server_ttl=3600,
+    find_user_playlists=True,
+    cycle=None,
+    completed_playlists=frozenset()
+):
+    """Syncs every admin playlist to a single user and adds new playlists made by the user to the admin account.
 
-        for listed_username in user_list:
-            if listed_username in [u.username or u.title for u in account.users()]:
-                valid_usernames.append(listed_username)
-                users = [account.user(username) for username in valid_usernames]
-            else:
-                not_usernames.append(listed_username)
-        if not_usernames:
-            print("These usernames are not valid", *not_usernames, sep=", ")
+    Args:
+        plex obj: plex server object
+        account obj: plex account object of the admin
+        user obj: plex user object
+        playlists list: list of admin playlist objects to sync
+        playlist_list list: list of string names that correspond to playlist names.
+        playlist_names list: list of admin playlist titles
+        sync_user_created_playlist bool: bool indicating whether to sync playlist made by users that are not on admin account.
+        run_as_test bool: bool indicating whether to run as test
+        user_server_ttl float: seconds a user token and its plex server are reused across runs
+        find_user_playlists bool: look for new playlists made by the user, False when only some playlists are due
+        cycle int: optional sync cycle number the synced playlists are recorded in
+        completed_playlists set: rating keys of the admin playlists already synced to the user in a resumed cycle
 
-    if not playlist_list:
-        print("No playlist were provided, so all playlist will be synced")
-        playlists = plex.playlists()
-    else:
-        playlist_to_sync, invalid_playlist, new_playlist_from_user = [], [], []
-        playlist_names = [p.title for p in plex.playlists()]
-        for sync_playlist_title in playlist_list:
-            if sync_playlist_title in playlist_names:
-                playlist_to_sync.append(sync_playlist_title)
-            elif sync_playlist_title not in [
-                p.title for p in playlist_to_sync
-            ]:
-                invalid_playlist.append(sync_playlist_title)
-        playlists = [plex.playlist(playlist) for playlist in playlist_to_sync]
-        if invalid_playlist:
-            print("These playlist names are not valid", *invalid_playlist, sep=", ")
+    Returns:
+        dict: admin playlist rating key to the result of sync_playlist_for_user.
+    """
+    user_name = user.username or user.title
+    with tracing.profiled(), tracing.span("sync user", user=user_name):
+        with tracing.span("connect user", user=user_name):
+            user_plex = user_server(plex, user, user_server_ttl)
+            if user_plex is None:
+                return {}
+            user_playlist_index = build_playlist_index(user_plex)
 
-    for user in users:
-        user_plex = plex.switchUser(user.username or user.title)
+        results = {}
+        for playlist in playlists:
+            if int(playlist.ratingKey) in completed_playlists:
+                continue
+            raise_if_circuit_open(plex)
+            with tracing.span("sync playlist", playlist=playlist.title, user=user_name), lock_playlist_cache(playlist):
+                results[int(playlist.ratingKey)] = sync_playlist_for_user(
+                    plex=plex,
+                    playlist=playlist,
+                    user=user,
+                    user_plex=user_plex,
+                    user_playlist_index=user_playlist_index,
+                    run_as_test=run_as_test
+                )
+            record_sync_checkpoint(cycle, playlist.ratingKey, user_name, results[int(playlist.ratingKey)])
+        if not find_user_playlists:
+            return results
 
+        new_playlist_from_user, user_playlists = [], []
         if playlist_list is None and sync_user_created_playlist:
-            user_playlists = user_plex.playlists()
+            user_playlists = list(user_playlist_index["ratingKeys"].values())
         else:
             try:
-                user_playlist_names = [p.title for p in user_plex.playlists()]
                 for sync_playlist_title in playlist_list:
                     if (
-                        sync_playlist_title in user_playlist_names
+                        sync_playlist_title in user_playlist_index["titles"]
                         and sync_user_created_playlist
                         and not sync_playlist_title in playlist_names
                     ):
                         new_playlist_from_user.append(sync_playlist_title)
                 user_playlists = [
-                    user_plex.playlist(playlist) for playlist in new_playlist_from_user
+                    find_playlist(user_playlist_index, playlist) for playlist in new_playlist_from_user
                 ]
             except Exception:
                 print(f"Playlist not found in {user.username or user.title} account continuing...")
 
-    try:
-        for playlist in playlists:
-            if playlist.smart:
-                print(f"'{playlist.title}' is a smart playlist skipping...")
-            elif not playlist.isAudio:
-                print(f"'{playlist.title}' is a not an audio playlist skipping...")
-            else:
-                try:
-                    print(
-                        f"'{playlist.title}' found in '{account.username or account.title}' playlist, checking for most updated playlist"
-                    )
-                    if not check_for_playlist_cache(
-                        playlist=playlist
-                    ):
-                        logging.info("Playlist cache does not exist. Creating...")
-                        make_playlist_cache(
-                            playlist=playlist,
-                            is_test=run_as_test
-                        )
-                    logging.info(f"Comparing {account.username or account.title}' playlist {playlist.title} to cache")
-                    compare_tracks_to_cache(
-                        plexserver=plex,
-                        playlist=playlist,
-                        username=account,
-                        is_test=run_as_test
-                    )
-                    for user in users:
-                        user_plex = plex.switchUser(user.username or user.title)
-
-                        try:
-                            try:
-                                print(
-                                    f"'{playlist.title}' found in '{user.username or user.title}' playlist, checking for most updated playlist"
-                                )
-                                if not check_for_playlist_cache(
-                                    playlist=playlist
-                                ):
-                                    logging.info("Playlist cache does not exist. Creating...")
-                                    make_playlist_cache(
-                                        playlist=playlist,
-                                        is_test=run_as_test
-                                    )
-                                logging.info(f"Comparing {user.username or user.title}' playlist {playlist.title} to cache")
-                                compare_tracks_to_cache(
-                                    plexserver=plex,
-                                    playlist=user_plex.playlist(playlist.title),
-                                    username=user,
-                                    is_test=run_as_test
-                                )
-                            except NotFound:
-                                print(
-                                    f"Playlist '{playlist.title}' not found for '{user.username or user.title}' adding playlist to users account"
-                                )
-                                create_playlist(
-                                    username=user,
-                                    user_plex=user_plex,
-                                    playlist=playlist,
-                                    is_test=run_as_test,
-                                )
-                        except:
-                            print("No playlist to sync, continuing...")
-                except:
-                    pass
-
         if not set(new_playlist_from_user).issubset(set(playlist_names)):
             print( user_playlists )
             try:
@@ -253,18 +351,21 @@ def sync_playlists(
                         print(
                             f"Adding playlist '{playlist.title}' to '{account.username or account.title}'..."
                         )
-                        create_playlist(
+                        admin_playlist = create_playlist(
                             username=account,
                             user_plex=plex,
                             playlist=playlist,
                             is_test=run_as_test,
                         )
+                        results[int(admin_playlist.ratingKey)] = "created"
+                        if not run_as_test:
+                            record_playlist_copy(admin_playlist, user, playlist)
                         if not check_for_playlist_cache(
-                            playlist=playlist
+                            playlist=admin_playlist
                         ):
                             logging.info("Playlist cache does not exist. Creating...")
                             make_playlist_cache(
-                            playlist=playlist,
+                            playlist=admin_playlist,
                             is_test=run_as_test
                     )
             except:
@@ -273,7 +374,198 @@ def sync_playlists(
                 )
         else:
             print(f"No new sync playlist from '{user.username or user.title}'")
+        return results
+
+
+@metrics.track_caller
+def sync_playlists(
+    plex,
+    playlist_list,
+    user_list,
+    sync_user_created_playlist,
+    run_as_test,
+    sync_concurrency=1,
+    changed_playlists=None,
+    user_server_ttl=3600,
+    user_directory_ttl=3600,
+    due_units=None,
+    checkpoint=False
+):
+    """Compares the playlist given in the list to those listed in the for each user in the user list provided. Playlists are then cached and compared against the cache as a way to know when to update to a new change.
+    The admin playlists are compared first and then each user the server is shared with is synced in a thread pool.
+    With checkpoint every synced playlist of a full sync is recorded, so a sync that was interrupted is resumed where it stopped.
+
+    Args:
+        plex obj: plex server object
+        playlist_list list: list of string names that correspond to playlist names.
+        user_list list: list of string names that correspond to user names.
+        sync_user_created_playlist bool: bool indicating whether to sync playlist made by users that are not on admin account.
+        run_as_test bool: bool indicating whether to run as test
+        sync_concurrency int: max number of users synced at the same time
+        changed_playlists list: optional list of admin playlist rating keys to limit the run to, None syncs every playlist.
+        user_server_ttl float: seconds a user token and its plex server are reused across runs
+        user_directory_ttl float: seconds the cached list of plex users is used before asking plex again
+        due_units set: optional set of (admin playlist rating key, username or None for the admin) to limit the run to, None syncs every pair.
+        checkpoint bool: record the synced playlists of a full sync and resume an interrupted one
+
+    Returns:
+        dict: (admin playlist rating key, username or None for the admin) to the result of the comparison.
+    """
+    account = plex.myPlexAccount()
+    if run_as_test:
+        print("Running sync in test mode, no changes will be actually be applied.")
+
+    if not any(user_list or []):
+        print("No users were specified, so all users will be used.")
+    with tracing.span("resolve users"):
+        users, not_usernames = resolve_users(account, user_list or [], user_directory_ttl)
+        users = shared_users(users, plex.machineIdentifier)
+    if not_usernames:
+        print("These usernames are not valid", *not_usernames, sep=", ")
+
+    playlist_names = []
+    with tracing.span("list playlists"):
+        playlist_index = build_playlist_index(plex)
+    if not playlist_list:
+        print("No playlist were provided, so all playlist will be synced")
+        playlists = list(playlist_index["ratingKeys"].values())
+    else:
+        playlist_to_sync, invalid_playlist = [], []
+        playlist_names = list(playlist_index["titles"])
+        for sync_playlist_title in playlist_list:
+            if sync_playlist_title in playlist_names:
+                playlist_to_sync.append(sync_playlist_title)
+            elif sync_playlist_title not in [
+                p.title for p in playlist_to_sync
+            ]:
+                invalid_playlist.append(sync_playlist_title)
+        playlists = [find_playlist(playlist_index, playlist) for playlist in playlist_to_sync]
+        if invalid_playlist:
+            print("These playlist names are not valid", *invalid_playlist, sep=", ")
+
+    synced_playlists = playlists
+    if changed_playlists is not None:
+        playlists = [p for p in playlists if int(p.ratingKey) in changed_playlists]
+    if due_units is not None:
+        due_keys = {key for key, _ in due_units}
+        playlists = [p for p in playlists if int(p.ratingKey) in due_keys]
+        due_usernames = {username for _, username in due_units}
+        users = [user for user in users if (user.username or user.title) in due_usernames]
+
+    cycle, completed_units = None, {}
+    if checkpoint and changed_playlists is None and due_units is None and not run_as_test:
+        cycle, completed_units = start_sync_checkpoint()
+        if completed_units:
+            print(f"Resuming the interrupted sync, {len(completed_units)} playlists were already synced.")
+
+    results = {}
+
+    sync_playlist_objects = []
+    try:
+        for playlist in playlists:
+            raise_if_circuit_open(plex)
+            if playlist.smart:
+                print(f"'{playlist.title}' is a smart playlist skipping...")
+            elif not playlist.isAudio:
+                print(f"'{playlist.title}' is a not an audio playlist skipping...")
+            else:
+                try:
+                    print(
+                        f"'{playlist.title}' found in '{account.username or account.title}' playlist, checking for most updated playlist"
+                    )
+                    with tracing.span("sync playlist", playlist=playlist.title, user=account.username or account.title), lock_playlist_cache(playlist):
+                        if not check_for_playlist_cache(
+                            playlist=playlist
+                        ):
+                            logging.info("Playlist cache does not exist. Creating...")
+                            make_playlist_cache(
+                                playlist=playlist,
+                                is_test=run_as_test
+                            )
+                        if (int(playlist.ratingKey), None) in completed_units:
+                            results[(int(playlist.ratingKey), None)] = completed_units[(int(playlist.ratingKey), None)]
+                        elif (
+                            due_units is None or (int(playlist.ratingKey), None) in due_units
+                        ) and sharding.owns(int(playlist.ratingKey), None):
+                            logging.info(f"Comparing {account.username or account.title}' playlist {playlist.title} to cache")
+                            results[(int(playlist.ratingKey), None)] = compare_tracks_to_cache(
+                                plexserver=plex,
+                                playlist=playlist,
+                                username=account,
+                                is_test=run_as_test
+                            )
+                            record_sync_checkpoint(cycle, playlist.ratingKey, None, results[(int(playlist.ratingKey), None)])
+                    sync_playlist_objects.append(playlist)
+                except:
+                    pass
     except:
         print("No playlist to sync, continuing...")
+    raise_if_circuit_open(plex)
+
+    if due_units is None and sharding.owns("delete old cache", plex.machineIdentifier):
+        try:
+            with tracing.span("delete old cache"):
+                delete_old_cache(
+                    playlists=synced_playlists,
+                    is_test=run_as_test,
+                    plex=plex
+                )
+        except Exception as e:
+            print(f"Failed to delete old cache: {e}")
+
+    # with more than one worker each user playlist and the search for new playlists of a user belong to one worker
+    user_work = {}
+    for user in users:
+        user_name = user.username or user.title
+        user_playlists = [
+            playlist
+            for playlist in sync_playlist_objects
+            if (due_units is None or (int(playlist.ratingKey), user_name) in due_units)
+            and sharding.owns(int(playlist.ratingKey), user_name)
+        ]
+        # only users' own playlists are searched for, so there is nothing to find when they are not synced
+        find_user_playlists = (
+            due_units is None
+            and sync_user_created_playlist
+            and sharding.owns("user playlists", user_name)
+        )
+        if user_playlists or find_user_playlists:
+            user_work[user_name] = (user, user_playlists, find_user_playlists)
+
+    with ThreadPoolExecutor(max_workers=max(1, sync_concurrency)) as executor:
+        futures = {
+            executor.submit(
+                sync_user,
+                plex=plex,
+                account=account,
+                user=user,
+                playlists=user_playlists,
+                playlist_list=playlist_list,
+                playlist_names=playlist_names,
+                sync_user_created_playlist=sync_user_created_playlist,
+                run_as_test=run_as_test,
+                user_server_ttl=user_server_ttl,
+                find_user_playlists=find_user_playlists,
+                cycle=cycle,
+                completed_playlists={
+                    playlist_key
+                    for playlist_key, username in completed_units
+                    if username == user_name
+                },
+            ): user
+            for user_name, (user, user_playlists, find_user_playlists) in user_work.items()
+        }
+        for future in as_completed(futures):
+            user = futures[future]
+            try:
+                for playlist_key, result in future.result().items():
+                    results[(playlist_key, user.username or user.title)] = result
+            except Exception as e:
+                print(f"Failed to sync playlists for '{user.username or user.title}': {e}")
+    for unit, result in completed_units.items():
+        results.setdefault(unit, result)
+    raise_if_circuit_open(plex)
+    finish_sync_checkpoint(cycle)
+    return results
 
-logging.basicConfig(level=logging.INFO)
\ No newline at end of file
+logging.basicConfig(level=logging.INFO)
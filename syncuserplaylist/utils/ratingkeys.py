@@ -0,0 +1,121 @@
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO)
+
+# below this many rating keys python sets are faster than building numpy arrays
+VECTORIZE_MIN_KEYS = 2000
+# widest rating key range numpy looks keys up in with a one byte per key table
+MAX_TABLE_RANGE = 1 << 24
+
+# numpy module once imported, False when it is not installed or too old and the python set fallback is used
+_numpy = None
+_numpy_lock = threading.Lock()
+
+
+def load_numpy():
+    """Imports numpy on first use so small libraries do not pay for it.
+    numpy is optional, versions before 1.24 have no table lookup and are not used either.
+
+    Returns:
+        obj: numpy module, None when numpy is not installed
+    """
+    global _numpy
+    with _numpy_lock:
+        if _numpy is None:
+            try:
+                import numpy
+
+                _numpy = numpy if tuple(map(int, numpy.__version__.split(".")[:2])) >= (1, 24) else False
+            except ImportError:
+                _numpy = False
+            if not _numpy:
+                logging.info("numpy 1.24 or newer is not installed, comparing rating keys with python sets")
+    return _numpy or None
+
+
+def vectorized(*key_lists):
+    """Checks if the rating key lists are large enough to be compared as numpy arrays.
+
+    Args:
+        *key_lists: lists of rating keys
+
+    Returns:
+        obj: numpy module when the keys should be compared as arrays, None for python sets
+    """
+    if sum(len(keys) for keys in key_lists) < VECTORIZE_MIN_KEYS:
+        return None
+    return load_numpy()
+
+
+def key_array(numpy, keys):
+    """Packs rating keys into a compact int64 array.
+
+    Args:
+        numpy obj: numpy module
+        keys list: list of rating keys
+
+    Returns:
+        obj: numpy array of rating keys
+    """
+    return numpy.fromiter(keys, dtype=numpy.int64, count=len(keys))
+
+
+def lookup_table_fits(keys):
+    """Checks if numpy can look keys up in a table spanning the rating keys, which is much faster than sets.
+    Rating keys are handed out in order so the keys of a library are close together, a wider range is faster with sets.
+
+    Args:
+        keys obj: numpy array of rating keys to look up in
+
+    Returns:
+        bool: True if the range of the keys fits in MAX_TABLE_RANGE
+    """
+    return not keys.size or int(keys.max()) - int(keys.min()) < MAX_TABLE_RANGE
+
+
+def keys_not_in(
+    keys,
+    other_keys
+):
+    """Finds the rating keys that are not in another list, once each and in their first order.
+
+    Args:
+        keys list: list of rating keys
+        other_keys list: list or set of rating keys to leave out
+
+    Returns:
+        list: list of rating keys
+    """
+    numpy = vectorized(keys, other_keys)
+    if numpy is not None:
+        other_key_array = key_array(numpy, list(other_keys))
+        if lookup_table_fits(other_key_array):
+            missing = key_array(numpy, keys)
+            missing = missing[~numpy.isin(missing, other_key_array, kind="table")]
+            _, first_positions = numpy.unique(missing, return_index=True)
+            return missing[numpy.sort(first_positions)].tolist()
+    other_key_set = other_keys if isinstance(other_keys, (set, frozenset)) else set(other_keys)
+    return [key for key in dict.fromkeys(keys) if key not in other_key_set]
+
+
+def contains_all(
+    keys,
+    other_keys
+):
+    """Checks if every rating key is in another list, like set.issubset.
+
+    Args:
+        keys list: list of rating keys
+        other_keys list: list or set of rating keys
+
+    Returns:
+        bool: True if no rating key is missing from other_keys
+    """
+    numpy = vectorized(keys, other_keys)
+    if numpy is not None:
+        other_key_array = key_array(numpy, list(other_keys))
+        if lookup_table_fits(other_key_array):
+            return bool(numpy.isin(key_array(numpy, keys), other_key_array, kind="table").all())
+    other_key_set = other_keys if isinstance(other_keys, (set, frozenset)) else set(other_keys)
+    return all(key in other_key_set for key in keys)
@@ -0,0 +1,121 @@
+import heapq
+import itertools
+import logging
+import threading
+from time import monotonic
+
+logging.basicConfig(level=logging.INFO)
+
+# results of a sync that mean the playlist changed on either side
+CHANGED_RESULTS = ("updated_plex", "updated_cache", "created")
+
+# (admin playlist rating key, username or None for the admin) -> (monotonic time the unit is due, seconds between syncs)
+_units = {}
+# heap of (due time, insertion order, unit), entries that no longer match _units are skipped when popped
+_due_queue = []
+_queue_order = itertools.count()
+_scheduler_lock = threading.Lock()
+
+
+def _schedule_unit(
+    unit,
+    due,
+    interval
+):
+    _units[unit] = (due, interval)
+    heapq.heappush(_due_queue, (due, next(_queue_order), unit))
+
+
+def next_interval(
+    interval,
+    result,
+    min_interval,
+    max_interval
+):
+    """Works out how long to wait before a unit is synced again.
+    The interval drops to the minimum after a change and doubles while the playlist stays idle.
+
+    Args:
+        interval float: seconds between syncs before this result, None for a new unit
+        result str: result of the sync from sync_playlists
+        min_interval float: shortest time between syncs
+        max_interval float: longest time between syncs
+
+    Returns:
+        float: seconds until the next sync.
+    """
+    if interval is None or result in CHANGED_RESULTS:
+        return min_interval
+    return max(min_interval, min(interval * 2, max_interval))
+
+
+def reschedule(
+    results,
+    min_interval,
+    max_interval,
+    full_run=False
+):
+    """Schedules the next sync of every unit that was synced.
+    A change to a playlist is copied to every user of it, so all units of a changed playlist drop to the minimum interval.
+
+    Args:
+        results dict: (admin playlist rating key, username or None) to result from sync_playlists
+        min_interval float: shortest time between syncs
+        max_interval float: longest time between syncs
+        full_run bool: the results cover every unit, units missing from them are no longer synced
+    """
+    now = monotonic()
+    changed_playlists = {playlist_key for (playlist_key, _), result in results.items() if result in CHANGED_RESULTS}
+    with _scheduler_lock:
+        if full_run:
+            for unit in set(_units) - set(results):
+                del _units[unit]
+        for unit, result in results.items():
+            if unit[0] in changed_playlists:
+                interval = min_interval
+            else:
+                interval = next_interval(_units.get(unit, (None, None))[1], result, min_interval, max_interval)
+            _schedule_unit(unit, now + interval, interval)
+        for unit, (due, _) in list(_units.items()):
+            if unit[0] in changed_playlists and unit not in results:
+                _schedule_unit(unit, min(due, now + min_interval), min_interval)
+        if full_run:
+            _due_queue[:] = [(due, next(_queue_order), unit) for unit, (due, _) in _units.items()]
+            heapq.heapify(_due_queue)
+
+
+def pop_due_units():
+    """Takes the units whose next sync time has passed off the queue.
+
+    Returns:
+        set: (admin playlist rating key, username or None) that are due.
+    """
+    now = monotonic()
+    due_units = set()
+    with _scheduler_lock:
+        while _due_queue and _due_queue[0][0] <= now:
+            due, _, unit = heapq.heappop(_due_queue)
+            if _units.get(unit, (None,))[0] == due:
+                due_units.add(unit)
+    return due_units
+
+
+def seconds_until_due():
+    """Returns how long until the next unit is due.
+
+    Returns:
+        float: seconds until the next sync, None when nothing is scheduled.
+    """
+    with _scheduler_lock:
+        while _due_queue and _units.get(_due_queue[0][2], (None,))[0] != _due_queue[0][0]:
+            heapq.heappop(_due_queue)
+        if not _due_queue:
+            return None
+        return max(0, _due_queue[0][0] - monotonic())
+
+
+def clear_schedule():
+    """Forgets every scheduled unit."""
+    with _scheduler_lock:
+        _units.clear()
+        _due_queue.clear()
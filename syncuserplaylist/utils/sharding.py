@@ -0,0 +1,78 @@
+import hashlib
+import logging
+import os
+from bisect import bisect
+
+logging.basicConfig(level=logging.INFO)
+
+# points each worker gets on the hash ring, more points spread the work more evenly
+VIRTUAL_NODES = 100
+
+
+def ring_hash(key):
+    """Hashes a key to a point on the hash ring the same way in every process, unlike hash().
+
+    Args:
+        key str: key to hash
+
+    Returns:
+        int: point on the ring
+    """
+    return int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:16], 16)
+
+
+def build_ring(count):
+    """Places VIRTUAL_NODES points for every worker on a consistent hash ring.
+    When the number of workers changes only the work between the moved points changes worker.
+
+    Args:
+        count int: number of workers
+
+    Returns:
+        tuple: sorted list of points and the worker index of each point
+    """
+    points = sorted(
+        (ring_hash(f"worker-{worker}-{node}"), worker)
+        for worker in range(count)
+        for node in range(VIRTUAL_NODES)
+    )
+    return [point for point, _ in points], [worker for _, worker in points]
+
+
+def worker_for(*parts):
+    """Finds the worker a piece of work belongs to.
+
+    Args:
+        *parts: values that identify the work, such as the admin playlist rating key and username
+
+    Returns:
+        int: index of the worker
+    """
+    position = bisect(_ring_points, ring_hash("/".join(str(part) for part in parts)))
+    return _ring_workers[position % len(_ring_workers)]
+
+
+def owns(*parts):
+    """Checks if this worker does a piece of work, always True when there is one worker.
+
+    Args:
+        *parts: values that identify the work, such as the admin playlist rating key and username
+
+    Returns:
+        bool: True if the work belongs to this worker
+    """
+    return worker_count == 1 or worker_for(*parts) == worker_index
+
+
+try:
+    worker_count = max(1, int(os.getenv("WORKER_COUNT", default=1)))
+except ValueError:
+    worker_count = 1
+try:
+    worker_index = int(os.getenv("WORKER_INDEX", default=0))
+except ValueError:
+    worker_index = 0
+if not 0 <= worker_index < worker_count:
+    logging.error(f"WORKER_INDEX {worker_index} is not between 0 and {worker_count - 1}, running as worker 0")
+    worker_index = 0
+_ring_points, _ring_workers = build_ring(worker_count)
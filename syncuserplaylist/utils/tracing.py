@@ -0,0 +1,200 @@
+import cProfile
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+
+logging.basicConfig(level=logging.INFO)
+
+# trace and profile files of older cycles are deleted once there are more than this many of each
+KEEP_CYCLES = 50
+
+# spans of the running cycle as chrome trace events, only collected between start_cycle and finish_cycle
+_events = []
+_thread_names = {}
+_profiles = []
+_trace_lock = threading.Lock()
+_tracing = False
+_profiling = False
+_cycle_start = 0.0
+# set while a thread is inside a profiled block so nested blocks do not start a second profiler
+_profiled_thread = threading.local()
+# from python 3.12 one cProfile sees every thread and no second one can run at the same time
+SHARED_PROFILER = sys.version_info >= (3, 12)
+_shared_profile_running = False
+
+
+def start_cycle(profile=False):
+    """Starts collecting the spans of a sync cycle.
+
+    Args:
+        profile bool: also run cProfile inside the profiled blocks of the cycle
+    """
+    global _tracing, _profiling, _cycle_start
+    with _trace_lock:
+        _events.clear()
+        _thread_names.clear()
+        _profiles.clear()
+        _cycle_start = perf_counter()
+        _tracing = True
+        _profiling = profile
+
+
+@contextmanager
+def span(name, **tags):
+    """Times the code inside the block as one span of the cycle timeline, does nothing while no cycle is traced.
+
+    Args:
+        name str: name of the phase, such as "load cache"
+        **tags: values shown with the span, such as the user and playlist
+    """
+    if not _tracing:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        ended = perf_counter()
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": round((started - _cycle_start) * 1000000),
+            "dur": round((ended - started) * 1000000),
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": {tag: str(value) for tag, value in tags.items() if value is not None},
+        }
+        with _trace_lock:
+            if _tracing:
+                _events.append(event)
+                _thread_names[thread.ident] = thread.name
+
+
+def start_profile():
+    """Starts a cProfile profiler for a profiled block, unless one already covers the thread.
+    When cProfile cannot be started the rest of the cycle runs without profiling.
+
+    Returns:
+        obj: the running profiler, None when the block is not profiled by it
+    """
+    global _shared_profile_running, _profiling
+    if not _profiling or getattr(_profiled_thread, "active", False):
+        return None
+    with _trace_lock:
+        if SHARED_PROFILER:
+            if _shared_profile_running:
+                return None
+            _shared_profile_running = True
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError as e:
+        with _trace_lock:
+            _shared_profile_running = False
+            if _profiling:
+                logging.error(f"Failed to start cProfile, the cycle is not profiled. Error: {e}")
+            _profiling = False
+        return None
+    _profiled_thread.active = True
+    return profile
+
+
+def stop_profile(profile):
+    """Stops a profiler started by start_profile and keeps its stats for the cycle.
+
+    Args:
+        profile obj: the running profiler
+    """
+    global _shared_profile_running
+    profile.disable()
+    _profiled_thread.active = False
+    with _trace_lock:
+        if SHARED_PROFILER:
+            _shared_profile_running = False
+        if _profiling:
+            _profiles.append(profile)
+
+
+@contextmanager
+def profiled():
+    """Runs cProfile over the code inside the block when the cycle is profiled.
+    Before python 3.12 cProfile only sees the thread it runs in, so every thread of the sync opens its own block and the results are merged.
+    From 3.12 the outermost block profiles every thread and the blocks inside it do nothing.
+    """
+    profile = start_profile()
+    if profile is None:
+        yield
+        return
+    try:
+        yield
+    finally:
+        stop_profile(profile)
+
+
+def remove_old_files(
+    directory,
+    suffix
+):
+    """Deletes the oldest trace or profile files so at most KEEP_CYCLES are kept.
+
+    Args:
+        directory str: folder the files are written to
+        suffix str: file ending of the kind of file
+    """
+    files = sorted(file for file in os.listdir(directory) if file.endswith(suffix))
+    for file in files[:-KEEP_CYCLES]:
+        os.remove(os.path.join(directory, file))
+
+
+def finish_cycle(directory):
+    """Stops collecting spans and writes the timeline of the cycle, and the merged cProfile stats when it was profiled.
+    The timeline is chrome trace json that opens in chrome://tracing or https://ui.perfetto.dev, the stats open with pstats or snakeviz.
+
+    Args:
+        directory str: folder the files are written to
+
+    Returns:
+        list: paths of the written files
+    """
+    global _tracing, _profiling
+    with _trace_lock:
+        if not _tracing:
+            return []
+        _tracing = _profiling = False
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_id, "args": {"name": thread_name}}
+            for thread_id, thread_name in _thread_names.items()
+        ] + sorted(_events, key=lambda event: event["ts"])
+        profiles = list(_profiles)
+        _events.clear()
+        _profiles.clear()
+
+    paths = []
+    try:
+        os.makedirs(directory, exist_ok=True)
+        cycle_name = f"cycle-{datetime.now():%Y%m%d-%H%M%S-%f}"
+        trace_path = os.path.join(directory, f"{cycle_name}.trace.json")
+        with open(trace_path, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+        paths.append(trace_path)
+        remove_old_files(directory, ".trace.json")
+        if profiles:
+            profile_path = os.path.join(directory, f"{cycle_name}.prof")
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(profile_path)
+            paths.append(profile_path)
+            remove_old_files(directory, ".prof")
+    except Exception as e:
+        logging.error(f"Failed to write the profile of the sync cycle! Error: {e}")
+    for path in paths:
+        logging.info(f"Wrote {path}")
+    return paths
@@ -0,0 +1,339 @@
+import logging
+import os
+import re
+import threading
+import unicodedata
+from time import monotonic
+
+# other scripts import
+from . import metrics
+
+logging.basicConfig(level=logging.INFO)
+
+# plex metadata type number of tracks
+TRACK_TYPE = 10
+# tracks requested per page while a music section is indexed
+INDEX_PAGE_SIZE = 5000
+# tracks with the same tags whose durations are this many milliseconds apart are treated as the same recording
+DURATION_TOLERANCE = 2000
+# guids made from the rating key of the file, they change together with the rating key
+UNSTABLE_GUID_PREFIXES = ("local://",)
+
+# (plex server url, library section id) -> matching index of the section from build_track_index
+_track_indexes = {}
+_track_indexes_lock = threading.Lock()
+# one lock per index key, so sections of different servers are indexed at the same time and each index is built once
+_index_locks = {}
+
+
+def normalize_text(text):
+    """Normalizes a tag so differences in case, accents, punctuation and spacing do not matter.
+
+    Args:
+        text str: artist, album or track title
+
+    Returns:
+        str: normalized text
+    """
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(character for character in text if not unicodedata.combining(character))
+    return " ".join(re.sub(r"[^\w]+", " ", text.casefold()).split())
+
+
+def stable_guid(guid):
+    """Returns the guid if it survives a rescan of the library.
+
+    Args:
+        guid str: plex or external guid of a track
+
+    Returns:
+        str: the guid, None when it is missing or made from the rating key.
+    """
+    if not guid or guid.startswith(UNSTABLE_GUID_PREFIXES):
+        return None
+    return guid
+
+
+def add_track(
+    index,
+    rating_key,
+    guids,
+    artist,
+    album,
+    title,
+    duration
+):
+    """Adds a track to a matching index.
+
+    Args:
+        index dict: matching index from build_track_index
+        rating_key int: rating key of the track
+        guids list: plex guid and external guids such as mbid:// of the track
+        artist str: artist of the track
+        album str: album of the track
+        title str: title of the track
+        duration int: duration of the track in milliseconds
+    """
+    for guid in guids:
+        if stable_guid(guid):
+            index["guids"].setdefault(guid, rating_key)
+    artist, album, title = normalize_text(artist), normalize_text(album), normalize_text(title)
+    index["tags"].setdefault((artist, album, title), []).append((duration, rating_key))
+    index["titles"].setdefault((artist, title), []).append((duration, rating_key))
+
+
+def build_track_index(
+    plex,
+    section_id
+):
+    """Indexes every track of a music section by guid and by normalized artist, album, title and duration.
+    The section is read in a few large pages instead of searching for tracks one at a time.
+
+    Args:
+        plex obj: plex server object
+        section_id int: library section id
+
+    Returns:
+        dict: matching index of the section
+    """
+    index = {"guids": {}, "tags": {}, "titles": {}, "builtAt": monotonic(), "unmatched": set()}
+    start = 0
+    while True:
+        data = plex.query(
+            f"/library/sections/{section_id}/all?type={TRACK_TYPE}&includeGuids=1",
+            headers={
+                "X-Plex-Container-Start": str(start),
+                "X-Plex-Container-Size": str(INDEX_PAGE_SIZE),
+            },
+        )
+        tracks = data.findall("Track")
+        for track in tracks:
+            add_track(
+                index,
+                rating_key=int(track.attrib["ratingKey"]),
+                guids=[track.attrib.get("guid")] + [guid.attrib.get("id") for guid in track.findall("Guid")],
+                artist=track.attrib.get("grandparentTitle"),
+                album=track.attrib.get("parentTitle"),
+                title=track.attrib.get("title"),
+                duration=int(track.attrib.get("duration") or 0),
+            )
+        start += len(tracks)
+        if not tracks or start >= int(data.attrib.get("totalSize", start)):
+            break
+    logging.info(f"Indexed {start} tracks of library section {section_id}")
+    return index
+
+
+def closest_duration(
+    candidates,
+    duration
+):
+    """Picks the track whose duration is closest to the cached one.
+
+    Args:
+        candidates list: list of (duration, rating key) of tracks with the same tags
+        duration int: cached duration in milliseconds, None for caches made before durations were kept
+
+    Returns:
+        int: rating key of the track, None when no track is close enough.
+    """
+    if not duration:
+        return candidates[0][1] if len(candidates) == 1 else None
+    distance, rating_key = min((abs(candidate - duration), rating_key) for candidate, rating_key in candidates)
+    return rating_key if distance <= DURATION_TOLERANCE else None
+
+
+def match_track(
+    index,
+    item
+):
+    """Finds the current rating key of a cached track in a matching index.
+
+    Args:
+        index dict: matching index from build_track_index
+        item dict: cached item dictionary
+
+    Returns:
+        int: rating key of the matching track, None when there is no match.
+    """
+    guid = stable_guid(item.get("guid"))
+    if guid and guid in index["guids"]:
+        return index["guids"][guid]
+    artist, title = normalize_text(item.get("artist")), normalize_text(item.get("title"))
+    if item.get("album") is not None:
+        candidates = index["tags"].get((artist, normalize_text(item["album"]), title))
+    else:
+        candidates = index["titles"].get((artist, title))
+    if not candidates:
+        return None
+    return closest_duration(candidates, item.get("duration"))
+
+
+def item_identity(item):
+    """Returns what identifies a cached track in a matching index, used to remember tracks that were not found.
+
+    Args:
+        item dict: cached item dictionary
+
+    Returns:
+        tuple: guid, artist, album, title and duration of the item
+    """
+    return tuple(item.get(field) for field in ("guid", "artist", "album", "title", "duration"))
+
+
+def index_lock(index_key):
+    """Returns the lock held while the index of one music section is built or matched against.
+
+    Args:
+        index_key tuple: plex server url and library section id
+
+    Returns:
+        obj: lock shared by every thread using the index
+    """
+    with _track_indexes_lock:
+        if index_key not in _index_locks:
+            _index_locks[index_key] = threading.Lock()
+        return _index_locks[index_key]
+
+
+def publish_track_index(
+    index_key,
+    index
+):
+    """Stores a built index so other threads and later runs use it.
+
+    Args:
+        index_key tuple: plex server url and library section id
+        index dict: matching index from build_track_index
+
+    Returns:
+        dict: the stored index
+    """
+    with _track_indexes_lock:
+        _track_indexes[index_key] = index
+    return index
+
+
+def match_section_tracks(
+    plex,
+    section_id,
+    items
+):
+    """Matches cached tracks against the index of one music section.
+    The index is built once and reused for track_index_ttl seconds. A cached index is built again once when a track
+    is not found in it, so tracks moved since it was built are found as well.
+
+    Args:
+        plex obj: plex server object
+        section_id int: library section id
+        items list: list of cached item dictionaries
+
+    Returns:
+        list: rating key of the matching track for each item, None where no track matched.
+    """
+    index_key = (plex._baseurl, section_id)
+    with index_lock(index_key):
+        with _track_indexes_lock:
+            index = _track_indexes.get(index_key)
+        fresh = index is None or monotonic() - index["builtAt"] > track_index_ttl
+        if fresh:
+            metrics.increment("cache_lookups_total", cache="track_index", result="miss")
+            index = publish_track_index(index_key, build_track_index(plex, section_id))
+        else:
+            metrics.increment("cache_lookups_total", cache="track_index", result="hit")
+        matches = [match_track(index, item) for item in items]
+        if not fresh and any(
+            rating_key is None and item_identity(item) not in index["unmatched"]
+            for item, rating_key in zip(items, matches)
+        ):
+            index = publish_track_index(index_key, build_track_index(plex, section_id))
+            matches = [match_track(index, item) for item in items]
+        index["unmatched"].update(
+            item_identity(item) for item, rating_key in zip(items, matches) if rating_key is None
+        )
+    return matches
+
+
+def remap_rating_keys(
+    plex,
+    items
+):
+    """Finds the new rating keys of cached tracks that are no longer on the server, for example after a rescan.
+
+    Args:
+        plex obj: plex server object
+        items list: list of cached item dictionaries whose rating key was not found
+
+    Returns:
+        dict: old rating key to new rating key for every track that was matched.
+    """
+    items_by_section = {}
+    for item in items:
+        if item.get("type") in (None, "track") and item.get("librarySectionID"):
+            items_by_section.setdefault(int(item["librarySectionID"]), []).append(item)
+
+    remapped, unmatched = {}, 0
+    for section_id, section_items in items_by_section.items():
+        for item, rating_key in zip(section_items, match_section_tracks(plex, section_id, section_items)):
+            if rating_key is None:
+                unmatched += 1
+            else:
+                remapped[int(item["ratingKey"])] = rating_key
+    if unmatched:
+        metrics.increment("tracks_remapped_total", unmatched, result="unmatched")
+    if remapped:
+        metrics.increment("tracks_remapped_total", len(remapped), result="remapped")
+        logging.info(f"Matched {len(remapped)} cached tracks to their new rating keys")
+    return remapped
+
+
+def music_section_ids(plex):
+    """Returns the ids of the music library sections of a server.
+
+    Args:
+        plex obj: plex server object
+
+    Returns:
+        list: list of library section ids
+    """
+    data = plex.query("/library/sections")
+    return [int(section.attrib["key"]) for section in data.findall("Directory") if section.attrib.get("type") == "artist"]
+
+
+def match_tracks(
+    plex,
+    items
+):
+    """Finds the tracks of another server's playlist on this server by looking through every music section index.
+
+    Args:
+        plex obj: plex server object the tracks are looked up on
+        items list: list of cached item dictionaries from the other server
+
+    Returns:
+        list: rating key on this server for each item, None where no track matched.
+    """
+    matches = [None] * len(items)
+    for section_id in music_section_ids(plex):
+        pending = [position for position, rating_key in enumerate(matches) if rating_key is None]
+        if not pending:
+            break
+        found = match_section_tracks(plex, section_id, [items[position] for position in pending])
+        for position, rating_key in zip(pending, found):
+            matches[position] = rating_key
+    unmatched = matches.count(None)
+    if unmatched:
+        logging.info(f"{unmatched} of {len(items)} tracks were not found on {plex._baseurl}")
+    return matches
+
+
+def clear_track_indexes():
+    """Forgets every matching index."""
+    with _track_indexes_lock:
+        _track_indexes.clear()
+
+
+try:
+    track_index_ttl = float(os.getenv("TRACK_INDEX_TTL", default=3600))
+except ValueError:
+    track_index_ttl = 3600
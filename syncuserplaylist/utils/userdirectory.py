@@ -0,0 +1,170 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+
+from plexapi.myplex import MyPlexUser
+
+# other scripts import
+from . import cachestore
+from . import metrics
+
+logging.basicConfig(level=logging.INFO)
+
+# (machine identifier, user id) of the users already logged as not shared on a server
+_unshared_users = set()
+_unshared_users_lock = threading.Lock()
+
+
+def user_to_row(user):
+    """Takes the fields of a plex user that are kept in the user directory.
+
+    Args:
+        user obj: plex user object
+
+    Returns:
+        dict: dictionary with the cachestore.USER_FIELDS of the user
+    """
+    return {
+        "id": user.id,
+        "username": user.username,
+        "title": user.title,
+        "email": user.email,
+        "home": int(bool(user.home)),
+        "thumb": user.thumb,
+        "servers": ",".join(server.machineIdentifier for server in user.servers if server.machineIdentifier),
+    }
+
+
+def row_to_user(
+    account,
+    row
+):
+    """Builds a plex user object from a user directory row that can be passed to switchUser.
+
+    Args:
+        account obj: plex account object of the admin
+        row dict: dictionary with the cachestore.USER_FIELDS of the user
+
+    Returns:
+        obj: plex user object
+    """
+    attributes = {field: str(value) for field, value in row.items() if value is not None and field != "servers"}
+    element = ElementTree.Element("User", attributes)
+    for machine_identifier in (row.get("servers") or "").split(","):
+        if machine_identifier:
+            ElementTree.SubElement(element, "Server", {"machineIdentifier": machine_identifier})
+    return MyPlexUser(account, element, initpath=MyPlexUser.key)
+
+
+@metrics.track_caller
+def load_user_directory(
+    account,
+    ttl,
+    refresh=False
+):
+    """Returns the users shared with the admin account, fetched from plex at most once per ttl.
+
+    Args:
+        account obj: plex account object of the admin
+        ttl float: seconds the cached user directory is used before asking plex again
+        refresh bool: ask plex even if the cached user directory has not expired
+
+    Returns:
+        tuple: list of plex user objects and True if they were fetched from plex.
+    """
+    if not refresh:
+        try:
+            rows, cached_at = cachestore.load_users()
+            if cached_at and datetime.fromisoformat(cached_at) > datetime.now() - timedelta(seconds=ttl):
+                metrics.increment("cache_lookups_total", cache="users", result="hit")
+                return [row_to_user(account, row) for row in rows], False
+        except Exception as e:
+            logging.error(f"An error occurred while loading the user directory from cache! Error: {e}")
+    metrics.increment("cache_lookups_total", cache="users", result="miss")
+    users = account.users()
+    try:
+        cachestore.save_users([user_to_row(user) for user in users], datetime.now().isoformat())
+    except Exception as e:
+        logging.error(f"The user directory failed to be saved! Error: {e}")
+    return users, True
+
+
+def index_users(users):
+    """Indexes users by username and title.
+
+    Args:
+        users list: list of plex user objects
+
+    Returns:
+        dict: dictionary of username and title to plex user object
+    """
+    user_index = {}
+    for user in users:
+        if user.title:
+            user_index.setdefault(user.title, user)
+        if user.username:
+            user_index[user.username] = user
+    return user_index
+
+
+def resolve_users(
+    account,
+    user_list,
+    ttl
+):
+    """Finds the plex users for the listed names with the cached user directory.
+    The directory is fetched again if a name is missing from a cached copy, so users shared since the last fetch are found.
+    Blank names are ignored and an empty list returns every user.
+
+    Args:
+        account obj: plex account object of the admin
+        user_list list: list of string names that correspond to user names, empty for every user
+        ttl float: seconds the cached user directory is used before asking plex again
+
+    Returns:
+        tuple: list of plex user objects and list of names that are not users.
+    """
+    user_list = [username for username in user_list if username]
+    users, fetched = load_user_directory(account, ttl)
+    if not user_list:
+        return users, []
+    user_index = index_users(users)
+    if not fetched and any(username not in user_index for username in user_list):
+        user_index = index_users(load_user_directory(account, ttl, refresh=True)[0])
+    valid_users, valid_user_ids, not_usernames = [], set(), []
+    for listed_username in user_list:
+        if listed_username in user_index:
+            user = user_index[listed_username]
+            if user.id not in valid_user_ids:
+                valid_users.append(user)
+                valid_user_ids.add(user.id)
+        else:
+            not_usernames.append(listed_username)
+    return valid_users, not_usernames
+
+
+def shared_users(
+    users,
+    machine_identifier
+):
+    """Leaves out the users the plex server is not shared with, each left out user is logged once.
+
+    Args:
+        users list: list of plex user objects
+        machine_identifier str: machine identifier of the plex server
+
+    Returns:
+        list: list of plex user objects the server is shared with
+    """
+    shared = []
+    for user in users:
+        if any(server.machineIdentifier == machine_identifier for server in user.servers):
+            shared.append(user)
+            continue
+        with _unshared_users_lock:
+            logged = (machine_identifier, user.id) in _unshared_users
+            _unshared_users.add((machine_identifier, user.id))
+        if not logged:
+            logging.info(f"Server {machine_identifier} is not shared with {user.username or user.title}, skipping...")
+    return shared
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the scripts import each other as "utils", like run.py and the tools do, and the tests start the mock server from tools
+ROOT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT_DIRECTORY, "syncuserplaylist"))
+sys.path.insert(0, os.path.join(ROOT_DIRECTORY, "tools"))
@@ -0,0 +1,74 @@
+"""Helpers for tests that sync playlists against the offline mock plex server from tools."""
+import os
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from types import SimpleNamespace
+from unittest import mock
+
+from benchmark import mock_session
+from benchmark import start_mock_server
+from plexapi.server import PlexServer
+from utils import cachestore
+from utils import plexsession
+from utils import trackindex
+from utils import userdirectory
+
+PLAYLIST_LIST = ["Playlist 1", "Playlist 2"]
+
+
+def user_list(users):
+    """Usernames of the users the mock server makes."""
+    return [f"user{user_id}" for user_id in range(2, users + 2)]
+
+
+def temporary_cache(test):
+    """Points the cache database at an empty folder and forgets what other tests cached in memory."""
+    directory = tempfile.mkdtemp(prefix="syncuserplaylist-test-")
+    test.addCleanup(shutil.rmtree, directory, True)
+    for name, value in (
+        ("cache_directory", directory),
+        ("cache_database", os.path.join(directory, "playlists.sqlite")),
+        ("_initialized", False),
+    ):
+        patcher = mock.patch.object(cachestore, name, value)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    patcher = mock.patch.object(userdirectory, "_unshared_users", set())
+    patcher.start()
+    test.addCleanup(patcher.stop)
+    plexsession.clear_user_servers()
+    trackindex.clear_track_indexes()
+    test.addCleanup(plexsession.clear_user_servers)
+    test.addCleanup(trackindex.clear_track_indexes)
+    return directory
+
+
+def mock_plex(
+    test,
+    users=3,
+    playlists=2,
+    tracks=30,
+    fanout_index=None,
+    unshared_users=0,
+    servers=0
+):
+    """Starts a mock plex server for one test and connects to it as the admin.
+
+    Returns:
+        tuple: admin plex server object and the base url of the mock server
+    """
+    process, mock_url = start_mock_server(
+        SimpleNamespace(users=users, playlists=playlists, tracks=tracks, port=0, servers=servers), fanout_index, unshared_users
+    )
+    test.addCleanup(process.stdout.close)
+    test.addCleanup(process.wait)
+    test.addCleanup(process.terminate)
+    session = mock_session(mock_url, plexsession.new_session())
+    return PlexServer(mock_url, "admin-token", session=session), mock_url
+
+
+def quietly(func, *args, **kwargs):
+    """Runs a sync without its progress prints."""
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        return func(*args, **kwargs)
@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+
+from tests.plexmock import mock_plex
+from tests.plexmock import quietly
+from tests.plexmock import temporary_cache
+from tests.plexmock import user_list
+from utils import cacheplaylist
+from utils import plexsyncplaylist
+from utils.plexsyncplaylist import sync_playlists
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        temporary_cache(self)
+        self.plex, self.mock_url = mock_plex(self, users=4)
+        self.sync()
+        self.plex._session.post(f"{self.mock_url}/_mock/churn?percent=10", headers={"X-Plex-Token": "admin-token"})
+
+    def sync(self):
+        return quietly(sync_playlists, self.plex, None, user_list(4), False, False, 1, checkpoint=True)
+
+    def synced_users(self):
+        """Runs a sync and returns it with the users whose playlists were compared in it."""
+        with mock.patch.object(
+            plexsyncplaylist, "sync_playlist_for_user", wraps=plexsyncplaylist.sync_playlist_for_user
+        ) as sync_playlist_for_user:
+            results = self.sync()
+        return results, {call.kwargs["user"].username for call in sync_playlist_for_user.call_args_list}
+
+    def interrupt_at(self, username):
+        """Runs a sync that stops like a restart would when it reaches the user."""
+        original = plexsyncplaylist.sync_playlist_for_user
+
+        def sync_playlist_for_user(**kwargs):
+            if kwargs["user"].username == username:
+                raise KeyboardInterrupt
+            return original(**kwargs)
+
+        with mock.patch.object(plexsyncplaylist, "sync_playlist_for_user", sync_playlist_for_user):
+            with self.assertRaises(KeyboardInterrupt):
+                self.sync()
+
+    def test_interrupted_cycle_resumes_where_it_stopped(self):
+        self.interrupt_at("user4")
+        results, synced = self.synced_users()
+        self.assertEqual(synced, {"user4"})
+        # the playlists synced before the restart keep the results they had
+        self.assertEqual(len(results), 2 * 5)
+        self.assertEqual({result for (_, username), result in results.items() if username is None}, {"updated_cache"})
+        self.assertEqual(set(results.values()), {"updated_cache", "updated_plex"})
+
+        # the resumed cycle finished, so the next one syncs everyone again
+        results, synced = self.synced_users()
+        self.assertEqual(synced, set(user_list(4)))
+        self.assertEqual(set(results.values()), {"skipped"})
+
+    def test_old_interrupted_cycle_is_started_over(self):
+        self.interrupt_at("user4")
+        with mock.patch.object(cacheplaylist, "CHECKPOINT_MAX_AGE", -1):
+            results, synced = self.synced_users()
+        self.assertEqual(synced, set(user_list(4)))
+        self.assertNotIn("updated_cache", results.values())
+
+
+if __name__ == "__main__":
+    unittest.main()
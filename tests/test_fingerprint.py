@@ -0,0 +1,50 @@
+import unittest
+
+from tests.plexmock import PLAYLIST_LIST
+from tests.plexmock import mock_plex
+from tests.plexmock import quietly
+from tests.plexmock import temporary_cache
+from tests.plexmock import user_list
+from utils.plexsyncplaylist import sync_playlists
+
+
+class FingerprintTest(unittest.TestCase):
+    def setUp(self):
+        temporary_cache(self)
+        self.plex, self.mock_url = mock_plex(self)
+        # the first sync makes the user copies and the second records the fingerprints of the settled playlists
+        self.sync()
+        self.sync()
+
+    def sync(self):
+        return quietly(sync_playlists, self.plex, PLAYLIST_LIST, user_list(3), False, False)
+
+    def results_by_playlist(self, results):
+        titles = {int(playlist.ratingKey): playlist.title for playlist in self.plex.playlists()}
+        by_playlist = {}
+        for (playlist_key, username), result in results.items():
+            by_playlist.setdefault(titles[playlist_key], {})[username] = result
+        return by_playlist
+
+    def test_unchanged_playlists_are_skipped(self):
+        self.assertEqual(set(self.sync().values()), {"skipped"})
+
+    def test_changed_tracks_resync_every_copy(self):
+        self.plex._session.post(f"{self.mock_url}/_mock/churn?percent=10", headers={"X-Plex-Token": "admin-token"})
+        for results in self.results_by_playlist(self.sync()).values():
+            self.assertEqual(results.pop(None), "updated_cache")
+            # the user copies did not change but the cache they were synced against did
+            self.assertEqual(set(results.values()), {"updated_plex"})
+        self.assertEqual(set(self.sync().values()), {"skipped"})
+
+    def test_summary_change_resyncs_only_that_playlist(self):
+        self.plex.playlist("Playlist 2").editSummary("new summary")
+        results = self.results_by_playlist(self.sync())
+        self.assertEqual(set(results["Playlist 1"].values()), {"skipped"})
+        self.assertEqual(results["Playlist 2"].pop(None), "updated_cache")
+        self.assertEqual(set(results["Playlist 2"].values()), {"updated_plex"})
+        self.assertEqual(set(self.sync().values()), {"skipped"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import random
+import unittest
+
+from utils import cachestore
+
+
+class JournalTest(unittest.TestCase):
+    @staticmethod
+    def items(keys):
+        return [{"ratingKey": key, "title": f"Track {key}"} for key in keys]
+
+    def test_adds_and_removes_replay_to_the_new_generation(self):
+        generator = random.Random(3)
+        for _ in range(200):
+            old_keys = generator.sample(range(100), generator.randrange(30))
+            new_keys = [key for key in old_keys if generator.random() > 0.2]
+            for key in generator.sample(range(100, 200), generator.randrange(5)):
+                new_keys.insert(generator.randrange(len(new_keys) + 1), key)
+            entries = cachestore.journal_changes(self.items(old_keys), self.items(new_keys))
+            self.assertIsNotNone(entries)
+            replayed = cachestore.replay_journal(self.items(old_keys), entries)
+            self.assertEqual([item["ratingKey"] for item in replayed], new_keys)
+            self.assertEqual(replayed[0]["title"] if replayed else None, f"Track {new_keys[0]}" if new_keys else None)
+
+    def test_reordered_playlist_is_not_journaled(self):
+        self.assertIsNone(cachestore.journal_changes(self.items([1, 2, 3]), self.items([3, 1, 2])))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from tests.plexmock import PLAYLIST_LIST
+from tests.plexmock import mock_plex
+from tests.plexmock import quietly
+from tests.plexmock import temporary_cache
+from tests.plexmock import user_list
+from utils.cacheplaylist import register_fanout_server
+from utils.multiserver import fan_out_playlists
+from utils.plexsyncplaylist import sync_playlists
+
+
+def synced_users(results):
+    return {username for _, username in results if username is not None}
+
+
+class SharedUsersTest(unittest.TestCase):
+    def setUp(self):
+        temporary_cache(self)
+
+    def test_users_without_the_server_are_skipped(self):
+        plex, _ = mock_plex(self, users=3, unshared_users=1)
+        with self.assertLogs(level="INFO") as logs:
+            results = quietly(sync_playlists, plex, PLAYLIST_LIST, user_list(3), False, False)
+            # the user directory comes from the cache the second time
+            quietly(sync_playlists, plex, PLAYLIST_LIST, user_list(3), False, False)
+
+        self.assertEqual(synced_users(results), {"user2", "user3"})
+        self.assertEqual(len([line for line in logs.output if "not shared with user4" in line]), 1)
+
+    def test_fan_out_only_syncs_users_of_the_other_server(self):
+        plex, _ = mock_plex(self, users=3, servers=1)
+        target_plex, _ = mock_plex(self, users=3, fanout_index=0, unshared_users=1, servers=1)
+        register_fanout_server(target_plex)
+        playlist_keys = {key for key, _ in quietly(sync_playlists, plex, PLAYLIST_LIST, user_list(3), False, False)}
+
+        with self.assertLogs(level="INFO") as logs:
+            results = quietly(fan_out_playlists, plex, [target_plex], playlist_keys, user_list(3), False)
+            quietly(fan_out_playlists, plex, [target_plex], playlist_keys, user_list(3), False)
+
+        self.assertEqual(synced_users(results[target_plex.machineIdentifier]), {"user2", "user3"})
+        self.assertNotIn(None, results[target_plex.machineIdentifier].values())
+        self.assertEqual(len([line for line in logs.output if "user4 has no token" in line]), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+from unittest import mock
+
+from tests.plexmock import PLAYLIST_LIST
+from tests.plexmock import mock_plex
+from tests.plexmock import quietly
+from tests.plexmock import temporary_cache
+from tests.plexmock import user_list
+from utils import cachestore
+from utils.plexsyncplaylist import sync_playlists
+
+
+class PlaylistCopyTest(unittest.TestCase):
+    def setUp(self):
+        temporary_cache(self)
+        self.plex, _ = mock_plex(self, users=2)
+        self.sync()
+
+    def sync(self):
+        """Runs a sync and returns it with the user copies written to the cache in it."""
+        with mock.patch.object(cachestore, "save_playlist_copy", wraps=cachestore.save_playlist_copy) as save_playlist_copy:
+            results = quietly(sync_playlists, self.plex, PLAYLIST_LIST, user_list(2), False, False)
+        return results, [call.args[1:] for call in save_playlist_copy.call_args_list]
+
+    def user_playlist(self, username, title):
+        return self.plex.switchUser(username).playlist(title)
+
+    def test_known_copies_are_not_written_again(self):
+        results, saved = self.sync()
+        self.assertNotIn(None, results.values())
+        self.assertEqual(saved, [])
+
+    def test_renamed_copy_is_found_by_rating_key(self):
+        copy = self.user_playlist("user2", "Playlist 1")
+        copy.editTitle("Road Trip")
+        results, saved = self.sync()
+        self.assertNotIn(None, results.values())
+        self.assertEqual(saved, [])
+        self.assertEqual(self.user_playlist("user2", "Playlist 1").ratingKey, copy.ratingKey)
+
+    def test_new_copy_is_written(self):
+        copy = self.user_playlist("user3", "Playlist 2")
+        copy.delete()
+        results, saved = self.sync()
+        new_copy = self.user_playlist("user3", "Playlist 2")
+        self.assertNotEqual(new_copy.ratingKey, copy.ratingKey)
+        self.assertEqual(saved, [(3, int(new_copy.ratingKey))])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from utils import cacheplaylist
+from utils.cacheplaylist import apply_playlist_diff
+from utils.cacheplaylist import diff_playlist_items
+
+
+class FakePlaylist:
+    """Playlist that records the batches of tracks added to it."""
+
+    title = "Playlist 1"
+
+    def __init__(self, fail_batch=None):
+        self.batches = []
+        self.removed = []
+        self.fail_batch = fail_batch
+
+    def addItems(self, tracks):
+        if len(self.batches) == self.fail_batch:
+            raise Exception("Plex server failed to answer")
+        self.batches.append([track.ratingKey for track in tracks])
+
+    def removeItems(self, tracks):
+        self.removed.append([track.ratingKey for track in tracks])
+
+
+def tracks(rating_keys):
+    return [SimpleNamespace(ratingKey=key, title=f"Track {key}", grandparentTitle="Artist") for key in rating_keys]
+
+
+class DiffPlaylistItemsTest(unittest.TestCase):
+    def test_adds_in_cache_order_and_removes_extras(self):
+        keys_to_add, keys_to_remove = diff_playlist_items([5, 1, 4, 5, 2], [1, 2, 3])
+        self.assertEqual(keys_to_add, [5, 4])
+        self.assertEqual(keys_to_remove, {3})
+
+    def test_same_tracks_need_no_changes(self):
+        self.assertEqual(diff_playlist_items([3, 1, 2], [1, 2, 3]), ([], set()))
+
+    def test_empty_playlists(self):
+        self.assertEqual(diff_playlist_items([1, 2], []), ([1, 2], set()))
+        self.assertEqual(diff_playlist_items([], [1, 2]), ([], {1, 2}))
+
+
+class ApplyPlaylistDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.user = SimpleNamespace(username="user2", title="user2")
+        patcher = mock.patch.object(cacheplaylist, "MAX_METADATA_KEY_LENGTH", 20)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def apply(self, playlist, keys_to_add, keys_to_remove=()):
+        with mock.patch("builtins.print"):
+            return apply_playlist_diff(playlist, tracks(keys_to_add), tracks(keys_to_remove), self.user)
+
+    def test_tracks_are_added_in_order_in_batches_that_fit_in_a_url(self):
+        playlist = FakePlaylist()
+        keys = [1000 + key for key in range(10)]
+        self.assertEqual(self.apply(playlist, keys, [5, 6]), 12)
+        self.assertEqual(playlist.batches, [keys[0:4], keys[4:8], keys[8:10]])
+        self.assertEqual(playlist.removed, [[5, 6]])
+
+    def test_batches_after_a_failed_one_are_not_sent(self):
+        playlist = FakePlaylist(fail_batch=1)
+        keys = [1000 + key for key in range(10)]
+        self.assertEqual(self.apply(playlist, keys, [5]), 5)
+        self.assertEqual(playlist.batches, [keys[0:4]])
+        self.assertEqual(playlist.removed, [[5]])
+
+    def test_nothing_to_apply(self):
+        playlist = FakePlaylist()
+        self.assertEqual(self.apply(playlist, []), 0)
+        self.assertEqual((playlist.batches, playlist.removed), ([], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import itertools
+import random
+import unittest
+
+from utils.cacheplaylist import longest_increasing_subsequence
+from utils.cacheplaylist import plan_playlist_moves
+
+
+def apply_moves(keys, moves):
+    """Moves keys in a list the way moveItem moves tracks in a playlist."""
+    keys = list(keys)
+    for rating_key, after_rating_key in moves:
+        keys.remove(rating_key)
+        keys.insert(keys.index(after_rating_key) + 1 if after_rating_key is not None else 0, rating_key)
+    return keys
+
+
+def longest_increasing_length(sequence):
+    """Length of the longest strictly increasing subsequence by trying every subsequence."""
+    for length in range(len(sequence), 0, -1):
+        for positions in itertools.combinations(range(len(sequence)), length):
+            values = [sequence[position] for position in positions]
+            if all(first < second for first, second in zip(values, values[1:])):
+                return length
+    return 0
+
+
+class LongestIncreasingSubsequenceTest(unittest.TestCase):
+    def test_simple_sequences(self):
+        self.assertEqual(longest_increasing_subsequence([]), set())
+        self.assertEqual(longest_increasing_subsequence([1, 2, 3]), {0, 1, 2})
+        self.assertEqual(len(longest_increasing_subsequence([3, 2, 1])), 1)
+        self.assertEqual(len(longest_increasing_subsequence([2, 2, 2])), 1)
+
+    def test_matches_brute_force(self):
+        generator = random.Random(1)
+        for _ in range(300):
+            sequence = [generator.randrange(8) for _ in range(generator.randrange(9))]
+            positions = sorted(longest_increasing_subsequence(sequence))
+            values = [sequence[position] for position in positions]
+            self.assertTrue(all(first < second for first, second in zip(values, values[1:])), sequence)
+            self.assertEqual(len(positions), longest_increasing_length(sequence), sequence)
+
+
+class PlanPlaylistMovesTest(unittest.TestCase):
+    def test_same_order_needs_no_moves(self):
+        self.assertEqual(plan_playlist_moves([1, 2, 3], [1, 2, 3]), [])
+
+    def test_single_track_moved(self):
+        moves = plan_playlist_moves([1, 2, 3, 4], [2, 3, 4, 1])
+        self.assertEqual(moves, [(1, None)])
+        self.assertEqual(apply_moves([2, 3, 4, 1], moves), [1, 2, 3, 4])
+
+    def test_tracks_in_only_one_list_are_left_alone(self):
+        current = [9, 3, 1, 2]
+        moves = plan_playlist_moves([1, 2, 3, 7], current)
+        self.assertNotIn(9, [rating_key for rating_key, _ in moves])
+        self.assertEqual([key for key in apply_moves(current, moves) if key != 9], [1, 2, 3])
+
+    def test_shuffles_are_ordered_with_fewest_moves(self):
+        generator = random.Random(2)
+        for _ in range(200):
+            desired = generator.sample(range(1000), generator.randrange(1, 40))
+            current = desired[:]
+            generator.shuffle(current)
+            moves = plan_playlist_moves(desired, current)
+            self.assertEqual(apply_moves(current, moves), desired)
+            positions = [desired.index(key) for key in current]
+            self.assertEqual(len(moves), len(current) - len(longest_increasing_subsequence(positions)))
+
+
+if __name__ == "__main__":
+    unittest.main()
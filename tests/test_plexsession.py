@@ -0,0 +1,115 @@
+import io
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import requests
+from utils import plexsession
+
+
+def response(status_code):
+    answer = requests.Response()
+    answer.status_code = status_code
+    answer.raw = io.BytesIO()
+    return answer
+
+
+class PlexSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.sleeps = []
+        self.answers = []
+        self.sent = []
+
+        def fake_sleep(seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+        def fake_request(session, method, url, *args, **kwargs):
+            self.sent.append(method)
+            answer = self.answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return response(answer)
+
+        for target, name, value in (
+            (plexsession, "monotonic", lambda: self.now),
+            (plexsession, "sleep", fake_sleep),
+            (requests.Session, "request", fake_request),
+        ):
+            patcher = mock.patch.object(target, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_reads_are_retried_with_a_growing_backoff(self):
+        session = plexsession.PlexSession(max_retries=3, retry_backoff=0.5)
+        self.answers = [503, 502, 200]
+        self.assertEqual(session.get("http://plex/playlists").status_code, 200)
+        self.assertEqual(len(self.sent), 3)
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertLessEqual(self.sleeps[0], 0.5)
+        self.assertLessEqual(self.sleeps[1], 1.0)
+
+    def test_last_failed_read_is_returned(self):
+        session = plexsession.PlexSession(max_retries=2)
+        self.answers = [503, 503, 503]
+        self.assertEqual(session.get("http://plex/playlists").status_code, 503)
+        self.assertEqual(len(self.sent), 3)
+
+    def test_writes_and_client_errors_are_not_retried(self):
+        session = plexsession.PlexSession(max_retries=3)
+        self.answers = [503, 404]
+        self.assertEqual(session.put("http://plex/playlists/1/items").status_code, 503)
+        self.assertEqual(session.get("http://plex/playlists/2").status_code, 404)
+        self.assertEqual(self.sent, ["PUT", "GET"])
+
+    def test_connection_errors_are_raised_after_the_retries(self):
+        session = plexsession.PlexSession(max_retries=1)
+        self.answers = [requests.exceptions.ConnectionError(), requests.exceptions.Timeout()]
+        with self.assertRaises(requests.exceptions.Timeout):
+            session.get("http://plex/playlists")
+        self.assertEqual(len(self.sent), 2)
+
+    def test_token_bucket_spaces_requests_out(self):
+        session = plexsession.PlexSession(rate_limit=2)
+        self.answers = [200] * 5
+        for _ in range(3):
+            session.get("http://plex/playlists")
+        self.assertEqual(self.sleeps, [0.5])
+        self.now += 10
+        session.get("http://plex/playlists")
+        session.get("http://plex/playlists")
+        self.assertEqual(self.sleeps, [0.5])
+
+    def test_circuit_opens_after_failures_in_a_row_and_closes_after_the_cooldown(self):
+        session = plexsession.PlexSession(max_retries=0, failure_threshold=2, cooldown=30)
+        plex = SimpleNamespace(_session=session)
+        self.answers = [503, 200, 503, 503, 200, 503]
+        session.get("http://plex/playlists")
+        session.get("http://plex/playlists")
+        session.get("http://plex/playlists")
+        plexsession.raise_if_circuit_open(plex)
+        session.get("http://plex/playlists")
+
+        with self.assertRaises(plexsession.CircuitOpenError) as raised:
+            session.get("http://plex/playlists")
+        self.assertEqual(raised.exception.retry_after, 30)
+        self.assertRaises(plexsession.CircuitOpenError, plexsession.raise_if_circuit_open, plex)
+        self.assertEqual(len(self.sent), 4)
+
+        self.now += 30
+        self.assertEqual(session.get("http://plex/playlists").status_code, 200)
+        # the success closed the circuit, so one more failure does not open it again
+        session.get("http://plex/playlists")
+        plexsession.raise_if_circuit_open(plex)
+
+    def test_circuit_can_be_turned_off(self):
+        session = plexsession.PlexSession(max_retries=0, failure_threshold=0)
+        self.answers = [503] * 10
+        for _ in range(10):
+            session.get("http://plex/playlists")
+        self.assertEqual(session.circuit_retry_after(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import random
+import unittest
+from unittest import mock
+
+from utils import ratingkeys
+
+
+def expected_keys_not_in(keys, other_keys):
+    other_key_set = set(other_keys)
+    return [key for key in dict.fromkeys(keys) if key not in other_key_set]
+
+
+def key_lists(generator, total, key_range):
+    """Two overlapping lists of rating keys with duplicates and total keys between them."""
+    size = total // 2
+    keys = [generator.randrange(key_range) for _ in range(size)]
+    other_keys = [key for key in keys if generator.random() > 0.1]
+    other_keys += [generator.randrange(key_range) for _ in range(total - size - len(other_keys))]
+    generator.shuffle(other_keys)
+    return keys, other_keys
+
+
+class RatingKeysTest(unittest.TestCase):
+    def check(self, keys, other_keys):
+        self.assertEqual(ratingkeys.keys_not_in(keys, other_keys), expected_keys_not_in(keys, other_keys))
+        self.assertEqual(ratingkeys.keys_not_in(keys, set(other_keys)), expected_keys_not_in(keys, other_keys))
+        self.assertEqual(ratingkeys.contains_all(keys, other_keys), set(keys) <= set(other_keys))
+        self.assertEqual(ratingkeys.contains_all(keys, keys), True)
+
+    def test_matches_sets_around_the_vectorize_limit(self):
+        generator = random.Random(4)
+        for total in (ratingkeys.VECTORIZE_MIN_KEYS - 1, ratingkeys.VECTORIZE_MIN_KEYS, ratingkeys.VECTORIZE_MIN_KEYS + 1, 20000):
+            for key_range in (3000, 500000, ratingkeys.MAX_TABLE_RANGE * 4):
+                with self.subTest(total=total, key_range=key_range):
+                    self.check(*key_lists(generator, total, key_range))
+
+    def test_empty_lists(self):
+        many_keys = list(range(ratingkeys.VECTORIZE_MIN_KEYS))
+        self.check([], many_keys)
+        self.check(many_keys, [])
+        self.check([], [])
+
+    def test_results_are_python_ints(self):
+        many_keys = list(range(ratingkeys.VECTORIZE_MIN_KEYS + 10))
+        self.assertTrue(all(type(key) is int for key in ratingkeys.keys_not_in(many_keys, many_keys[:5])))
+
+    def test_without_numpy(self):
+        generator = random.Random(5)
+        with mock.patch.object(ratingkeys, "load_numpy", return_value=None):
+            self.check(*key_lists(generator, 5000, 100000))
+
+    @unittest.skipIf(ratingkeys.load_numpy() is None, "numpy is not installed")
+    def test_large_lists_use_numpy(self):
+        self.assertIsNotNone(ratingkeys.vectorized(range(ratingkeys.VECTORIZE_MIN_KEYS)))
+        self.assertIsNone(ratingkeys.vectorized(range(ratingkeys.VECTORIZE_MIN_KEYS - 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import unittest
+from unittest import mock
+
+from utils import scheduler
+
+PLAYLIST = (100, None)
+USER_PLAYLIST = (100, "user2")
+OTHER_USER_PLAYLIST = (100, "user3")
+OTHER_PLAYLIST = (200, None)
+
+
+class NextIntervalTest(unittest.TestCase):
+    def test_new_unit_starts_at_the_minimum(self):
+        self.assertEqual(scheduler.next_interval(None, "unchanged", 5, 600), 5)
+
+    def test_change_drops_to_the_minimum(self):
+        for result in scheduler.CHANGED_RESULTS:
+            self.assertEqual(scheduler.next_interval(320, result, 5, 600), 5)
+
+    def test_idle_doubles(self):
+        self.assertEqual(scheduler.next_interval(40, "unchanged", 5, 600), 80)
+        self.assertEqual(scheduler.next_interval(40, "skipped", 5, 600), 80)
+
+    def test_failed_sync_backs_off_like_idle(self):
+        self.assertEqual(scheduler.next_interval(40, None, 5, 600), 80)
+
+    def test_stays_within_bounds(self):
+        interval = None
+        for _ in range(20):
+            interval = scheduler.next_interval(interval, "skipped", 5, 600)
+            self.assertGreaterEqual(interval, 5)
+            self.assertLessEqual(interval, 600)
+        self.assertEqual(interval, 600)
+        self.assertEqual(scheduler.next_interval(1, "skipped", 5, 600), 5)
+
+
+class ScheduleTest(unittest.TestCase):
+    def setUp(self):
+        scheduler.clear_schedule()
+        self.now = 1000.0
+        patcher = mock.patch.object(scheduler, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(scheduler.clear_schedule)
+
+    def test_units_are_due_after_their_interval(self):
+        scheduler.reschedule({PLAYLIST: "unchanged", USER_PLAYLIST: "created"}, 5, 600, full_run=True)
+        self.assertEqual(scheduler.seconds_until_due(), 5)
+        self.assertEqual(scheduler.pop_due_units(), set())
+        self.now += 5
+        self.assertEqual(scheduler.pop_due_units(), {PLAYLIST, USER_PLAYLIST})
+        self.assertIsNone(scheduler.seconds_until_due())
+
+    def test_idle_unit_waits_longer_than_changed_unit(self):
+        scheduler.reschedule({OTHER_PLAYLIST: "unchanged", USER_PLAYLIST: "unchanged"}, 5, 600, full_run=True)
+        self.now += 5
+        scheduler.reschedule({OTHER_PLAYLIST: "skipped", USER_PLAYLIST: "updated_plex"}, 5, 600)
+        self.now += 5
+        self.assertEqual(scheduler.pop_due_units(), {USER_PLAYLIST})
+        self.now += 5
+        self.assertEqual(scheduler.pop_due_units(), {OTHER_PLAYLIST})
+
+    def test_change_makes_every_unit_of_the_playlist_due_soon(self):
+        units = {PLAYLIST: "unchanged", USER_PLAYLIST: "unchanged", OTHER_USER_PLAYLIST: "unchanged", OTHER_PLAYLIST: "unchanged"}
+        scheduler.reschedule(units, 5, 600, full_run=True)
+        for _ in range(4):
+            self.now += 600
+            scheduler.pop_due_units()
+            scheduler.reschedule(units, 5, 600)
+        self.now += 5
+        self.assertEqual(scheduler.pop_due_units(), set())
+
+        # only the user copy was due, the admin playlist and the other user copy were waiting for 80 seconds
+        scheduler.reschedule({USER_PLAYLIST: "updated_cache", OTHER_PLAYLIST: "skipped"}, 5, 600)
+        self.now += 5
+        self.assertEqual(scheduler.pop_due_units(), {PLAYLIST, USER_PLAYLIST, OTHER_USER_PLAYLIST})
+        scheduler.reschedule({PLAYLIST: "unchanged", USER_PLAYLIST: "unchanged", OTHER_USER_PLAYLIST: "unchanged"}, 5, 600)
+        self.now += 5
+        self.assertEqual(scheduler.pop_due_units(), set())
+        self.now += 5
+        self.assertEqual(scheduler.pop_due_units(), {PLAYLIST, USER_PLAYLIST, OTHER_USER_PLAYLIST})
+
+    def test_rescheduled_unit_is_not_due_at_its_old_time(self):
+        scheduler.reschedule({PLAYLIST: "unchanged"}, 5, 600, full_run=True)
+        self.now += 5
+        scheduler.reschedule({PLAYLIST: "unchanged"}, 5, 600)
+        self.now += 5
+        self.assertEqual(scheduler.pop_due_units(), set())
+        self.assertEqual(scheduler.seconds_until_due(), 5)
+
+    def test_full_run_forgets_units_that_are_no_longer_synced(self):
+        scheduler.reschedule({PLAYLIST: "unchanged", USER_PLAYLIST: "unchanged"}, 5, 600, full_run=True)
+        scheduler.reschedule({PLAYLIST: "unchanged"}, 5, 600, full_run=True)
+        self.now += 600
+        self.assertEqual(scheduler.pop_due_units(), {PLAYLIST})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+from collections import Counter
+from unittest import mock
+
+from utils import sharding
+
+UNITS = [(playlist_key, f"user{user}") for playlist_key in range(100, 160) for user in range(50)]
+
+
+def assign(count):
+    """Worker of every unit when there are count workers."""
+    ring_points, ring_workers = sharding.build_ring(count)
+    with mock.patch.object(sharding, "_ring_points", ring_points), mock.patch.object(sharding, "_ring_workers", ring_workers):
+        return {unit: sharding.worker_for(*unit) for unit in UNITS}
+
+
+class ShardingTest(unittest.TestCase):
+    def test_ring_hash_is_the_same_in_every_process(self):
+        self.assertEqual(sharding.ring_hash("100/user2"), 0xbf60953e7eef590d)
+
+    def test_every_unit_has_one_worker_in_range(self):
+        owners = assign(3)
+        self.assertEqual(set(owners.values()), {0, 1, 2})
+        self.assertEqual(owners, assign(3))
+
+    def test_work_is_spread_evenly(self):
+        counts = Counter(assign(4).values())
+        for worker in range(4):
+            self.assertGreater(counts[worker], len(UNITS) * 0.15)
+            self.assertLess(counts[worker], len(UNITS) * 0.35)
+
+    def test_adding_a_worker_only_moves_work_to_it(self):
+        before, after = assign(3), assign(4)
+        moved = [unit for unit in UNITS if before[unit] != after[unit]]
+        self.assertTrue(all(after[unit] == 3 for unit in moved))
+        self.assertLess(len(moved), len(UNITS) * 0.35)
+
+    def test_single_worker_owns_everything(self):
+        with mock.patch.object(sharding, "worker_count", 1):
+            self.assertTrue(all(sharding.owns(*unit) for unit in UNITS))
+
+    def test_workers_split_units_without_overlap(self):
+        ring_points, ring_workers = sharding.build_ring(2)
+        owned = []
+        for worker_index in range(2):
+            with mock.patch.multiple(
+                sharding,
+                worker_count=2,
+                worker_index=worker_index,
+                _ring_points=ring_points,
+                _ring_workers=ring_workers,
+            ):
+                owned.append({unit for unit in UNITS if sharding.owns(*unit)})
+        self.assertEqual(owned[0] & owned[1], set())
+        self.assertEqual(owned[0] | owned[1], set(UNITS))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from tests.plexmock import PLAYLIST_LIST
+from tests.plexmock import mock_plex
+from tests.plexmock import quietly
+from tests.plexmock import temporary_cache
+from tests.plexmock import user_list
+from utils import tracing
+from utils.plexsyncplaylist import sync_playlists
+
+
+class TracingTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="syncuserplaylist-profiles-")
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.addCleanup(tracing.finish_cycle, self.directory)
+
+    def test_spans_are_not_kept_outside_a_cycle(self):
+        with tracing.span("load cache"):
+            pass
+        self.assertEqual(tracing.finish_cycle(self.directory), [])
+
+    def test_profiled_sync_with_a_thread_pool(self):
+        temporary_cache(self)
+        plex, _ = mock_plex(self, users=4)
+        tracing.start_cycle(profile=True)
+        with tracing.profiled(), tracing.span("cycle"):
+            results = quietly(sync_playlists, plex, PLAYLIST_LIST, user_list(4), True, False, 3, checkpoint=True)
+        paths = tracing.finish_cycle(self.directory)
+
+        self.assertEqual(len(results), len(PLAYLIST_LIST) * 5)
+        self.assertNotIn(None, results.values())
+        trace_path, profile_path = sorted(paths, key=lambda path: path.endswith(".prof"))
+        with open(trace_path) as trace_file:
+            events = json.load(trace_file)["traceEvents"]
+        self.assertEqual(
+            {event["args"]["user"] for event in events if event["name"] == "sync user"}, set(user_list(4))
+        )
+        self.assertTrue(
+            any(function[2] == "sync_playlist_for_user" for function in pstats.Stats(profile_path).stats),
+            "the user threads are missing from the profile",
+        )
+
+    def test_failing_profiler_does_not_stop_the_cycle(self):
+        tracing.start_cycle(profile=True)
+        with mock.patch.object(tracing.cProfile.Profile, "enable", side_effect=ValueError("Another profiling tool is already active")):
+            with self.assertLogs(level="ERROR"):
+                with tracing.profiled(), tracing.span("cycle"):
+                    ran = True
+        self.assertTrue(ran)
+        self.assertFalse(getattr(tracing._profiled_thread, "active", False))
+        with tracing.profiled():
+            pass
+        self.assertEqual([path for path in tracing.finish_cycle(self.directory) if path.endswith(".prof")], [])
+
+    def test_blocks_in_other_threads_while_profiling(self):
+        tracing.start_cycle(profile=True)
+        errors = []
+
+        def profiled_thread():
+            try:
+                with tracing.profiled():
+                    sum(range(1000))
+            except Exception as e:
+                errors.append(e)
+
+        with tracing.profiled():
+            threads = [threading.Thread(target=profiled_thread) for _ in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(any(path.endswith(".prof") for path in tracing.finish_cycle(self.directory)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+from utils import trackindex
+
+
+def new_index():
+    return {"guids": {}, "tags": {}, "titles": {}, "builtAt": 0, "unmatched": set()}
+
+
+class NormalizeTextTest(unittest.TestCase):
+    def test_case_accents_punctuation_and_spacing_are_ignored(self):
+        self.assertEqual(trackindex.normalize_text("  Beyoncé -  Halo!! "), "beyonce halo")
+        self.assertEqual(trackindex.normalize_text("AC/DC"), trackindex.normalize_text("ac dc"))
+        self.assertEqual(trackindex.normalize_text("Straße"), "strasse")
+
+    def test_missing_text(self):
+        self.assertEqual(trackindex.normalize_text(None), "")
+        self.assertEqual(trackindex.normalize_text(""), "")
+
+
+class ClosestDurationTest(unittest.TestCase):
+    def test_closest_track_within_the_tolerance(self):
+        candidates = [(180000, 1), (240000, 2), (241500, 3)]
+        self.assertEqual(trackindex.closest_duration(candidates, 241000), 3)
+        self.assertEqual(trackindex.closest_duration(candidates, 180000 + trackindex.DURATION_TOLERANCE), 1)
+        self.assertIsNone(trackindex.closest_duration(candidates, 300000))
+
+    def test_without_a_cached_duration_only_a_single_candidate_matches(self):
+        self.assertEqual(trackindex.closest_duration([(180000, 1)], None), 1)
+        self.assertIsNone(trackindex.closest_duration([(180000, 1), (240000, 2)], None))
+
+
+class MatchTrackTest(unittest.TestCase):
+    def setUp(self):
+        self.index = new_index()
+        trackindex.add_track(self.index, 10, ["plex://track/a", "mbid://1"], "Artist", "Album", "Song", 200000)
+        trackindex.add_track(self.index, 11, ["local://11"], "Artist", "Live Album", "Song", 260000)
+        trackindex.add_track(self.index, 12, [None], "Other Artist", "Album", "Song", 200000)
+
+    def test_stable_guids_match_first(self):
+        self.assertEqual(trackindex.match_track(self.index, {"guid": "mbid://1", "title": "Wrong"}), 10)
+        self.assertNotIn("local://11", self.index["guids"])
+
+    def test_tags_and_duration_match_without_a_guid(self):
+        item = {"guid": "local://99", "artist": "ARTIST", "album": "live album", "title": "song!", "duration": 259000}
+        self.assertEqual(trackindex.match_track(self.index, item), 11)
+        item = {"artist": "Other Artist", "album": "Album", "title": "Song", "duration": 200500}
+        self.assertEqual(trackindex.match_track(self.index, item), 12)
+
+    def test_items_without_an_album_match_by_artist_and_title(self):
+        item = {"artist": "Artist", "album": None, "title": "Song", "duration": 261000}
+        self.assertEqual(trackindex.match_track(self.index, item), 11)
+
+    def test_no_match(self):
+        self.assertIsNone(trackindex.match_track(self.index, {"artist": "Nobody", "album": "Album", "title": "Song"}))
+        item = {"artist": "Artist", "album": "Album", "title": "Song", "duration": 400000}
+        self.assertIsNone(trackindex.match_track(self.index, item))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+from xml.etree import ElementTree
+
+from plexapi.myplex import MyPlexUser
+from tests.plexmock import temporary_cache
+from utils.userdirectory import resolve_users
+from utils.userdirectory import shared_users
+
+
+class FakeAccount:
+    """Admin account that counts how often the user list is fetched from plex."""
+
+    def __init__(self, *users):
+        self.user_attributes = list(users)
+        self.fetches = 0
+
+    def users(self):
+        self.fetches += 1
+        users = []
+        for attributes in self.user_attributes:
+            element = ElementTree.Element("User", {key: value for key, value in attributes.items() if key != "server"})
+            ElementTree.SubElement(element, "Server", {"machineIdentifier": attributes.get("server", "server1")})
+            users.append(MyPlexUser(self, element, initpath=MyPlexUser.key))
+        return users
+
+
+def names(users):
+    return [user.username or user.title for user in users]
+
+
+class ResolveUsersTest(unittest.TestCase):
+    def setUp(self):
+        temporary_cache(self)
+        self.account = FakeAccount(
+            {"id": "2", "username": "alice", "title": "Alice"},
+            {"id": "3", "username": "", "title": "Bob"},
+            {"id": "4", "username": "carol", "title": "Carol", "server": "server2"},
+        )
+
+    def test_empty_list_returns_every_user(self):
+        users, not_usernames = resolve_users(self.account, ["", None], 3600)
+        self.assertEqual(names(users), ["alice", "Bob", "carol"])
+        self.assertEqual(not_usernames, [])
+
+    def test_names_are_found_by_username_or_title_once_each(self):
+        users, not_usernames = resolve_users(self.account, ["Alice", "Bob", "alice", "dave"], 3600)
+        self.assertEqual(names(users), ["alice", "Bob"])
+        self.assertEqual(not_usernames, ["dave"])
+
+    def test_cached_directory_is_used_until_it_expires(self):
+        resolve_users(self.account, [], 3600)
+        users, _ = resolve_users(self.account, ["alice", "carol"], 3600)
+        self.assertEqual(self.account.fetches, 1)
+        self.assertEqual(names(users), ["alice", "carol"])
+        self.assertEqual([user.id for user in users], [2, 4])
+        resolve_users(self.account, ["alice"], 0)
+        self.assertEqual(self.account.fetches, 2)
+
+    def test_cached_users_keep_their_servers(self):
+        resolve_users(self.account, [], 3600)
+        users, _ = resolve_users(self.account, [], 3600)
+        self.assertEqual(self.account.fetches, 1)
+        self.assertEqual(names(shared_users(users, "server1")), ["alice", "Bob"])
+        self.assertEqual(names(shared_users(users, "server2")), ["carol"])
+
+    def test_missing_name_fetches_the_directory_again(self):
+        resolve_users(self.account, [], 3600)
+        self.account.user_attributes.append({"id": "5", "username": "dave", "title": "Dave"})
+        users, not_usernames = resolve_users(self.account, ["dave", "erin"], 3600)
+        self.assertEqual(self.account.fetches, 2)
+        self.assertEqual(names(users), ["dave"])
+        self.assertEqual(not_usernames, ["erin"])
+        resolve_users(self.account, ["dave"], 3600)
+        self.assertEqual(self.account.fetches, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,259 @@
+"""Benchmark of sync_playlists against the offline mock plex server.
+
+Run from the repository root:
+
+    python tools/benchmark.py --users 10 --playlists 5 --tracks 3000
+
+Each scenario runs a full sync_playlists and reports wall time, peak python memory from
+tracemalloc and the number of requests the mock server received per endpoint:
+
+    cold   empty cache and users without copies of the playlists
+    settle the run after cold, recording the state of the new copies
+    idle   nothing changed since the last run
+    churn  1% of the tracks in every admin playlist were replaced
+    rescan 1% of the playlist tracks got new rating keys and were dropped from the playlists
+    flaky  another 1% churn with --error-rate of the requests failing with 503
+
+With --profile every scenario also writes a chrome trace of its phases and a cProfile dump
+to the given folder, like PROFILE=cprofile does for run.py.
+
+With --servers the playlists are also fanned out to that many extra mock servers that start
+without playlists, their requests are counted together with the main server.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from collections import Counter
+from time import perf_counter
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TOOLS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+# defaults of USER_TOKEN_TTL and USER_DIRECTORY_TTL in run.py
+USER_TOKEN_TTL = 3600
+USER_DIRECTORY_TTL = 3600
+
+
+class PlexTvRedirectAdapter(HTTPAdapter):
+    """Sends requests meant for https://plex.tv to the mock server instead."""
+
+    def __init__(self, mock_url, **kwargs):
+        super().__init__(**kwargs)
+        self.mock_url = mock_url
+
+    def send(self, request, **kwargs):
+        request.url = request.url.replace("https://plex.tv", self.mock_url, 1)
+        return super().send(request, **kwargs)
+
+
+def mock_session(mock_url, session=None):
+    """Builds a requests session that talks to the mock server for both the plex server and plex.tv.
+
+    Args:
+        mock_url str: base url of the mock plex server
+        session obj: optional requests session to send plex.tv requests from to the mock server
+
+    Returns:
+        obj: requests session
+    """
+    session = session or requests.Session()
+    session.mount("https://plex.tv", PlexTvRedirectAdapter(mock_url))
+    return session
+
+
+def mock_machine_identifier(fanout_index=None):
+    """Machine identifier of the main mock server, or of the extra server with that number."""
+    return "mockplexserver" if fanout_index is None else f"mockplexserver{fanout_index + 2}"
+
+
+def start_mock_server(args, fanout_index=None, unshared_users=0):
+    """Starts the mock plex server in its own process so its memory is not counted.
+
+    Args:
+        args obj: parsed command line arguments, the users are shared on the main server and all args.servers extra servers
+        fanout_index int: optional number of the extra server, it starts without playlists and with other rating keys
+        unshared_users int: number of the users the server is not shared with
+
+    Returns:
+        tuple: the server process and its base url
+    """
+    other_servers = [
+        mock_machine_identifier(index) for index in [None, *range(args.servers)] if index != fanout_index
+    ]
+    extra_arguments = ["--shared-servers", ",".join(other_servers)] if args.servers else []
+    if fanout_index is not None:
+        extra_arguments += [
+            "--playlists", "0",
+            "--port", "0",
+            "--machine-identifier", mock_machine_identifier(fanout_index),
+            "--key-offset", str(1000000 * (fanout_index + 1)),
+        ]
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(TOOLS_DIRECTORY, "mockplexserver.py"),
+            "--users", str(args.users),
+            "--playlists", str(args.playlists),
+            "--tracks", str(args.tracks),
+            "--port", str(args.port),
+            "--unshared-users", str(unshared_users),
+            *extra_arguments,
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    mock_url = process.stdout.readline().strip().rsplit(" ", 1)[1]
+    return process, mock_url
+
+
+def run_scenario(name, mock_urls, sync):
+    """Runs one sync and collects its wall time, peak memory and request counts.
+
+    Args:
+        name str: scenario name
+        mock_urls list: base urls of the mock plex servers
+        sync func: function running the sync
+
+    Returns:
+        dict: scenario results
+    """
+    for mock_url in mock_urls:
+        requests.post(f"{mock_url}/_mock/stats/reset")
+    tracemalloc.start()
+    started = perf_counter()
+    sync()
+    wall_time = perf_counter() - started
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    request_counts = Counter()
+    for mock_url in mock_urls:
+        request_counts.update(requests.get(f"{mock_url}/_mock/stats").json())
+    return {
+        "scenario": name,
+        "wall_time": round(wall_time, 3),
+        "peak_memory_mb": round(peak_memory / 1024 / 1024, 2),
+        "requests": sum(request_counts.values()),
+        "requests_by_endpoint": dict(sorted(request_counts.items(), key=lambda item: -item[1])),
+    }
+
+
+def print_results(results):
+    for result in results:
+        print(
+            f"\n{result['scenario']:<8} {result['wall_time']:>9.3f}s "
+            f"{result['peak_memory_mb']:>9.2f} MB peak {result['requests']:>7} requests"
+        )
+        for endpoint, count in result["requests_by_endpoint"].items():
+            print(f"    {count:>7}  {endpoint}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--playlists", type=int, default=3)
+    parser.add_argument("--tracks", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--servers", type=int, default=0, help="extra mock servers the playlists are fanned out to")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of requests failing with 503 in an extra churn run")
+    parser.add_argument("--json", action="store_true", help="print the results as json")
+    parser.add_argument("--metrics", action="store_true", help="print the prometheus metrics recorded by the sync")
+    parser.add_argument("--profile", help="folder to write a trace and cProfile dump of every scenario to")
+    args = parser.parse_args()
+
+    os.environ["CACHE_DIRECTORY"] = tempfile.mkdtemp(prefix="syncuserplaylist-benchmark-")
+    sys.path.insert(0, os.path.join(TOOLS_DIRECTORY, "..", "syncuserplaylist"))
+    import logging
+    from contextlib import redirect_stdout
+    from plexapi.server import PlexServer
+    from utils import metrics
+    from utils import plexsession
+    from utils import tracing
+    from utils.cacheplaylist import register_fanout_server
+    from utils.multiserver import fan_out_playlists
+    from utils.plexsyncplaylist import sync_playlists
+
+    logging.disable(logging.INFO)
+    process, mock_url = start_mock_server(args)
+    fanout_mocks = [start_mock_server(args, fanout_index) for fanout_index in range(args.servers)]
+    mock_urls = [mock_url] + [fanout_url for _, fanout_url in fanout_mocks]
+    try:
+        playlist_list = [f"Playlist {index + 1}" for index in range(args.playlists)]
+        user_list = [f"user{user_id}" for user_id in range(2, args.users + 2)]
+
+        # the admin servers are made on the first run and reused like run.py does
+        servers = []
+
+        def sync():
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                if not servers:
+                    for server_url in mock_urls:
+                        session = mock_session(server_url, plexsession.new_session(max(10, args.concurrency)))
+                        servers.append(
+                            PlexServer(server_url, "admin-token", session=metrics.instrumented_session(session))
+                        )
+                    for fanout_plex in servers[1:]:
+                        register_fanout_server(fanout_plex)
+                if args.profile:
+                    tracing.start_cycle(profile=True)
+                try:
+                    # the same arguments run_sync in run.py passes with the default settings
+                    with tracing.profiled(), tracing.span("cycle"):
+                        results = sync_playlists(
+                            servers[0],
+                            playlist_list,
+                            user_list,
+                            True,
+                            False,
+                            args.concurrency,
+                            None,
+                            USER_TOKEN_TTL,
+                            USER_DIRECTORY_TTL,
+                            None,
+                            checkpoint=True
+                        )
+                        fan_out_playlists(
+                            servers[0],
+                            servers[1:],
+                            {playlist_key for playlist_key, _ in results},
+                            user_list,
+                            False,
+                            args.concurrency,
+                            USER_TOKEN_TTL,
+                            USER_DIRECTORY_TTL
+                        )
+                except plexsession.CircuitOpenError:
+                    pass
+                finally:
+                    tracing.finish_cycle(args.profile)
+
+        results = [
+            run_scenario("cold", mock_urls, sync),
+            run_scenario("settle", mock_urls, sync),
+            run_scenario("idle", mock_urls, sync),
+        ]
+        requests.post(f"{mock_url}/_mock/churn?percent=1")
+        results.append(run_scenario("churn", mock_urls, sync))
+        requests.post(f"{mock_url}/_mock/rescan?percent=1")
+        results.append(run_scenario("rescan", mock_urls, sync))
+        if args.error_rate:
+            requests.post(f"{mock_url}/_mock/churn?percent=1")
+            requests.post(f"{mock_url}/_mock/errors?rate={args.error_rate}")
+            results.append(run_scenario("flaky", mock_urls, sync))
+            requests.post(f"{mock_url}/_mock/errors?rate=0")
+    finally:
+        process.terminate()
+        for fanout_process, _ in fanout_mocks:
+            fanout_process.terminate()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+    if args.metrics:
+        print(metrics.render_metrics())
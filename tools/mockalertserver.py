@@ -0,0 +1,162 @@
+"""Local stand-in for the plex notifications websocket used to try the event sync mode without a plex server.
+
+Run from the repository root:
+
+    python tools/mockalertserver.py
+
+It starts the stand-in, connects the same listener used by SYNC_MODE=events, sends a burst of
+playlist notifications and prints the playlist rating keys handed out after the debounce period.
+"""
+import base64
+import hashlib
+import json
+import os
+import socketserver
+import struct
+import sys
+import threading
+from time import sleep
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+_clients = []
+_clients_lock = threading.Lock()
+
+
+class NotificationHandler(socketserver.BaseRequestHandler):
+    """Accepts a websocket handshake and keeps the connection open for broadcast notifications."""
+
+    def handle(self):
+        request = b""
+        while b"\r\n\r\n" not in request:
+            data = self.request.recv(1024)
+            if not data:
+                return
+            request += data
+        headers = dict(
+            line.split(": ", 1)
+            for line in request.decode("latin-1").split("\r\n")[1:]
+            if ": " in line
+        )
+        accept = base64.b64encode(
+            hashlib.sha1((headers["Sec-WebSocket-Key"] + WEBSOCKET_GUID).encode()).digest()
+        ).decode()
+        self.request.sendall(
+            (
+                "HTTP/1.1 101 Switching Protocols\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+            ).encode()
+        )
+        with _clients_lock:
+            _clients.append(self.request)
+        try:
+            while self.request.recv(1024):
+                pass
+        except OSError:
+            pass
+        finally:
+            with _clients_lock:
+                if self.request in _clients:
+                    _clients.remove(self.request)
+
+
+class NotificationServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def websocket_frame(message):
+    """Builds an unmasked websocket text frame.
+
+    Args:
+        message str: text to send
+
+    Returns:
+        bytes: the encoded frame.
+    """
+    payload = message.encode("utf-8")
+    if len(payload) < 126:
+        header = struct.pack("!BB", 0x81, len(payload))
+    elif len(payload) < 65536:
+        header = struct.pack("!BBH", 0x81, 126, len(payload))
+    else:
+        header = struct.pack("!BBQ", 0x81, 127, len(payload))
+    return header + payload
+
+
+def send_notification(notification):
+    """Sends a NotificationContainer to every connected listener.
+
+    Args:
+        notification dict: NotificationContainer contents
+    """
+    frame = websocket_frame(json.dumps({"NotificationContainer": notification}))
+    with _clients_lock:
+        for client in list(_clients):
+            client.sendall(frame)
+
+
+def playlist_notification(playlist_key):
+    """Builds the timeline notification plex sends when a playlist is edited.
+
+    Args:
+        playlist_key int: playlist rating key
+
+    Returns:
+        dict: NotificationContainer contents
+    """
+    return {
+        "type": "timeline",
+        "size": 1,
+        "TimelineEntry": [
+            {
+                "identifier": "com.plexapp.plugins.library",
+                "itemID": str(playlist_key),
+                "type": 15,
+                "state": 5,
+            }
+        ],
+    }
+
+
+def start_notification_server(port=0):
+    """Starts the stand-in websocket server in a background thread.
+
+    Args:
+        port int: port to listen on, 0 picks a free port
+
+    Returns:
+        obj: the running server, its port is server.server_address[1]
+    """
+    server = NotificationServer(("127.0.0.1", port), NotificationHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StandInPlexServer:
+    """The part of a PlexServer the alert listener needs to build the websocket url."""
+
+    def __init__(self, port):
+        self.port = port
+
+    def url(self, key, includeToken=False):
+        return f"http://127.0.0.1:{self.port}{key}"
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "syncuserplaylist"))
+    from utils.playlistevents import pop_changed_playlists, start_playlist_listener
+
+    server = start_notification_server()
+    listener = start_playlist_listener(StandInPlexServer(server.server_address[1]))
+    while not _clients:
+        sleep(0.05)
+    for playlist_key in (101, 102, 101):
+        send_notification(playlist_notification(playlist_key))
+    sleep(0.2)
+    print("before debounce:", pop_changed_playlists(1))
+    sleep(1)
+    print("after debounce:", pop_changed_playlists(1))
+    server.shutdown()
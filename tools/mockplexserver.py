@@ -0,0 +1,465 @@
+"""Offline stand-in for the plex server and plex.tv endpoints the sync uses.
+
+Run from the repository root:
+
+    python tools/mockplexserver.py --users 10 --playlists 5 --tracks 3000 --port 32500
+
+The server generates an admin account with the given number of audio playlists, a music library
+with enough tracks to fill them, and shared users that start without copies of the playlists.
+Requests are authenticated by the X-Plex-Token header: the admin uses admin-token and each user
+gets user-<id>-token through the shared_servers endpoint used by switchUser. The last
+--unshared-users users are friends of the admin that the server is not shared with, they have no token.
+Each mock server answers plex.tv for itself, --shared-servers lists the machine identifiers of the
+other mock servers so the user list says the users can use them too.
+
+Requests to https://plex.tv have to be sent to this server as well, see benchmark.py for a
+session that does this. Besides the plex endpoints the server answers:
+
+    GET  /_mock/stats            request count per endpoint since the last reset, as json
+    POST /_mock/stats/reset      clears the request counts
+    POST /_mock/churn?percent=1  replaces that percent of the tracks in every admin playlist
+    POST /_mock/errors?rate=0.1  answers that share of the plex requests with 503, 0 turns errors off
+    POST /_mock/rescan?percent=1 gives that percent of the playlist tracks new rating keys and drops them from playlists
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import xml.etree.ElementTree as ElementTree
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from urllib.parse import parse_qs, unquote, urlparse
+
+MACHINE_IDENTIFIER = "mockplexserver"
+ADMIN_TOKEN = "admin-token"
+LIBRARY_SECTION_ID = 1
+PLAYLIST_RATING_KEY_START = 1000000
+
+
+class MockPlexState:
+    """Library, playlists, users and request counts shared by every request handler."""
+
+    def __init__(
+        self,
+        users,
+        playlists,
+        tracks,
+        seed=0,
+        machine_identifier=MACHINE_IDENTIFIER,
+        key_offset=0,
+        unshared_users=0,
+        shared_servers=(),
+    ):
+        self.lock = threading.Lock()
+        self.machine_identifier = machine_identifier
+        self.shared_servers = [machine_identifier, *shared_servers]
+        self.random = random.Random(seed)
+        self.request_counts = Counter()
+        self.library_size = max(tracks * 2, 100)
+        self.tracks = {
+            number + key_offset: {
+                "ratingKey": str(number + key_offset),
+                "key": f"/library/metadata/{number + key_offset}",
+                "type": "track",
+                "title": f"Track {number}",
+                "grandparentTitle": f"Artist {number % 500}",
+                "grandparentRatingKey": str(self.library_size + 1 + number % 500),
+                "parentTitle": f"Album {number % 2000}",
+                "parentRatingKey": str(self.library_size + 1000 + number % 2000),
+                "librarySectionID": str(LIBRARY_SECTION_ID),
+                "duration": str(120000 + number % 240000),
+                "guid": f"plex://track/{number:024x}",
+            }
+            for number in range(1, self.library_size + 1)
+        }
+        self.users = {
+            user_id: {"id": str(user_id), "username": f"user{user_id}", "title": f"user{user_id}"}
+            for user_id in range(2, users + 2)
+        }
+        self.tokens = {ADMIN_TOKEN: "admin"}
+        self.shared_user_ids = set(list(self.users)[: max(0, users - unshared_users)])
+        self.tokens.update({f"user-{user_id}-token": str(user_id) for user_id in self.shared_user_ids})
+        self.playlists = {}
+        self.playlist_keys = itertools.count(PLAYLIST_RATING_KEY_START)
+        self.playlist_item_ids = itertools.count(1)
+        self.last_update = 0
+        self.error_rate = 0.0
+        self.track_keys = itertools.count(self.library_size + key_offset + 10000)
+        for index in range(playlists):
+            self.create_playlist(
+                "admin",
+                f"Playlist {index + 1}",
+                self.random.sample(range(1 + key_offset, self.library_size + 1 + key_offset), tracks),
+                summary=f"Mock playlist {index + 1}",
+            )
+
+    def touch(self, playlist):
+        self.last_update = max(int(time()), self.last_update + 1)
+        playlist["updatedAt"] = self.last_update
+
+    def create_playlist(self, owner, title, rating_keys, summary=""):
+        playlist = {
+            "ratingKey": next(self.playlist_keys),
+            "owner": owner,
+            "title": title,
+            "summary": summary,
+            "items": [(next(self.playlist_item_ids), int(rating_key)) for rating_key in rating_keys],
+        }
+        self.touch(playlist)
+        self.playlists[playlist["ratingKey"]] = playlist
+        return playlist
+
+    def churn(self, percent):
+        changed = 0
+        for playlist in self.playlists.values():
+            if playlist["owner"] != "admin":
+                continue
+            count = max(1, len(playlist["items"]) * percent // 100)
+            removed = set(self.random.sample(range(len(playlist["items"])), min(count, len(playlist["items"]))))
+            playlist["items"] = [item for index, item in enumerate(playlist["items"]) if index not in removed]
+            present = {rating_key for _, rating_key in playlist["items"]}
+            candidates = [rating_key for rating_key in self.tracks if rating_key not in present]
+            playlist["items"].extend(
+                (next(self.playlist_item_ids), rating_key)
+                for rating_key in self.random.sample(candidates, count)
+            )
+            self.touch(playlist)
+            changed += count
+        return changed
+
+    def rescan(self, percent):
+        in_playlists = sorted(
+            {rating_key for playlist in self.playlists.values() for _, rating_key in playlist["items"]}
+        )
+        count = max(1, len(in_playlists) * percent // 100)
+        rescanned = set(self.random.sample(in_playlists, min(count, len(in_playlists))))
+        for rating_key in rescanned:
+            new_rating_key = next(self.track_keys)
+            track = self.tracks.pop(rating_key)
+            self.tracks[new_rating_key] = dict(
+                track, ratingKey=str(new_rating_key), key=f"/library/metadata/{new_rating_key}"
+            )
+        for playlist in self.playlists.values():
+            items = [item for item in playlist["items"] if item[1] not in rescanned]
+            if len(items) != len(playlist["items"]):
+                playlist["items"] = items
+                self.touch(playlist)
+        return len(rescanned)
+
+
+def track_element(track, playlist_item_id=None, include_guids=False):
+    element = ElementTree.Element("Track", track)
+    if playlist_item_id is not None:
+        element.set("playlistItemID", str(playlist_item_id))
+    if include_guids:
+        mbid = track["guid"].rsplit("/", 1)[1][-12:]
+        ElementTree.SubElement(element, "Guid", {"id": f"mbid://00000000-0000-0000-0000-{mbid}"})
+    return element
+
+
+def user_element(user, state):
+    element = ElementTree.Element("User", user)
+    for machine_identifier in state.shared_servers:
+        if int(user["id"]) in state.shared_user_ids or machine_identifier != state.machine_identifier:
+            ElementTree.SubElement(element, "Server", {"machineIdentifier": machine_identifier, "name": machine_identifier})
+    return element
+
+
+def playlist_element(playlist):
+    return ElementTree.Element(
+        "Playlist",
+        {
+            "ratingKey": str(playlist["ratingKey"]),
+            "key": f"/playlists/{playlist['ratingKey']}/items",
+            "guid": f"com.plexapp.agents.none://{playlist['ratingKey']:032x}",
+            "type": "playlist",
+            "title": playlist["title"],
+            "summary": playlist["summary"],
+            "smart": "0",
+            "playlistType": "audio",
+            "leafCount": str(len(playlist["items"])),
+            "updatedAt": str(playlist["updatedAt"]),
+            "addedAt": str(playlist["updatedAt"]),
+        },
+    )
+
+
+class MockPlexHandler(BaseHTTPRequestHandler):
+    """Answers plex server and plex.tv requests from the shared MockPlexState."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_PUT(self):
+        self.route("PUT")
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+    def send_body(self, body, content_type="text/xml", status=200):
+        if isinstance(body, ElementTree.Element):
+            body = ElementTree.tostring(body, encoding="utf-8")
+        elif isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def container(self, children=(), **attributes):
+        element = ElementTree.Element(
+            "MediaContainer", {key: str(value) for key, value in attributes.items()}
+        )
+        element.set("size", str(len(children)))
+        element.extend(children)
+        return element
+
+    def route(self, method):
+        url = urlparse(self.path)
+        path, query = unquote(url.path), parse_qs(url.query)
+        if path.startswith("/_mock/"):
+            return self.mock_control(method, path, query)
+        endpoint = re.sub(r"(?<=/)\d+(,\d+)*(?=/|$)", "{id}", path.rstrip("/") or "/")
+        state = self.state
+        with state.lock:
+            state.request_counts[f"{method} {endpoint}"] += 1
+        owner = state.tokens.get(self.headers.get("X-Plex-Token") or query.get("X-Plex-Token", [None])[0])
+        if owner is None:
+            return self.send_body("Unauthorized", "text/plain", 401)
+        with state.lock:
+            failed = state.error_rate and state.random.random() < state.error_rate
+        if failed:
+            return self.send_body("Service Unavailable", "text/plain", 503)
+        with state.lock:
+            response = self.plex_response(method, path, query, owner)
+        if response is None:
+            return self.send_body("Not Found", "text/plain", 404)
+        self.send_body(response)
+
+    def mock_control(self, method, path, query):
+        state = self.state
+        with state.lock:
+            if path == "/_mock/stats":
+                body = json.dumps(dict(state.request_counts))
+            elif path == "/_mock/stats/reset":
+                state.request_counts.clear()
+                body = "{}"
+            elif path == "/_mock/churn":
+                body = json.dumps({"changed": state.churn(int(query.get("percent", ["1"])[0]))})
+            elif path == "/_mock/rescan":
+                body = json.dumps({"changed": state.rescan(int(query.get("percent", ["1"])[0]))})
+            elif path == "/_mock/errors":
+                state.error_rate = float(query.get("rate", ["0"])[0])
+                body = json.dumps({"rate": state.error_rate})
+            else:
+                return self.send_body("Not Found", "text/plain", 404)
+        self.send_body(body, "application/json")
+
+    def paged(self, query, elements):
+        start = int(self.headers.get("X-Plex-Container-Start") or query.get("X-Plex-Container-Start", ["0"])[0])
+        size = self.headers.get("X-Plex-Container-Size") or query.get("X-Plex-Container-Size", [None])[0]
+        end = len(elements) if size is None else start + int(size)
+        return elements[start:end], len(elements)
+
+    def plex_response(self, method, path, query, owner):
+        state = self.state
+        parts = [part for part in path.split("/") if part]
+
+        if path == "/" and method == "GET":
+            return self.container(
+                machineIdentifier=state.machine_identifier,
+                friendlyName="Mock Plex Server",
+                version="1.40.0.0000",
+                myPlex=1,
+                myPlexUsername="admin",
+            )
+        if path == "/api/v2/user":
+            user = ElementTree.Element(
+                "user",
+                {
+                    "id": "1",
+                    "uuid": "mockadmin",
+                    "username": "admin",
+                    "title": "admin",
+                    "email": "admin@example.com",
+                    "authToken": ADMIN_TOKEN,
+                    "scrobbleTypes": "1",
+                },
+            )
+            ElementTree.SubElement(user, "subscription", {"active": "1", "status": "Active"})
+            ElementTree.SubElement(user, "profile", {"autoSelectAudio": "1"})
+            return user
+        if path.rstrip("/") == "/api/users":
+            return self.container([user_element(user, state) for user in state.users.values()])
+        if len(parts) == 4 and parts[:2] == ["api", "servers"] and parts[3] == "shared_servers":
+            return self.container(
+                [
+                    ElementTree.Element(
+                        "SharedServer",
+                        {"userID": user_id, "accessToken": token, "username": state.users[int(user_id)]["username"]},
+                    )
+                    for token, user_id in state.tokens.items()
+                    if user_id != "admin"
+                ]
+            )
+        if parts[:2] == ["library", "metadata"] and len(parts) == 3 and method == "GET":
+            tracks = [
+                track_element(state.tracks[int(rating_key)])
+                for rating_key in parts[2].split(",")
+                if int(rating_key) in state.tracks
+            ]
+            tracks, total = self.paged(query, tracks)
+            return self.container(tracks, totalSize=total, librarySectionID=LIBRARY_SECTION_ID)
+        if parts == ["library", "sections"] and method == "GET":
+            return self.container(
+                [ElementTree.Element("Directory", {"key": str(LIBRARY_SECTION_ID), "type": "artist", "title": "Music"})]
+            )
+        if parts == ["library", "sections", str(LIBRARY_SECTION_ID), "all"] and method == "GET":
+            include_guids = query.get("includeGuids", ["0"])[0] == "1"
+            tracks = [track_element(track, include_guids=include_guids) for track in state.tracks.values()]
+            tracks, total = self.paged(query, tracks)
+            return self.container(tracks, totalSize=total, librarySectionID=LIBRARY_SECTION_ID)
+        if parts == ["playlists"]:
+            if method == "POST":
+                rating_keys = query["uri"][0].rsplit("/", 1)[1].split(",")
+                playlist = state.create_playlist(owner, query["title"][0], rating_keys)
+                return self.container([playlist_element(playlist)])
+            playlists = [
+                playlist_element(playlist)
+                for playlist in state.playlists.values()
+                if playlist["owner"] == owner
+                and ("title" not in query or query["title"][0].lower() in playlist["title"].lower())
+            ]
+            return self.container(playlists)
+        if parts[:1] == ["playlists"] and len(parts) >= 2:
+            playlist = state.playlists.get(int(parts[1]))
+            if playlist is None or playlist["owner"] != owner:
+                return None
+            if len(parts) == 2:
+                if method == "PUT":
+                    for field in ("title", "summary"):
+                        if f"{field}.value" in query:
+                            playlist[field] = query[f"{field}.value"][0]
+                    state.touch(playlist)
+                elif method == "DELETE":
+                    del state.playlists[playlist["ratingKey"]]
+                    return self.container()
+                return self.container([playlist_element(playlist)])
+            if len(parts) == 3 and parts[2] == "items":
+                if method == "PUT":
+                    rating_keys = query["uri"][0].rsplit("/", 1)[1].split(",")
+                    playlist["items"].extend(
+                        (next(state.playlist_item_ids), int(rating_key)) for rating_key in rating_keys
+                    )
+                    state.touch(playlist)
+                    return self.container([playlist_element(playlist)])
+                items = [
+                    track_element(state.tracks[rating_key], playlist_item_id)
+                    for playlist_item_id, rating_key in playlist["items"]
+                ]
+                items, total = self.paged(query, items)
+                return self.container(items, totalSize=total, leafCount=total, ratingKey=playlist["ratingKey"])
+            if len(parts) >= 4 and parts[2] == "items":
+                playlist_item_id = int(parts[3])
+                index = next(
+                    (index for index, item in enumerate(playlist["items"]) if item[0] == playlist_item_id), None
+                )
+                if index is None:
+                    return None
+                if method == "DELETE" and len(parts) == 4:
+                    del playlist["items"][index]
+                elif method == "PUT" and parts[4:] == ["move"]:
+                    item = playlist["items"].pop(index)
+                    after = query.get("after", [None])[0]
+                    position = 0
+                    if after is not None:
+                        position = 1 + next(
+                            index for index, other in enumerate(playlist["items"]) if other[0] == int(after)
+                        )
+                    playlist["items"].insert(position, item)
+                else:
+                    return None
+                state.touch(playlist)
+                return self.container([playlist_element(playlist)])
+        return None
+
+
+def start_mock_plex_server(
+    users,
+    playlists,
+    tracks,
+    port=0,
+    seed=0,
+    machine_identifier=MACHINE_IDENTIFIER,
+    key_offset=0,
+    unshared_users=0,
+    shared_servers=(),
+):
+    """Starts the mock plex server in a background thread.
+
+    Args:
+        users int: number of shared users
+        playlists int: number of admin playlists
+        tracks int: number of tracks in each playlist
+        port int: port to listen on, 0 picks a free port
+        seed int: seed for the generated playlists
+        machine_identifier str: machine identifier the server reports
+        key_offset int: added to every track rating key, so servers with the same tracks use different rating keys
+        unshared_users int: number of the users the server is not shared with
+        shared_servers list: machine identifiers of the other servers shared with every user
+
+    Returns:
+        obj: the running server, its port is server.server_address[1]
+    """
+    state = MockPlexState(
+        users, playlists, tracks, seed, machine_identifier, key_offset, unshared_users, shared_servers
+    )
+    handler = type("Handler", (MockPlexHandler,), {"state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--playlists", type=int, default=3)
+    parser.add_argument("--tracks", type=int, default=500)
+    parser.add_argument("--port", type=int, default=32500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--machine-identifier", default=MACHINE_IDENTIFIER)
+    parser.add_argument("--key-offset", type=int, default=0)
+    parser.add_argument("--unshared-users", type=int, default=0)
+    parser.add_argument("--shared-servers", default="")
+    args = parser.parse_args()
+    server = start_mock_plex_server(
+        args.users,
+        args.playlists,
+        args.tracks,
+        args.port,
+        args.seed,
+        args.machine_identifier,
+        args.key_offset,
+        args.unshared_users,
+        [machine_identifier for machine_identifier in args.shared_servers.split(",") if machine_identifier],
+    )
+    print(f"Mock plex server listening on http://127.0.0.1:{server.server_address[1]}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()